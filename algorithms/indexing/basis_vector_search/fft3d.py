@@ -3,6 +3,8 @@
 import logging
 import math
 
+import numpy as np
+
 from cctbx import crystal, uctbx, xray
 from libtbx import libtbx, phil
 from scitbx import fftpack, matrix
@@ -16,6 +18,15 @@
 
 logger = logging.getLogger(__name__)
 
+# Grids kept between calls if reuse_grids=True, keyed by the gridding. Only the
+# grid for the most recent gridding is kept, until clear_grid_cache() is called.
+_grid_cache = {}
+
+
+def clear_grid_cache():
+    """Release the grid kept between calls if reuse_grids=True."""
+    _grid_cache.clear()
+
 
 fft3d_phil_str = """\
 b_iso = Auto
@@ -30,6 +41,13 @@
 peak_volume_cutoff = 0.15
     .type = float
     .expert_level = 2
+reuse_grids = False
+    .type = bool
+    .help = "Keep the reciprocal space grid allocated between calls, to avoid "
+            "reallocating it for repeated indexing attempts with the same "
+            "gridding, e.g. when processing many stills. The grid for the most "
+            "recent gridding is kept until clear_grid_cache() is called."
+    .expert_level = 2
 reciprocal_space_grid {
     n_points = 256
         .type = int(value_min=0)
@@ -201,23 +219,48 @@ def _fft(self, reciprocal_lattice_vectors, d_min):
         # (512**3)*8*2*bytes_to_gb
         # 2.0
 
-        fft = fftpack.complex_to_complex_3d(self._gridding)
-        grid_complex = flex.complex_double(
-            reals=reciprocal_space_grid,
-            imags=flex.double(reciprocal_space_grid.size(), 0),
-        )
-        grid_transformed = fft.forward(grid_complex)
-        grid_real = flex.pow2(flex.real(grid_transformed))
-        del grid_transformed
+        # The reciprocal space grid is real, so use a real-to-complex FFT, which
+        # only computes the half of the transform with the last index k <= n/2.
+        # The rest follows from the Hermitian symmetry F(-h) = F*(h), so the
+        # peak search works on this half grid. The transform is done one axis
+        # at a time, so that no more than two grids are held at once.
+        grid = reciprocal_space_grid.as_numpy_array()
+        del reciprocal_space_grid
+        grid_half = np.fft.rfft(grid, axis=2)
+        del grid
+        grid_half = np.fft.fft(grid_half, axis=1)
+        grid_half = np.fft.fft(grid_half, axis=0)
+
+        # Square the real part in place in the complex buffer
+        grid_real = grid_half.real
+        np.square(grid_real, out=grid_real)
 
         return grid_real, used_in_indexing
 
+    def _get_grid(self, name, allocate):
+        """Get a grid, reusing a previously allocated grid if reuse_grids=True."""
+        if not self._params.reuse_grids:
+            return allocate()
+        key = (name, self._gridding)
+        if key not in _grid_cache:
+            # Release any grids kept for a different gridding
+            for other in [k for k in _grid_cache if k[1] != self._gridding]:
+                del _grid_cache[other]
+            _grid_cache[key] = allocate()
+        return _grid_cache[key]
+
     def _map_centroids_to_reciprocal_space_grid(
         self, reciprocal_lattice_vectors, d_min
     ):
         logger.info("FFT gridding: (%i,%i,%i)" % self._gridding)
 
-        grid = flex.double(flex.grid(self._gridding), 0)
+        if self._params.reuse_grids:
+            grid = self._get_grid(
+                "reciprocal", lambda: flex.double(flex.grid(self._gridding), 0)
+            )
+            grid.fill(0)
+        else:
+            grid = flex.double(flex.grid(self._gridding), 0)
 
         if self._params.b_iso is libtbx.Auto:
             self._params.b_iso = -4 * d_min ** 2 * math.log(0.05)
@@ -233,19 +276,8 @@ def _map_centroids_to_reciprocal_space_grid(
         return grid, used_in_indexing
 
     def _find_peaks(self, grid_real, d_min):
-        grid_real_binary = grid_real.deep_copy()
-        rmsd = math.sqrt(
-            flex.mean(
-                flex.pow2(
-                    grid_real_binary.as_1d() - flex.mean(grid_real_binary.as_1d())
-                )
-            )
-        )
-        grid_real_binary.set_selected(
-            grid_real_binary < (self._params.rmsd_cutoff) * rmsd, 0
-        )
-        grid_real_binary.as_1d().set_selected(grid_real_binary.as_1d() > 0, 1)
-        grid_real_binary = grid_real_binary.iround()
+        """Find the peaks in the half grid returned by _fft."""
+        grid_real_binary = self._threshold(grid_real)
         from cctbx import masks
 
         # real space FFT grid dimensions
@@ -282,3 +314,40 @@ def _find_peaks(self, grid_real, d_min):
         sites = flood_fill.centres_of_mass_frac().select(isel)
         volumes = flood_fill.grid_points_per_void().select(isel)
         return sites, volumes
+
+    def _threshold(self, grid_real):
+        """Threshold the half grid returned by _fft into the full binary grid."""
+        n = self._gridding[2]
+        n_half = grid_real.shape[2]
+        # The weight of each plane of constant k in the full grid: the planes
+        # 0 < k < n - n_half + 1 appear twice, once mirrored
+        weights = np.ones(n_half)
+        weights[1 : n - n_half + 1] = 2
+        n0, n1 = grid_real.shape[:2]
+        n_total = n0 * n1 * n
+
+        # Accumulate the mean and rmsd plane by plane, to avoid temporary grids
+        mean = sum(plane.dot(weights).sum() for plane in grid_real) / n_total
+        rmsd = math.sqrt(
+            sum(np.square(plane - mean).dot(weights).sum() for plane in grid_real)
+            / n_total
+        )
+        cutoff = self._params.rmsd_cutoff * rmsd
+
+        # Set the grid points above the cutoff, and their mirrors, straight into
+        # the binary grid for the flood fill
+        grid_real_binary = flex.int(flex.grid(self._gridding), 0)
+        for i, plane in enumerate(grid_real):
+            sel = plane >= cutoff
+            if cutoff <= 0:
+                sel &= plane > 0
+            j, k = np.nonzero(sel)
+            mirror = (k > 0) & (k <= n - n_half)
+            i_full = np.concatenate(
+                (np.full(j.size, i), np.full(mirror.sum(), -i % n0))
+            )
+            j_full = np.concatenate((j, -j[mirror] % n1))
+            k_full = np.concatenate((k, n - k[mirror]))
+            isel = (i_full * n1 + j_full) * n + k_full
+            grid_real_binary.as_1d().set_selected(flex.size_t(isel.astype(int)), 1)
+        return grid_real_binary
@@ -1,17 +1,22 @@
 from __future__ import absolute_import, division, print_function
 
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 from scitbx import lbfgs
 from scitbx.array_family import flex
 
+from .utils import cosine_sums
 
-def optimise_basis_vectors(reciprocal_lattice_points, vectors):
-    optimised = flex.vec3_double()
-    for vector in vectors:
-        minimised = BasisVectorMinimiser(reciprocal_lattice_points, vector)
-        optimised.append(tuple(minimised.x))
-    functionals = flex.double(minimised.target.compute_functional(v) for v in vectors)
+
+def optimise_basis_vectors(reciprocal_lattice_points, vectors, nproc=1):
+    if not len(vectors):
+        return flex.vec3_double()
+    minimised = BasisVectorsMinimiser(reciprocal_lattice_points, vectors, nproc=nproc)
+    optimised = flex.vec3_double(minimised.x)
+    functionals = flex.double(
+        -cosine_sums(vectors, reciprocal_lattice_points, nproc=nproc)
+    )
     perm = flex.sort_permutation(functionals)
     optimised = optimised.select(perm)
     return optimised
@@ -64,3 +69,61 @@ def __init__(
     def compute_functional_and_gradients(self):
         f, g = self.target.compute_functional_and_gradients(tuple(self.x))
         return f, g
+
+
+class BasisVectorsMinimiser(object):
+    """Minimise the target for several basis vectors.
+
+    Each vector is minimised independently by its own LBFGS run, with the same
+    convergence criteria as BasisVectorMinimiser. The functionals and gradients
+    are evaluated with cosine_sums, which releases the GIL, so that the runs
+    may be shared between nproc threads.
+    """
+
+    def __init__(
+        self,
+        reciprocal_lattice_points,
+        vectors,
+        nproc=1,
+        lbfgs_termination_params=None,
+        lbfgs_core_params=lbfgs.core_parameters(m=20),
+    ):
+        self.reciprocal_lattice_points = reciprocal_lattice_points
+        points = reciprocal_lattice_points.as_numpy_array()
+        self.minimisers = [_VectorMinimiser(points, vector) for vector in vectors]
+
+        def run(minimiser):
+            minimiser.minimizer = lbfgs.run(
+                target_evaluator=minimiser,
+                termination_params=lbfgs_termination_params,
+                core_params=lbfgs_core_params,
+            )
+
+        if nproc > 1 and len(self.minimisers) > 1:
+            with ThreadPoolExecutor(
+                max_workers=min(nproc, len(self.minimisers))
+            ) as pool:
+                list(pool.map(run, self.minimisers))
+        else:
+            for minimiser in self.minimisers:
+                run(minimiser)
+
+        self.x = flex.double()
+        for minimiser in self.minimisers:
+            self.x.extend(minimiser.x)
+        self.n = len(self.x)
+
+
+class _VectorMinimiser(object):
+    """The LBFGS target evaluator for one of the vectors of a
+    BasisVectorsMinimiser."""
+
+    def __init__(self, points, vector):
+        self._points = points
+        self.x = flex.double(tuple(vector))
+        self.n = len(self.x)
+        assert self.n == 3
+
+    def compute_functional_and_gradients(self):
+        f, g = cosine_sums([tuple(self.x)], self._points, gradients=True)
+        return -f[0], flex.double(tuple(-g[0]))
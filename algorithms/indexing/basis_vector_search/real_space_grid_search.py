@@ -3,6 +3,8 @@
 import logging
 import math
 
+import numpy as np
+
 from libtbx import phil
 from rstbx.array_family import (
     flex,  # required to load scitbx::af::shared<rstbx::Direction> to_python converter
@@ -13,7 +15,7 @@
 from dials.algorithms.indexing import DialsIndexError
 
 from .strategy import Strategy
-from .utils import group_vectors
+from .utils import cosine_sums, group_vectors
 
 logger = logging.getLogger(__name__)
 
@@ -36,13 +38,16 @@ class RealSpaceGridSearch(Strategy):
 
     phil_scope = phil.parse(real_space_grid_search_phil_str)
 
-    def __init__(self, max_cell, target_unit_cell, params=None, *args, **kwargs):
+    def __init__(
+        self, max_cell, target_unit_cell, params=None, nproc=1, *args, **kwargs
+    ):
         """Construct a real_space_grid_search object.
 
         Args:
             max_cell (float): An estimate of the maximum cell dimension of the primitive
                 cell.
             target_unit_cell (cctbx.uctbx.unit_cell): The target unit cell.
+            nproc (int): The number of threads to use to score the search vectors.
         """
         super(RealSpaceGridSearch, self).__init__(
             max_cell, params=params, *args, **kwargs
@@ -52,6 +57,7 @@ def __init__(self, max_cell, target_unit_cell, params=None, *args, **kwargs):
                 "Target unit cell must be provided for real_space_grid_search"
             )
         self._target_unit_cell = target_unit_cell
+        self._nproc = nproc
 
     @property
     def search_directions(self):
@@ -97,13 +103,15 @@ def score_vectors(self, reciprocal_lattice_vectors):
         Returns:
             A tuple containing the list of search vectors and their scores.
         """
-        vectors = flex.vec3_double()
-        scores = flex.double()
-        for i, v in enumerate(self.search_vectors):
-            f = self.compute_functional(v.elems, reciprocal_lattice_vectors)
-            vectors.append(v.elems)
-            scores.append(f)
-        return vectors, scores
+        directions = np.array([d.elems for d in self.search_directions])
+        lengths = np.array(list(set(self._target_unit_cell.parameters()[:3])))
+        # in the same order as search_vectors
+        vectors = (directions[:, np.newaxis, :] * lengths[:, np.newaxis]).reshape(-1, 3)
+        scores = cosine_sums(vectors, reciprocal_lattice_vectors, nproc=self._nproc)
+        return (
+            flex.vec3_double(flex.double(np.ascontiguousarray(vectors).ravel())),
+            flex.double(scores),
+        )
 
     def find_basis_vectors(self, reciprocal_lattice_vectors):
         """Find a list of likely basis vectors.
@@ -29,6 +29,18 @@ def test_optimise_basis_vectors(setup_rlp):
     optimised = optimise.optimise_basis_vectors(rlp, basis_vectors)
     assert len(optimised) == len(basis_vectors)
 
+    # Minimising the vectors in threads finds the same minima, as each vector
+    # still converges independently
+    minimised = optimise.BasisVectorsMinimiser(rlp, basis_vectors, nproc=2)
+    for i, v in enumerate(basis_vectors):
+        expected = optimise.BasisVectorMinimiser(rlp, v)
+        assert list(minimised.x[3 * i : 3 * i + 3]) == pytest.approx(
+            list(expected.x), abs=1e-4
+        )
+        assert minimised.minimisers[i].minimizer.iter() == pytest.approx(
+            expected.minimizer.iter(), abs=1
+        )
+
 
 def _gradient_fd(target, vector, eps=1e-6):
     grads = []
@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function
 
+import math
+
 import pytest
 
-from . import FFT1D, FFT3D, RealSpaceGridSearch
+from scitbx import fftpack
+from scitbx.array_family import flex
+
+from . import FFT1D, FFT3D, RealSpaceGridSearch, fft3d
 
 
 class TestStrategies(object):
@@ -27,6 +32,64 @@ def test_fft3d(self, setup_rlp):
         basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
         self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
 
+    def test_fft3d_real_to_complex(self, setup_rlp):
+        max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
+        params = FFT3D.phil_scope.extract()
+        params.reciprocal_space_grid.n_points = 30
+        strategy = FFT3D(max_cell, params=params)
+        d_min = 5 * max_cell / 30
+        grid_half, _ = strategy._fft(setup_rlp["rlp"], d_min)
+
+        # Compare with the half of the full complex-to-complex transform
+        grid, _ = strategy._map_centroids_to_reciprocal_space_grid(
+            setup_rlp["rlp"], d_min
+        )
+        fft = fftpack.complex_to_complex_3d(grid.all())
+        transformed = fft.forward(
+            flex.complex_double(reals=grid, imags=flex.double(grid.size(), 0))
+        )
+        grid_real = flex.pow2(flex.real(transformed))
+        expected = grid_real.as_numpy_array()[:, :, : grid_half.shape[2]]
+        assert list(grid_half.ravel()) == pytest.approx(
+            list(expected.ravel()), rel=1e-6, abs=1e-6
+        )
+
+        # Thresholding the half grid matches thresholding the full grid
+        rmsd = math.sqrt(
+            flex.mean(flex.pow2(grid_real.as_1d() - flex.mean(grid_real.as_1d())))
+        )
+        expected = grid_real.deep_copy()
+        expected.set_selected(expected < params.rmsd_cutoff * rmsd, 0)
+        expected.as_1d().set_selected(expected.as_1d() > 0, 1)
+        binary = strategy._threshold(grid_half)
+        assert binary.all() == grid_real.all()
+        assert list(binary) == list(expected.iround())
+
+        # Reusing the grids gives the same basis vectors
+        params = FFT3D.phil_scope.extract()
+        params.reuse_grids = True
+        for i in range(2):
+            strategy = FFT3D(max_cell, params=params)
+            basis_vectors, used = strategy.find_basis_vectors(setup_rlp["rlp"])
+            self.check_results(setup_rlp["crystal_symmetry"].unit_cell(), basis_vectors)
+        assert fft3d._grid_cache
+        fft3d.clear_grid_cache()
+        assert not fft3d._grid_cache
+
+    def test_real_space_grid_search_scores(self, setup_rlp):
+        max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
+        strategy = RealSpaceGridSearch(
+            max_cell, target_unit_cell=setup_rlp["crystal_symmetry"].unit_cell()
+        )
+        vectors, scores = strategy.score_vectors(setup_rlp["rlp"])
+        search_vectors = list(strategy.search_vectors)
+        assert len(vectors) == len(scores) == len(search_vectors)
+        for i in range(0, len(search_vectors), 97):
+            assert vectors[i] == pytest.approx(search_vectors[i].elems)
+            assert scores[i] == pytest.approx(
+                strategy.compute_functional(vectors[i], setup_rlp["rlp"])
+            )
+
     def test_real_space_grid_search(self, setup_rlp):
         max_cell = 1.3 * max(setup_rlp["crystal_symmetry"].unit_cell().parameters()[:3])
         strategy = RealSpaceGridSearch(
@@ -1,9 +1,13 @@
 from __future__ import absolute_import, division, print_function
 
+import math
+
 import pytest
 
 from scitbx import matrix
+from scitbx.array_family import flex
 
+from . import utils
 from .utils import group_vectors, is_approximate_integer_multiple, vector_group
 
 
@@ -49,3 +53,26 @@ def test_group_vectors():
     assert len(groups) == 1
     groups[0].mean.elems == pytest.approx((12.1, 13.1, 14.1))
     groups[0].weights == [1, 2, 3]
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_cosine_sums(monkeypatch, nproc):
+    # Use small blocks and tiles to test the accumulation over them
+    monkeypatch.setattr(utils, "VECTOR_BLOCK_SIZE", 4)
+    monkeypatch.setattr(utils, "TILE_SIZE", 4 * 7)
+    points = flex.vec3_double(flex.random_double(3 * 50) - 0.5)
+    vectors = [matrix.col(v) for v in flex.vec3_double(flex.random_double(30) * 50)]
+
+    f, g = utils.cosine_sums(vectors, points, gradients=True, nproc=nproc)
+    assert list(utils.cosine_sums(vectors, points, nproc=nproc)) == pytest.approx(
+        list(f)
+    )
+    for v, f_v, g_v in zip(vectors, f, g):
+        assert f_v == pytest.approx(
+            flex.sum(flex.cos(2 * math.pi * points.dot(v.elems)))
+        )
+        g_expected = [
+            -flex.sum(2 * math.pi * p * flex.sin(2 * math.pi * points.dot(v.elems)))
+            for p in points.parts()
+        ]
+        assert list(g_v) == pytest.approx(g_expected)
@@ -1,6 +1,18 @@
 from __future__ import absolute_import, division, print_function
 
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
 from scitbx import matrix
+from scitbx.array_family import flex
+
+# The number of vectors, and the number of elements of the vectors x reciprocal
+# lattice points matrix, evaluated at a time by cosine_sums, chosen so that the
+# intermediate arrays fit comfortably in cache
+VECTOR_BLOCK_SIZE = 64
+TILE_SIZE = 2 ** 16
 
 
 def is_approximate_integer_multiple(
@@ -89,3 +101,62 @@ def group_vectors(
             vector_groups.append(group)
 
     return vector_groups
+
+
+def _as_vec3_array(vectors):
+    if isinstance(vectors, flex.vec3_double):
+        return vectors.as_numpy_array()
+    if isinstance(vectors, np.ndarray):
+        return np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    return np.array([tuple(v) for v in vectors], dtype=np.float64).reshape(-1, 3)
+
+
+def cosine_sums(vectors, reciprocal_lattice_vectors, gradients=False, nproc=1):
+    """Compute the sum of cos(2 pi s.v) over the reciprocal lattice vectors s
+    for each vector v.
+
+    The vectors are evaluated in blocks, and the reciprocal lattice vectors in
+    tiles, so that each step is a small matrix product. The blocks of vectors are
+    shared between nproc threads.
+
+    Args:
+        vectors: The vectors v, as a scitbx.array_family.flex.vec3_double, a
+            numpy array of shape (n, 3) or a list of vectors.
+        reciprocal_lattice_vectors: The reciprocal lattice vectors s, in any of
+            the same forms.
+        gradients (bool): Also compute the gradients of the sums with respect to
+            the vectors.
+        nproc (int): The number of threads to use.
+
+    Returns:
+        A numpy array of the sums for each vector, and if gradients is True, a
+        numpy array of shape (n, 3) of the gradients.
+    """
+    vectors = _as_vec3_array(vectors)
+    points = 2 * math.pi * _as_vec3_array(reciprocal_lattice_vectors)
+    tile = max(1, TILE_SIZE // VECTOR_BLOCK_SIZE)
+
+    def _block(start):
+        v = vectors[start : start + VECTOR_BLOCK_SIZE]
+        f = np.zeros(len(v))
+        g = np.zeros(v.shape) if gradients else None
+        for i in range(0, len(points), tile):
+            s = points[i : i + tile]
+            two_pi_S_dot_v = np.dot(v, s.T)
+            f += np.cos(two_pi_S_dot_v).sum(axis=1)
+            if gradients:
+                g -= np.dot(np.sin(two_pi_S_dot_v), s)
+        return f, g
+
+    starts = range(0, len(vectors), VECTOR_BLOCK_SIZE)
+    if nproc > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=nproc) as pool:
+            results = list(pool.map(_block, starts))
+    else:
+        results = [_block(start) for start in starts]
+
+    f = np.concatenate([r[0] for r in results]) if results else np.zeros(0)
+    if not gradients:
+        return f
+    g = np.concatenate([r[1] for r in results]) if results else np.zeros((0, 3))
+    return f, g
@@ -1,9 +1,10 @@
 from __future__ import absolute_import, division, print_function
 
-import concurrent.futures
 import copy
 import logging
 import math
+import multiprocessing
+import time
 
 import libtbx
 import libtbx.phil
@@ -12,6 +13,7 @@
 from cctbx.crystal_orientation import crystal_orientation
 from cctbx.sgtbx import bravais_types
 from dxtbx.model import Crystal
+from dxtbx.model.experiment_list import Experiment, ExperimentList
 from libtbx.introspection import number_of_processors
 from rstbx.dps_core.lepage import iotbx_converter
 from rstbx.symmetry.subgroup import MetricSubgroup
@@ -242,17 +244,23 @@ def refined_settings_from_refined_triclinic(experiments, reflections, params):
             constrain_orient, space_group
         )
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=params.nproc) as pool:
-        for i, result in enumerate(
-            pool.map(
-                refine_subgroup,
-                (
-                    (params, subgroup, used_reflections, experiments)
-                    for subgroup in refined_settings
-                ),
-            )
-        ):
-            refined_settings[i] = result
+    # The reflections and experiments are the same for every subgroup, so hand
+    # them to each worker once when it starts and send only the subgroups
+    initargs = (params, used_reflections, experiments)
+    if params.nproc > 1:
+        with multiprocessing.Pool(
+            processes=params.nproc,
+            initializer=_init_subgroup_worker,
+            initargs=initargs,
+        ) as pool:
+            results = pool.map(_refine_subgroup_in_worker, refined_settings, 1)
+    else:
+        _init_subgroup_worker(*initargs)
+        results = [_refine_subgroup_in_worker(s) for s in refined_settings]
+    _init_subgroup_worker(None, None, None)
+    for i, (result, elapsed) in enumerate(results):
+        logger.debug("Refined %s setting in %.2fs", result["bravais"], elapsed)
+        refined_settings[i] = result
 
     identify_likely_solutions(refined_settings)
     return refined_settings
@@ -289,6 +297,42 @@ def identify_likely_solutions(all_solutions):
         solution.recommended = True
 
 
+# The data shared by all subgroup refinements in a worker process, set by
+# _init_subgroup_worker
+_subgroup_worker_data = None
+
+
+def _init_subgroup_worker(params, used_reflections, experiments):
+    global _subgroup_worker_data
+    _subgroup_worker_data = (params, used_reflections, experiments)
+
+
+def _refine_subgroup_in_worker(subgroup):
+    params, used_reflections, experiments = _subgroup_worker_data
+    st = time.time()
+    # refine_subgroup modifies the outlier rejection parameters and refines the
+    # experimental models in place, so give each subgroup its own copies as if
+    # they had been pickled separately
+    experiments = ExperimentList(
+        [
+            Experiment(
+                imageset=expt.imageset,
+                beam=copy.deepcopy(expt.beam),
+                detector=copy.deepcopy(expt.detector),
+                goniometer=copy.deepcopy(expt.goniometer),
+                scan=copy.deepcopy(expt.scan),
+                crystal=expt.crystal,
+                identifier=expt.identifier,
+            )
+            for expt in experiments
+        ]
+    )
+    result = refine_subgroup(
+        (copy.deepcopy(params), subgroup, used_reflections, experiments)
+    )
+    return result, time.time() - st
+
+
 def refine_subgroup(args):
     assert len(args) == 4
     params, subgroup, used_reflections, experiments = args
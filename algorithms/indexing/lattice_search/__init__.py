@@ -1,8 +1,11 @@
 from __future__ import absolute_import, division, print_function
 
+import copy
 import itertools
 import logging
 import math
+import multiprocessing
+import time
 
 import pkg_resources
 from six.moves import cStringIO as StringIO
@@ -187,24 +190,27 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
 
         args = []
 
+        sel = self.reflections["id"] == -1
+        if self.d_min is not None:
+            sel &= 1 / self.reflections["rlp"].norms() > self.d_min
+        xo, yo, zo = self.reflections["xyzobs.mm.value"].parts()
+        imageset_id = self.reflections["imageset_id"]
+        for i_expt, expt in enumerate(self.experiments):
+            # XXX Not sure if we still need this loop over self.experiments
+            if expt.scan is not None:
+                start, end = expt.scan.get_oscillation_range()
+                if (end - start) > 360:
+                    # only use reflections from the first 360 degrees of the scan
+                    sel.set_selected(
+                        (imageset_id == i_expt)
+                        & (zo > ((start * math.pi / 180) + 2 * math.pi)),
+                        False,
+                    )
+        reflections = self.reflections.select(sel)
+
         for cm in candidate_orientation_matrices:
-            sel = self.reflections["id"] == -1
-            if self.d_min is not None:
-                sel &= 1 / self.reflections["rlp"].norms() > self.d_min
-            xo, yo, zo = self.reflections["xyzobs.mm.value"].parts()
-            imageset_id = self.reflections["imageset_id"]
             experiments = ExperimentList()
-            for i_expt, expt in enumerate(self.experiments):
-                # XXX Not sure if we still need this loop over self.experiments
-                if expt.scan is not None:
-                    start, end = expt.scan.get_oscillation_range()
-                    if (end - start) > 360:
-                        # only use reflections from the first 360 degrees of the scan
-                        sel.set_selected(
-                            (imageset_id == i_expt)
-                            & (zo > ((start * math.pi / 180) + 2 * math.pi)),
-                            False,
-                        )
+            for expt in self.experiments:
                 experiments.append(
                     Experiment(
                         imageset=expt.imageset,
@@ -215,7 +221,7 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
                         crystal=cm,
                     )
                 )
-            refl = self.reflections.select(sel)
+            refl = reflections.copy()
             self.index_reflections(experiments, refl)
             if refl.get_flags(refl.flags.indexed).count(True) == 0:
                 continue
@@ -263,22 +269,40 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
                     continue
                 experiments[0].crystal.update(new_crystal)
 
-            args.append((experiments, refl))
+            # Only the candidate crystal model and the columns set by indexing
+            # differ between candidates, so send just these to the workers
+            args.append(
+                (
+                    experiments[0].crystal,
+                    refl["miller_index"],
+                    refl["id"],
+                    refl["flags"],
+                )
+            )
             if len(args) == self.params.basis_vector_combinations.max_refine:
                 break
 
-        from libtbx import easy_mp
-
         evaluator = model_evaluation.ModelEvaluation(self.all_params)
-        results = easy_mp.parallel_map(
-            evaluator.evaluate,
-            args,
-            iterable_type=easy_mp.posiargs,
-            processes=self.params.nproc,
-            preserve_exception_message=True,
-        )
-
-        for soln in results:
+        initargs = (evaluator, reflections, self.experiments)
+        if self.params.nproc > 1 and len(args) > 1:
+            with multiprocessing.Pool(
+                processes=min(self.params.nproc, len(args)),
+                initializer=_init_candidate_worker,
+                initargs=initargs,
+            ) as pool:
+                results = pool.map(_evaluate_candidate, args, 1)
+        else:
+            _init_candidate_worker(*initargs)
+            results = [_evaluate_candidate(a) for a in args]
+        _init_candidate_worker(None, None, None)
+
+        for i, (soln, elapsed) in enumerate(results):
+            logger.debug(
+                "Evaluated candidate %i (%s) in %.2fs",
+                i + 1,
+                args[i][0].get_unit_cell(),
+                elapsed,
+            )
             if soln is None:
                 continue
             solutions.append(soln)
@@ -295,6 +319,43 @@ def choose_best_orientation_matrix(self, candidate_orientation_matrices):
             return None, None
 
 
+# The model evaluator, unindexed reflections and experiments shared by all the
+# candidate orientation matrices evaluated in a worker process, set by
+# _init_candidate_worker
+_candidate_worker_data = None
+
+
+def _init_candidate_worker(evaluator, reflections, experiments):
+    global _candidate_worker_data
+    _candidate_worker_data = (evaluator, reflections, experiments)
+
+
+def _evaluate_candidate(args):
+    evaluator, reflections, experiments = _candidate_worker_data
+    crystal_model, miller_index, ids, flags = args
+    st = time.time()
+    refl = reflections.copy()
+    refl["miller_index"] = miller_index
+    refl["id"] = ids
+    refl["flags"] = flags
+    # Refinement updates the models in place, so evaluate each candidate
+    # against its own copies of the shared models
+    candidate_experiments = ExperimentList()
+    for expt in experiments:
+        candidate_experiments.append(
+            Experiment(
+                imageset=expt.imageset,
+                beam=copy.deepcopy(expt.beam),
+                detector=copy.deepcopy(expt.detector),
+                goniometer=copy.deepcopy(expt.goniometer),
+                scan=copy.deepcopy(expt.scan),
+                crystal=crystal_model,
+            )
+        )
+    soln = evaluator.evaluate(candidate_experiments, refl)
+    return soln, time.time() - st
+
+
 class BasisVectorSearch(LatticeSearch):
     def __init__(self, reflections, experiments, params=None):
         super(BasisVectorSearch, self).__init__(reflections, experiments, params)
@@ -324,6 +385,7 @@ def __init__(self, reflections, experiments, params=None):
             min_cell=self.params.min_cell,
             target_unit_cell=target_unit_cell,
             params=getattr(self.params, entry_point.name),
+            nproc=self.params.nproc,
         )
 
     def find_candidate_basis_vectors(self):
@@ -389,6 +451,7 @@ def optimise_basis_vectors(self):
         optimised_basis_vectors = optimise.optimise_basis_vectors(
             self.reflections["rlp"].select(self._used_in_indexing),
             self.candidate_basis_vectors,
+            nproc=self.params.nproc,
         )
         self.candidate_basis_vectors = [
             scitbx.matrix.col(v) for v in optimised_basis_vectors
@@ -36,6 +36,7 @@ def __init__(self):
         self.finalize = 0
         self.total = 0
         self.user = 0
+        self.transfer = 0
 
     def __str__(self):
         """Convert to string."""
@@ -47,6 +48,7 @@ def __str__(self):
                 ["Pre-process time", self.initialize],
                 ["Process time", self.process],
                 ["Post-process time", self.finalize],
+                ["Process transfer time", self.transfer],
                 ["Total time", self.total],
                 ["User time", self.user],
             )
@@ -0,0 +1,266 @@
+"""
+A cache of decoded images in shared memory, for integration jobs that overlap.
+
+When a sweep is split into blocks for processing, consecutive blocks overlap
+by a number of frames, and each job independently reads and decodes its full
+frame range, so the overlapping frames are decoded more than once. With the
+SharedImageCache, the first job to decode one of these frames places the
+corrected image data in a named shared memory segment, and any other job
+covering the same frame reads the data from there instead of from disk.
+
+The cache is bounded: the frames shared by the most jobs are cached first, up
+to a maximum total size, and each frame is removed from shared memory as soon
+as the last job covering it has finished. Shared memory segments require
+Python 3.8 or later; where they are not available, no cache is created and
+each job reads its own images.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import logging
+import os
+import uuid
+from collections import Counter
+
+import numpy as np
+
+from dials.algorithms.integration.transport import (
+    _open,
+    release_shared_memory,
+    shared_memory_available,
+)
+from dials.array_family import flex
+
+logger = logging.getLogger(__name__)
+
+# The segment header is a "ready" flag followed by the number of panels, then
+# the (slow, fast) dimensions of each panel, all as 64-bit unsigned integers.
+_READY = 1
+
+
+def shared_memory_free():
+    """
+    The free space in bytes available for shared memory segments.
+
+    :return: The free space of /dev/shm, or None where shared memory is not
+             backed by a file system that can be queried
+    """
+    try:
+        stat = os.statvfs("/dev/shm")
+    except (AttributeError, OSError):
+        return None
+    return stat.f_bavail * stat.f_frsize
+
+
+def frame_size(detector):
+    """
+    The size in bytes of the shared memory segment for one frame.
+
+    :param detector: The detector model
+    :return: The size of the header and the float64 data for all panels
+    """
+    return 16 * (len(detector) + 1) + sum(
+        8 * nx * ny for nx, ny in (panel.get_image_size() for panel in detector)
+    )
+
+
+def load_image(name):
+    """
+    Load the corrected image data for a frame from a shared memory segment.
+
+    The segment is opened without registering it with the resource tracker,
+    since it is owned by the process that created it.
+
+    :param name: The name of the segment
+    :return: A tuple of flex.double arrays, one per panel, or None if the
+             segment does not exist or is still being written
+    """
+    try:
+        shm = _open(name, track=False)
+    except FileNotFoundError:
+        return None
+    try:
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf)
+        if header[0] != _READY:
+            # Another process is still writing this frame
+            return None
+        n_panels = int(header[1])
+        shapes = np.ndarray((n_panels, 2), dtype=np.uint64, buffer=shm.buf, offset=16)
+        offset = 16 * (n_panels + 1)
+        image = []
+        for ny, nx in shapes:
+            ny, nx = int(ny), int(nx)
+            data = np.ndarray(
+                (ny * nx,), dtype=np.float64, buffer=shm.buf, offset=offset
+            )
+            panel = flex.double(data.copy())
+            panel.reshape(flex.grid(ny, nx))
+            image.append(panel)
+            offset += 8 * ny * nx
+            del data
+        del header, shapes
+        return tuple(image)
+    finally:
+        shm.close()
+
+
+def store_image(name, image):
+    """
+    Store the corrected image data for a frame in a new shared memory segment.
+
+    The segment is removed with release_shared_memory(). Nothing is written if
+    a segment of the same name already exists.
+
+    :param name: The name of the segment
+    :param image: A tuple of flex.double arrays, one per panel
+    """
+    shapes = [panel.all() for panel in image]
+    size = 16 * (len(shapes) + 1) + sum(8 * ny * nx for ny, nx in shapes)
+    try:
+        shm = _open(name, create=True, size=size, track=False)
+    except FileExistsError:
+        # Another process has decoded the same frame at the same time
+        return
+    try:
+        header = np.ndarray((2,), dtype=np.uint64, buffer=shm.buf)
+        header[1] = len(shapes)
+        np.ndarray((len(shapes), 2), dtype=np.uint64, buffer=shm.buf, offset=16)[
+            :
+        ] = shapes
+        offset = 16 * (len(shapes) + 1)
+        for panel, (ny, nx) in zip(image, shapes):
+            data = np.ndarray(
+                (ny * nx,), dtype=np.float64, buffer=shm.buf, offset=offset
+            )
+            data[:] = panel.as_numpy_array().ravel()
+            offset += 8 * ny * nx
+            del data
+        # Mark the frame as ready only once all the data has been written
+        header[0] = _READY
+        del header
+    finally:
+        shm.close()
+
+
+class SharedImageCache(object):
+    """
+    A cache of corrected image data for frames shared between jobs.
+
+    Only the frames which are covered by more than one job are cached. The
+    object itself only holds the segment names, so it is cheap to pickle and
+    send to worker processes. The process that creates the cache is
+    responsible for calling job_finished() as each job completes, which frees
+    the frames that are no longer needed, and release() once all jobs have
+    finished. The workers therefore open the segments without registering them
+    with their resource tracker, which would otherwise remove them, or warn
+    about them, when the worker exits.
+    """
+
+    def __init__(self, frames, prefix=None, remaining=None):
+        """
+        :param frames: The (imageset key, frame) pairs to cache
+        :param prefix: A unique prefix for the shared memory segment names
+        :param remaining: The number of jobs covering each cached frame
+        """
+        if prefix is None:
+            prefix = "dials_%d_%s" % (os.getpid(), uuid.uuid4().hex[:8])
+        self.prefix = prefix
+        self.frames = frozenset(frames)
+        self.hits = 0
+        self.misses = 0
+        self._remaining = Counter(remaining or {})
+
+    @staticmethod
+    def available():
+        """Check whether shared memory segments are supported."""
+        return shared_memory_available()
+
+    @classmethod
+    def from_jobs(cls, jobs, frame_sizes=None, max_size=None):
+        """
+        Create a cache for the frames shared between jobs.
+
+        If a maximum size is given, the frames shared by the most jobs are
+        chosen first, until the cache would exceed this size.
+
+        :param jobs: An iterable of (imageset key, (frame0, frame1)) pairs
+        :param frame_sizes: A dictionary of the frame size in bytes for each
+                            imageset key, required if max_size is given
+        :param max_size: The maximum total size in bytes of the cache
+        """
+        counts = Counter()
+        for key, (frame0, frame1) in jobs:
+            counts.update((key, frame) for frame in range(frame0, frame1))
+        shared = sorted(
+            (frame for frame, count in counts.items() if count > 1),
+            key=lambda frame: (-counts[frame], frame),
+        )
+        if max_size is not None:
+            total = 0
+            for i, (key, frame) in enumerate(shared):
+                total += frame_sizes[key]
+                if total > max_size:
+                    shared = shared[:i]
+                    break
+        return cls(shared, remaining={frame: counts[frame] for frame in shared})
+
+    def __getstate__(self):
+        """
+        Pickle the cache for a worker, without the job bookkeeping.
+        """
+        state = self.__dict__.copy()
+        state["_remaining"] = Counter()
+        return state
+
+    def __len__(self):
+        return len(self.frames)
+
+    def _name(self, key, frame):
+        return "%s_%d_%d" % (self.prefix, key, frame)
+
+    def get(self, key, frame, read):
+        """
+        Get the corrected image data for a frame.
+
+        :param key: The imageset key
+        :param frame: The frame number
+        :param read: A function to read the image data if it is not cached
+        :return: A tuple of flex.double arrays, one per panel
+        """
+        if (key, frame) not in self.frames:
+            return read()
+        name = self._name(key, frame)
+        image = load_image(name)
+        if image is not None:
+            self.hits += 1
+            return image
+        self.misses += 1
+        image = read()
+        store_image(name, image)
+        return image
+
+    def job_finished(self, key, frames):
+        """
+        Record that a job has finished, and remove the segments of the frames
+        that are not covered by any job still to be processed.
+
+        :param key: The imageset key of the job
+        :param frames: The (frame0, frame1) range of the job
+        """
+        for frame in range(*frames):
+            if (key, frame) not in self._remaining:
+                continue
+            self._remaining[key, frame] -= 1
+            if self._remaining[key, frame] <= 0:
+                del self._remaining[key, frame]
+                self._unlink(self._name(key, frame))
+
+    @staticmethod
+    def _unlink(name):
+        release_shared_memory(name)
+
+    def release(self):
+        """Remove all the shared memory segments created for this cache."""
+        for key, frame in self.frames:
+            self._unlink(self._name(key, frame))
+        self._remaining.clear()
@@ -233,6 +233,30 @@ def generate_phil_scope():
         nproc = 1
           .type = int(value_min=1)
           .help = "The number of processes to use per cluster job"
+
+        shared_image_cache = False
+          .type = bool
+          .help = "With multiple processes on a single node, place decoded"
+                  "images of frames that are covered by more than one job in"
+                  "shared memory, so that each overlapping frame is only read"
+                  "and decoded once."
+          .expert_level = 2
+
+        shared_image_cache_size = 1024
+          .type = int(value_min=1)
+          .help = "The maximum size in MB of the shared image cache. Frames"
+                  "shared by the most jobs are cached first, and the size is"
+                  "further limited to half the free space in /dev/shm. Each"
+                  "frame is freed once the last job covering it has finished."
+          .expert_level = 2
+
+        transport = *pickle shared_memory
+          .type = choice
+          .help = "How reflections are sent to and from local worker processes."
+                  "With shared_memory, the reflections are serialised once into"
+                  "shared memory rather than pickled with each task and result."
+                  "Only used with nproc > 1 and njobs = 1."
+          .expert_level = 2
       }
 
       summation {
@@ -380,6 +404,9 @@ def from_phil(params):
         mp.method = params.mp.method
         mp.nproc = params.mp.nproc
         mp.njobs = params.mp.njobs
+        mp.shared_image_cache = params.mp.shared_image_cache
+        mp.shared_image_cache_size = params.mp.shared_image_cache_size
+        mp.transport = params.mp.transport
 
         # Set the lookup parameters
         lookup = processor.Lookup()
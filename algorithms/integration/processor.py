@@ -5,7 +5,9 @@
 import itertools
 import logging
 import math
+import os
 import platform
+import uuid
 from time import time
 
 import psutil
@@ -16,6 +18,16 @@
 import dials.algorithms.integration
 import dials.util
 import dials.util.log
+from dials.algorithms.integration.image_cache import (
+    SharedImageCache,
+    frame_size,
+    shared_memory_free,
+)
+from dials.algorithms.integration.transport import (
+    SharedReflectionTable,
+    release_shared_memory,
+    shared_memory_available,
+)
 from dials.array_family import flex
 from dials.model.data import make_image
 from dials.util import tabulate
@@ -105,12 +117,18 @@ def __init__(self):
         self.nproc = 1
         self.njobs = 1
         self.nthreads = 1
+        self.shared_image_cache = False
+        self.shared_image_cache_size = 1024
+        self.transport = "pickle"
 
     def update(self, other):
         self.method = other.method
         self.nproc = other.nproc
         self.njobs = other.njobs
         self.nthreads = other.nthreads
+        self.shared_image_cache = other.shared_image_cache
+        self.shared_image_cache_size = other.shared_image_cache_size
+        self.transport = other.transport
 
 
 class Lookup(object):
@@ -210,6 +228,16 @@ def execute_parallel_task(task):
 
     dials.util.log.config_simple_cached()
     result = task()
+    if getattr(task, "transport_name", None):
+        # The segment is owned, and released, by the parent process
+        result = result._replace(
+            reflections=SharedReflectionTable(
+                result.reflections,
+                task.transport_name + "r",
+                transfer_time=task.transfer_time,
+                owner=False,
+            )
+        )
     handlers = logging.getLogger("dials").handlers
     assert len(handlers) == 1, "Invalid number of logging handlers"
     return result, handlers[0].messages()
@@ -281,26 +309,42 @@ def process(self):
             )
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n" % (mp_nproc))
-        if mp_njobs * mp_nproc > 1:
-
-            def process_output(result):
-                for message in result[1]:
-                    logger.handle(message)
-                self.manager.accumulate(result[0])
-
-            multi_node_parallel_map(
-                func=execute_parallel_task,
-                iterable=list(self.manager.tasks()),
-                njobs=mp_njobs,
-                nproc=mp_nproc,
-                callback=process_output,
-                cluster_method=mp_method,
-                preserve_order=True,
-                preserve_exception_message=True,
-            )
-        else:
-            for task in self.manager.tasks():
-                self.manager.accumulate(task())
+        try:
+            if mp_njobs * mp_nproc > 1:
+
+                def process_output(result):
+                    for message in result[1]:
+                        logger.handle(message)
+                    result = result[0]
+                    try:
+                        if isinstance(result.reflections, SharedReflectionTable):
+                            shared = result.reflections
+                            result = result._replace(
+                                reflections=shared.load(release=True)
+                            )
+                            self.manager.time.transfer += shared.transfer_time
+                    finally:
+                        self.manager.release_transport(result.index)
+                    self.manager.accumulate(result)
+
+                # The tasks are created, and their reflections written to
+                # shared memory, only as they are dispatched to the workers
+                multi_node_parallel_map(
+                    func=execute_parallel_task,
+                    iterable=self.manager.tasks(),
+                    njobs=mp_njobs,
+                    nproc=mp_nproc,
+                    callback=process_output,
+                    cluster_method=mp_method,
+                    preserve_order=True,
+                    preserve_exception_message=True,
+                )
+            else:
+                for task in self.manager.tasks():
+                    self.manager.accumulate(task())
+        finally:
+            self.manager.release_transport()
+            self.manager.release_image_cache()
         self.manager.finalize()
         end_time = time()
         self.manager.time.user_time = end_time - start_time
@@ -372,7 +416,18 @@ class Task(object):
     A class to perform a processing task.
     """
 
-    def __init__(self, index, job, experiments, reflections, params, executor=None):
+    def __init__(
+        self,
+        index,
+        job,
+        experiments,
+        reflections,
+        params,
+        executor=None,
+        image_cache=None,
+        image_cache_key=0,
+        transport_name=None,
+    ):
         """
         Initialise the task.
 
@@ -383,6 +438,11 @@ def __init__(self, index, job, experiments, reflections, params, executor=None):
         :param job: The frames to integrate
         :param flatten: Flatten the shoeboxes
         :param executor: The executor class
+        :param image_cache: An optional SharedImageCache for overlapping frames
+        :param image_cache_key: The key of the imageset in the image cache
+        :param transport_name: The prefix of the names of the shared memory
+                               segments used to transfer the reflections to
+                               and from a worker process, if any
         """
         assert executor is not None, "No executor given"
         assert len(reflections) > 0, "Zero reflections given"
@@ -392,6 +452,31 @@ def __init__(self, index, job, experiments, reflections, params, executor=None):
         self.reflections = reflections
         self.params = params
         self.executor = executor
+        self.image_cache = image_cache
+        self.image_cache_key = image_cache_key
+        self.transport_name = transport_name
+        self.transfer_time = 0.0
+
+    def __getstate__(self):
+        """
+        Pickle the task, optionally passing the reflections in shared memory.
+        """
+        state = self.__dict__.copy()
+        if self.transport_name:
+            state["reflections"] = SharedReflectionTable(
+                self.reflections, self.transport_name + "t"
+            )
+        return state
+
+    def __setstate__(self, state):
+        """
+        Unpickle the task, loading reflections passed in shared memory.
+        """
+        self.__dict__.update(state)
+        if isinstance(self.reflections, SharedReflectionTable):
+            shared = self.reflections
+            self.reflections = shared.load(release=True)
+            self.transfer_time = shared.transfer_time
 
     def __call__(self):
         """
@@ -466,7 +551,14 @@ def __call__(self):
         read_time = 0.0
         for i in range(len(imageset)):
             st = time()
-            image = imageset.get_corrected_data(i)
+            if self.image_cache is not None:
+                image = self.image_cache.get(
+                    self.image_cache_key,
+                    frame0 + i,
+                    lambda: imageset.get_corrected_data(i),
+                )
+            else:
+                image = imageset.get_corrected_data(i)
             if imageset.is_marked_for_rejection(i):
                 mask = tuple(flex.bool(im.accessor(), False) for im in image)
             else:
@@ -487,6 +579,12 @@ def __call__(self):
             del image
             del mask
         assert processor.finished(), "Data processor is not finished"
+        if self.image_cache is not None:
+            logger.debug(
+                "Job %d read %d frame(s) from the shared image cache",
+                self.index,
+                self.image_cache.hits,
+            )
 
         # Optionally save the shoeboxes
         if self.params.debug.output and self.params.debug.separate_files:
@@ -536,6 +634,8 @@ def __init__(self, experiments, reflections, params):
 
         # Initialise the callbacks
         self.executor = None
+        self.image_cache = None
+        self.transport_prefix = None
 
         # Save some data
         self.experiments = experiments
@@ -575,6 +675,50 @@ def initialize(self):
         # Create the reflection manager
         self.manager = ReflectionManager(self.jobs, self.reflections)
 
+        # Transfer the reflections through shared memory with local processes
+        if self.params.mp.transport == "shared_memory":
+            if not shared_memory_available():
+                raise dials.util.Sorry(
+                    "mp.transport=shared_memory requires Python 3.8 or later"
+                )
+            if self.params.mp.nproc > 1 and self.params.mp.njobs == 1:
+                self.transport_prefix = "dials_%d_%s_" % (
+                    os.getpid(),
+                    uuid.uuid4().hex[:6],
+                )
+
+        # Optionally cache the frames shared between jobs in shared memory
+        if (
+            self.params.mp.shared_image_cache
+            and self.params.mp.nproc > 1
+            and self.params.mp.njobs == 1
+        ):
+            if SharedImageCache.available():
+                max_size = self.params.mp.shared_image_cache_size * 1024 ** 2
+                free = shared_memory_free()
+                if free is not None:
+                    max_size = min(max_size, free // 2)
+                self.image_cache = SharedImageCache.from_jobs(
+                    (
+                        (self.manager.job(i).expr()[0], self.manager.job(i).frames())
+                        for i in range(len(self.manager))
+                    ),
+                    frame_sizes={
+                        i: frame_size(expr.detector)
+                        for i, expr in enumerate(self.experiments)
+                    },
+                    max_size=max_size,
+                )
+                logger.info(
+                    " Caching %d frame(s) shared between jobs in shared memory\n",
+                    len(self.image_cache),
+                )
+            else:
+                logger.warning(
+                    "The shared image cache requires Python 3.8 or later, "
+                    "so each job will read its own images\n"
+                )
+
         # Parallel reading of HDF5 from the same handle is not allowed. Python
         # multiprocessing is a bit messed up and used fork on linux so need to
         # close and reopen file.
@@ -608,6 +752,9 @@ def task(self, index):
                 reflections=reflections,
                 params=self.params,
                 executor=self.executor,
+                image_cache=self.image_cache,
+                image_cache_key=expr_id[0],
+                transport_name=self.transport_name(index),
             )
         return task
 
@@ -626,6 +773,37 @@ def accumulate(self, result):
         self.time.extract += result.extract_time
         self.time.process += result.process_time
         self.time.total += result.total_time
+        if self.image_cache is not None:
+            job = self.manager.job(result.index)
+            self.image_cache.job_finished(job.expr()[0], job.frames())
+
+    def transport_name(self, index):
+        """
+        Get the prefix of the shared memory segment names for a task.
+        """
+        if self.transport_prefix is None:
+            return None
+        return "%s%d" % (self.transport_prefix, index)
+
+    def release_transport(self, index=None):
+        """
+        Release the shared memory used to transfer the reflections of a task,
+        or of all tasks if no index is given.
+        """
+        if self.transport_prefix is None:
+            return
+        indices = range(len(self)) if index is None else [index]
+        for i in indices:
+            name = self.transport_name(i)
+            release_shared_memory(name + "t")
+            release_shared_memory(name + "r")
+
+    def release_image_cache(self):
+        """
+        Release the shared memory used by the image cache, if any.
+        """
+        if self.image_cache is not None:
+            self.image_cache.release()
 
     def finalize(self):
         """
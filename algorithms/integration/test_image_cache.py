@@ -0,0 +1,76 @@
+from dials.algorithms.integration.image_cache import SharedImageCache
+from dials.array_family import flex
+
+
+def test_shared_image_cache():
+    cache = SharedImageCache.from_jobs([(0, (0, 5)), (0, (3, 8)), (1, (0, 5))])
+    assert len(cache) == 2
+    assert cache.frames == {(0, 3), (0, 4)}
+
+    image = (
+        flex.double(flex.grid(3, 4), 1.5),
+        flex.double(flex.grid(2, 2), -2.0),
+    )
+    calls = []
+
+    def read():
+        calls.append(1)
+        return image
+
+    try:
+        # Frames not shared between jobs are always read
+        assert cache.get(0, 0, read) is image
+        assert cache.get(0, 0, read) is image
+        assert len(calls) == 2
+
+        # Shared frames are only read once
+        assert cache.get(0, 3, read) is image
+        cached = cache.get(0, 3, read)
+        assert len(calls) == 3
+        assert cache.hits == 1
+        assert cache.misses == 1
+        assert len(cached) == 2
+        for a, b in zip(cached, image):
+            assert a.all() == b.all()
+            assert list(a) == list(b)
+    finally:
+        cache.release()
+
+    # After release the frame has to be read again
+    assert cache.get(0, 3, read) is image
+    cache.release()
+    assert len(calls) == 4
+
+
+def test_shared_image_cache_bounded():
+    jobs = [(0, (0, 5)), (0, (3, 8)), (0, (4, 10))]
+
+    # The frames covered by the most jobs are cached first
+    cache = SharedImageCache.from_jobs(jobs, frame_sizes={0: 100}, max_size=250)
+    assert cache.frames == {(0, 3), (0, 4)}
+    cache = SharedImageCache.from_jobs(jobs, frame_sizes={0: 100}, max_size=150)
+    assert cache.frames == {(0, 4)}
+
+    image = (flex.double(flex.grid(2, 3), 1.0),)
+    calls = []
+
+    def read():
+        calls.append(1)
+        return image
+
+    cache = SharedImageCache.from_jobs(jobs)
+    try:
+        cache.get(0, 4, read)
+        cache.get(0, 4, read)
+        assert len(calls) == 1
+
+        # The frame is kept until the last job covering it has finished
+        cache.job_finished(0, (0, 5))
+        cache.job_finished(0, (3, 8))
+        cache.get(0, 4, read)
+        assert len(calls) == 1
+        cache.job_finished(0, (4, 10))
+        cache.get(0, 4, read)
+        assert len(calls) == 2
+    finally:
+        cache.release()
@@ -0,0 +1,54 @@
+import os
+import pickle
+import uuid
+
+import pytest
+
+from dials.algorithms.integration.transport import (
+    SharedReflectionTable,
+    release_shared_memory,
+)
+from dials.array_family import flex
+
+
+def test_shared_reflection_table():
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 0, 1])
+    table["intensity.sum.value"] = flex.double([1.0, 2.0, 3.0])
+    table["miller_index"] = flex.miller_index([(1, 0, 0), (0, 1, 0), (0, 0, 1)])
+    table.experiment_identifiers()[0] = "a"
+    table.experiment_identifiers()[1] = "b"
+
+    name = "dials_%d_%s" % (os.getpid(), uuid.uuid4().hex[:6])
+    try:
+        shared = pickle.loads(pickle.dumps(SharedReflectionTable(table, name)))
+        loaded = shared.load()
+    finally:
+        release_shared_memory(name)
+    assert shared.transfer_time > 0
+    assert list(loaded["id"]) == [0, 0, 1]
+    assert list(loaded["intensity.sum.value"]) == [1.0, 2.0, 3.0]
+    assert list(loaded["miller_index"]) == list(table["miller_index"])
+    assert dict(loaded.experiment_identifiers()) == {0: "a", 1: "b"}
+
+    # The shared memory is removed by the owner once released
+    with pytest.raises(FileNotFoundError):
+        shared.load()
+    release_shared_memory(name)
+
+
+def test_shared_reflection_table_release_on_load():
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 1])
+
+    name = "dials_%d_%s" % (os.getpid(), uuid.uuid4().hex[:6])
+    try:
+        shared = pickle.loads(pickle.dumps(SharedReflectionTable(table, name)))
+        loaded = shared.load(release=True)
+        assert list(loaded["id"]) == [0, 1]
+
+        # The segment is removed as soon as it has been loaded
+        with pytest.raises(FileNotFoundError):
+            shared.load()
+    finally:
+        release_shared_memory(name)
@@ -0,0 +1,128 @@
+"""
+Transport of reflection tables between processes through shared memory.
+
+By default the reflection tables of integration tasks and their results are
+pickled to and from the worker processes along with the rest of the task. With
+a SharedReflectionTable, the table is instead serialised once as msgpack into
+a named shared memory segment, and only the name of the segment is pickled.
+The receiving process decodes the table straight from the segment.
+
+The parent process chooses the names of the segments. The segment holding the
+reflections of a task is removed by the worker process as soon as it has been
+loaded, and the segment holding the result is removed by the parent once it
+has been loaded, so only the segments of the tasks in flight exist at once.
+The parent also removes the segments of each task with release_shared_memory()
+when its result has been received, and once more for all tasks when processing
+finishes, so a handle that is never loaded does not leak its segment. Shared
+memory segments require Python 3.8 or later.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+from time import time
+
+from dials.array_family import flex
+
+
+def _shared_memory():
+    """The multiprocessing.shared_memory module, or None before Python 3.8."""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
+
+
+def shared_memory_available():
+    """Check whether shared memory segments are supported."""
+    return _shared_memory() is not None
+
+
+def _open(name, create=False, size=0, track=True):
+    """
+    Open a shared memory segment.
+
+    :param name: The name of the segment
+    :param create: Create a new segment rather than attach to an existing one
+    :param size: The size in bytes of a new segment
+    :param track: Whether the resource tracker of this process should remove
+                  the segment if it still exists when the process exits. This
+                  must be False for segments owned by another process.
+    """
+    shared_memory = _shared_memory()
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=size, track=track
+        )
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    if not track and os.name == "posix":
+        from multiprocessing import resource_tracker
+
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def release_shared_memory(name):
+    """
+    Remove a shared memory segment, if it exists.
+
+    :param name: The name of the segment
+    """
+    try:
+        shm = _open(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+class SharedReflectionTable(object):
+    """
+    A handle to a reflection table serialised into shared memory.
+
+    The handle may be loaded by the receiving process, which may remove the
+    segment once it has been loaded; otherwise it is removed by the owning
+    process with release_shared_memory().
+    The time spent serialising and deserialising the table is accumulated in
+    transfer_time.
+    """
+
+    def __init__(self, table, name, transfer_time=0.0, owner=True):
+        """
+        :param table: The reflection table to share
+        :param name: The name of the shared memory segment
+        :param transfer_time: Any time already spent transferring this data
+        :param owner: Whether this process owns, and will release, the segment
+        """
+        st = time()
+        data = table.as_msgpack()
+        self.name = name
+        self.size = len(data)
+        shm = _open(name, create=True, size=max(self.size, 1), track=owner)
+        try:
+            shm.buf[: self.size] = data
+        finally:
+            shm.close()
+        self.transfer_time = transfer_time + time() - st
+
+    def load(self, release=False):
+        """
+        Load the reflection table, decoding it directly from shared memory.
+
+        :param release: Remove the segment once the table has been loaded
+        :return: The reflection table
+        """
+        st = time()
+        shm = _open(self.name, track=release)
+        buf = shm.buf[: self.size]
+        try:
+            table = flex.reflection_table.from_msgpack(buf)
+        finally:
+            buf.release()
+            shm.close()
+            if release:
+                shm.unlink()
+        self.transfer_time += time() - st
+        return table
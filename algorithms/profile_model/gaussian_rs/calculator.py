@@ -7,12 +7,11 @@
 
 from __future__ import absolute_import, division, print_function
 
-import collections
-import copy
 import logging
 import math
+import multiprocessing
 
-import six
+import numpy as np
 
 import scitbx.math
 
@@ -569,6 +568,44 @@ def sigma_m(self):
         return self._sigma_m
 
 
+# The models and partial reflections, sorted by frame, shared by the per-frame
+# profile model calculations in a worker process, set by _init_frame_worker
+_frame_worker_data = None
+
+
+def _init_frame_worker(crystal, beam, detector, goniometer, scan, reflections):
+    global _frame_worker_data
+    _frame_worker_data = (crystal, beam, detector, goniometer, scan, reflections)
+
+
+def _compute_frame_sigmas(task):
+    """Compute sigma_b and sigma_m from the reflections on one frame."""
+    crystal, beam, detector, goniometer, scan, reflections = _frame_worker_data
+    begin, end = task
+    reflections = reflections[begin:end]
+    beam_divergence = ComputeEsdBeamDivergence(detector, reflections)
+    reflecting_range = ComputeEsdReflectingRange(
+        crystal, beam, detector, goniometer, scan, reflections
+    )
+    return beam_divergence.sigma(), reflecting_range.sigma()
+
+
+def _gaussian_kernel(n):
+    """A normalised Gaussian kernel of odd size n, truncated at 3 sigma."""
+    assert n & 1
+    mid = n // 2
+    sigma = mid / 3.0
+    kernel = np.exp(-((np.arange(n) - mid) ** 2) / (2 * sigma ** 2))
+    return kernel / kernel.sum()
+
+
+def _convolve(data, kernel):
+    """Convolve data with a symmetric kernel, extending the data at the ends."""
+    assert len(kernel) & 1
+    padded = np.pad(data, len(kernel) // 2, mode="edge")
+    return np.convolve(padded, kernel, mode="valid")
+
+
 class ScanVaryingProfileModelCalculator(object):
     """Class to help calculate the profile model."""
 
@@ -583,8 +620,10 @@ def __init__(
         min_zeta=0.05,
         algorithm="basic",
         centroid_definition="s1",
+        nproc=1,
     ):
-        """Calculate the profile model."""
+        """Calculate the profile model, sharing the frames between nproc
+        processes."""
         from dxtbx.model.experiment_list import Experiment
 
         # Check input has what we want
@@ -608,91 +647,71 @@ def __init__(
             )
         )
         mask = flex.abs(zeta) >= min_zeta
-        reflections = reflections.select(mask)
+
+        # Take only the columns needed for the profile model, sharing them with
+        # the input table. Selecting by zeta then gives a new table, so the
+        # shoeboxes can be split into partials without deep copying them
+        columns = flex.reflection_table()
+        for key in (
+            "bbox",
+            "panel",
+            "shoebox",
+            "s1",
+            "xyzobs.px.value",
+            "xyzcal.mm",
+            "zeta",
+        ):
+            columns[key] = reflections[key]
+        reflections = columns.select(mask)
 
         # Split the reflections into partials
-        reflections = copy.deepcopy(reflections)
         reflections.split_partials_with_shoebox()
 
-        # Get a list of reflections for each frame
-        bbox = reflections["bbox"]
-        index_list = collections.defaultdict(list)
-        for i, (x0, x1, y0, y1, z0, z1) in enumerate(bbox):
-            assert z1 == z0 + 1
-            index_list[z0].append(i)
-        reflection_list = {
-            key: reflections.select(flex.size_t(value))
-            for key, value in six.iteritems(index_list)
-        }
+        # Sort the partials by frame, so the reflections on each frame are a
+        # contiguous slice of the table
+        _, _, _, _, frame, frame_end = reflections["bbox"].parts()
+        assert (frame_end - frame).all_eq(1)
+        perm = flex.sort_permutation(frame, stable=True)
+        reflections = reflections.select(perm)
+        frame = frame.select(perm)
 
         # The range of frames
         z0, z1 = scan.get_array_range()
-        min_z = min(index_list)
-        max_z = max(index_list)
-        assert z0 == min_z
-        assert z1 == max_z + 1
+        assert z0 == flex.min(frame)
+        assert z1 == flex.max(frame) + 1
+        counts = np.bincount(frame.as_numpy_array() - z0, minlength=z1 - z0)
+        offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
 
         # Compute for all frames
-        self._num = []
-        sigma_b = flex.double()
-        sigma_m = flex.double()
-        for i in range(z0, z1):
-
-            # Get reflections at the index
-            reflections = reflection_list[i]
-
-            self._num.append(len(reflections))
-
-            # Calculate the E.S.D of the beam divergence
-            beam_divergence = ComputeEsdBeamDivergence(detector, reflections)
-
-            # Set the sigma b
-            sigma_b.append(beam_divergence.sigma())
-
-            # Calculate the E.S.D of the reflecting range
-            reflecting_range = ComputeEsdReflectingRange(
-                crystal, beam, detector, goniometer, scan, reflections
-            )
-
+        tasks = [(offsets[i], offsets[i + 1]) for i in range(z1 - z0)]
+        initargs = (crystal, beam, detector, goniometer, scan, reflections)
+        nproc = min(nproc, len(tasks))
+        if nproc > 1:
+            with multiprocessing.Pool(
+                processes=nproc, initializer=_init_frame_worker, initargs=initargs
+            ) as pool:
+                chunksize = int(math.ceil(len(tasks) / (4 * nproc)))
+                results = pool.map(_compute_frame_sigmas, tasks, chunksize)
+        else:
+            _init_frame_worker(*initargs)
+            results = [_compute_frame_sigmas(task) for task in tasks]
+        _init_frame_worker(None, None, None, None, None, None)
+
+        self._num = counts.tolist()
+        sigma_b = flex.double([b for b, m in results])
+        sigma_m = flex.double([m for b, m in results])
+        for i in range(len(results)):
             logger.info(
                 "Computing profile model for frame %d: sigma_b = %.4f degrees, sigma_m = %.4f degrees",
-                i,
-                beam_divergence.sigma() * 180 / math.pi,
-                reflecting_range.sigma() * 180 / math.pi,
+                z0 + i,
+                sigma_b[i] * 180 / math.pi,
+                sigma_m[i] * 180 / math.pi,
             )
 
-            # Set the sigmas
-            sigma_m.append(reflecting_range.sigma())
-
-        def convolve(data, kernel):
-            assert len(kernel) & 1
-            result = []
-            mid = len(kernel) // 2
-            for i in range(len(data)):
-                r = 0
-                for j in range(len(kernel)):
-                    k = i - mid + j
-                    if k < 0:
-                        r += kernel[j] * data[0]
-                    elif k >= len(data):
-                        r += kernel[j] * data[-1]
-                    else:
-                        r += kernel[j] * data[k]
-                result.append(r)
-            return result
-
-        def gaussian_kernel(n):
-            assert n & 1
-            mid = n // 2
-            sigma = mid / 3.0
-            kernel = [math.exp(-((i - mid) ** 2) / (2 * sigma ** 2)) for i in range(n)]
-            kernel = [k / sum(kernel) for k in kernel]
-            return kernel
-
         # Smooth the parameters
-        kernel = gaussian_kernel(51)
-        sigma_b_sq_new = convolve(flex.pow2(sigma_b), kernel)
-        sigma_m_sq_new = convolve(flex.pow2(sigma_m), kernel)
+        kernel = _gaussian_kernel(51)
+        sigma_b_sq_new = _convolve(flex.pow2(sigma_b).as_numpy_array(), kernel)
+        sigma_m_sq_new = _convolve(flex.pow2(sigma_m).as_numpy_array(), kernel)
 
         # Print the output - mean as is scan varying
         mean_sigma_b = math.sqrt(sum(flex.pow2(sigma_b)) / len(sigma_b))
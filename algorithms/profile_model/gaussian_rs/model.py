@@ -18,6 +18,11 @@
         .type = bool
         .help = "Calculate a scan varying model"
 
+    nproc = 1
+        .type = int(value_min=1)
+        .help = "The number of processes to use to calculate a scan varying"
+                "model, sharing the frames between them"
+
     min_spots
       .help = "if (total_reflections > overall or reflections_per_degree >"
               "per_degree) then do the profile modelling."
@@ -380,10 +385,12 @@ def create_from_reflections(
                 deg=True,
             )
 
+        kwargs = {}
         if not params.gaussian_rs.scan_varying:
             Calculator = ProfileModelCalculator
         else:
             Calculator = ScanVaryingProfileModelCalculator
+            kwargs["nproc"] = params.gaussian_rs.nproc
         calculator = Calculator(
             reflections,
             crystal,
@@ -394,6 +401,7 @@ def create_from_reflections(
             params.gaussian_rs.filter.min_zeta,
             algorithm=params.gaussian_rs.sigma_m_algorithm,
             centroid_definition=params.gaussian_rs.centroid_definition,
+            **kwargs
         )
         return cls(
             params=params,
@@ -4,9 +4,14 @@
 
 from __future__ import absolute_import, division, print_function
 
+import contextlib
 import copy
 import json
 import logging
+import math
+import multiprocessing
+
+import numpy as np
 
 import libtbx
 from libtbx import easy_mp
@@ -81,6 +86,16 @@
 """
 refinery_phil_scope = parse(refinery_phil_str)
 
+# The refinery used by the processes of a persistent worker pool. This is set
+# only while the pool is being created, so that forked worker processes inherit
+# the refinery, including all of its reflection data, without pickling it.
+_pool_refinery = None
+
+
+def _pool_reduced_equations_for_block(args):
+    """Task run in a persistent worker process, see AdaptLstbx.worker_pool"""
+    return _pool_refinery.reduced_equations_for_block(*args)
+
 
 class Journal(dict):
     """Container in which to store information about refinement history.
@@ -144,6 +159,107 @@ def from_json_file(cls, filename):
         return j
 
 
+class JacobianStatistics(object):
+    """Statistics of the columns of the Jacobian, accumulated block by block.
+
+    For each type of residual (e.g. X, Y, Phi) this keeps the number of rows,
+    the column sums and the Gram matrix of the columns, which are enough to
+    calculate the correlation matrices between columns. For the condition
+    number, the triangular factor R of a QR decomposition of the whole Jacobian
+    is updated with each block of rows. R has the same singular values as the
+    Jacobian, so unlike the Gram matrix its conditioning is not squared. None of
+    these need the Jacobian itself to be kept."""
+
+    # Columns whose elements would all round to zero at 15 decimal places are
+    # treated as zero, as in Refinery._packed_corr_mat
+    _zero_column_tolerance = (0.5e-15) ** 2
+
+    def __init__(self, nblocks, nparam):
+        self.nparam = nparam
+        self.nrows = [0] * nblocks
+        self.sums = [flex.double(nparam, 0.0) for _ in range(nblocks)]
+        self.gram = [
+            flex.double(flex.grid(nparam, nparam), 0.0) for _ in range(nblocks)
+        ]
+        self.r = np.zeros((0, nparam))
+
+    def add(self, jacobian):
+        """Add the rows of a Jacobian, with rows ordered in blocks for each type
+        of residual, to the statistics"""
+
+        try:
+            # The Jacobian might be a sparse matrix
+            j = jacobian.as_dense_matrix()
+        except AttributeError:
+            j = jacobian
+
+        nr, nc = j.all()
+        assert nc == self.nparam
+        nr_block = nr // len(self.nrows)
+        for i in range(len(self.nrows)):
+            block = j.matrix_copy_block(i * nr_block, 0, nr_block, nc)
+            ones = flex.double(flex.grid(nr_block, 1), 1.0)
+            self.nrows[i] += nr_block
+            self.sums[i] += block.matrix_transpose_multiply(ones).as_1d()
+            self.gram[i] += block.matrix_transpose_multiply(block)
+        self.r = self._update_r(self.r, j.as_numpy_array())
+
+    def merge(self, other):
+        """Add statistics accumulated for other rows of the Jacobian"""
+
+        for i in range(len(self.nrows)):
+            self.nrows[i] += other.nrows[i]
+            self.sums[i] += other.sums[i]
+            self.gram[i] += other.gram[i]
+        self.r = self._update_r(self.r, other.r)
+
+    @staticmethod
+    def _update_r(r, rows):
+        """The R factor of the rows of r stacked on top of the given rows"""
+        return np.linalg.qr(np.vstack((r, rows)), mode="r")
+
+    def packed_correlation_matrices(self):
+        """Return, for each type of residual, a 1D flex array containing the
+        upper diagonal values of the correlation matrix between the columns"""
+
+        result = []
+        for n, sums, gram in zip(self.nrows, self.sums, self.gram):
+            # n times the covariance matrix
+            cov = gram.deep_copy()
+            if n > 0:
+                cov -= sums.matrix_outer_product(sums) * (1.0 / n)
+            zero = [
+                gram[i, i] <= n * self._zero_column_tolerance
+                for i in range(self.nparam)
+            ]
+            tmp = flex.double()
+            for col1 in range(self.nparam):
+                for col2 in range(col1, self.nparam):
+                    if col1 == col2:
+                        tmp.append(1.0)
+                        continue
+                    denom = cov[col1, col1] * cov[col2, col2]
+                    if zero[col1] or zero[col2] or denom <= 0:
+                        tmp.append(0.0)
+                    else:
+                        tmp.append(cov[col1, col2] / math.sqrt(denom))
+            result.append(tmp)
+        return result
+
+    def condition_number(self):
+        """Calculate the 2-norm condition number of the Jacobian, the ratio of
+        its largest to smallest singular values, from the SVD of its R factor.
+        The Jacobian is treated as rank deficient, with an infinite condition
+        number, if the smallest singular value is below the precision of the
+        largest, as for numpy.linalg.matrix_rank"""
+
+        sigma = np.linalg.svd(self.r, compute_uv=False)
+        eps = np.finfo(np.float64).eps
+        if len(sigma) < self.nparam or sigma[-1] <= sigma[0] * self.nparam * eps:
+            return float("inf")
+        return float(sigma[0] / sigma[-1])
+
+
 class Refinery(object):
     """Interface for Refinery objects. This should be subclassed and the run
     method implemented."""
@@ -191,7 +307,7 @@ def __init__(
         # undefined initial functional and gradients values
         self._f = None
         self._g = None
-        self._jacobian = None
+        self._jacobian_statistics = None
 
         # filename for an optional log file
         self._log = log
@@ -231,16 +347,21 @@ def __init__(
     def get_num_steps(self):
         return self.history.get_nrows() - 1
 
-    def prepare_for_step(self):
-        """Update the parameterisation and prepare the target function"""
+    def set_parameter_values(self):
+        """Set the current parameter values in the parameterisation"""
 
         x = self.x
         if self._constr_manager is not None:
             x = self._constr_manager.expand_parameters(x)
 
-        # set current parameter values
         self._parameters.set_param_vals(x)
 
+    def prepare_for_step(self):
+        """Update the parameterisation and prepare the target function"""
+
+        # set current parameter values
+        self.set_parameter_values()
+
         # do reflection prediction
         self._target.predict()
 
@@ -257,43 +378,23 @@ def update_journal(self):
         self.history.set_last_cell("objective", self._f)
         if "gradient" in self.history:
             self.history.set_last_cell("gradient", self._g)
-        if "parameter_correlation" in self.history and self._jacobian is not None:
-            resid_names = [s.replace("RMSD_", "") for s in self._target.rmsd_names]
-            # split Jacobian into dense matrix blocks corresponding to each residual
-            jblocks = self.split_jacobian_into_blocks()
-            corrmats = {}
-            for r, j in zip(resid_names, jblocks):
-                corrmats[r] = self._packed_corr_mat(j)
-            self.history.set_last_cell("parameter_correlation", corrmats)
-        if "condition_number" in self.history and self._jacobian is not None:
-            self.history.set_last_cell(
-                "condition_number", self.jacobian_condition_number()
-            )
+        resid_names = [s.replace("RMSD_", "") for s in self._target.rmsd_names]
+        if "parameter_correlation" in self.history:
+            if self._jacobian_statistics is not None:
+                packed = self._jacobian_statistics.packed_correlation_matrices()
+                corrmats = dict(zip(resid_names, packed))
+                self.history.set_last_cell("parameter_correlation", corrmats)
+        if "condition_number" in self.history:
+            if self._jacobian_statistics is not None:
+                self.history.set_last_cell(
+                    "condition_number", self._jacobian_statistics.condition_number()
+                )
         if "out_of_sample_rmsd" in self.history:
             preds = self._target.predict_for_free_reflections()
             self.history.set_last_cell(
                 "out_of_sample_rmsd", self._target.rmsds_for_reflection_table(preds)
             )
 
-    def split_jacobian_into_blocks(self):
-        """Split the Jacobian into blocks each corresponding to a separate
-        residual"""
-
-        nblocks = len(self._target.rmsd_names)
-
-        try:
-            # The Jacobian might be a sparse matrix
-            j = self._jacobian.as_dense_matrix()
-        except AttributeError:
-            j = self._jacobian
-
-        nr, nc = j.all()
-        nr_block = int(nr / nblocks)
-        row_start = [e * nr_block for e in range(nblocks)]
-        blocks = [j.matrix_copy_block(rs, 0, nr_block, nc) for rs in row_start]
-
-        return blocks
-
     @staticmethod
     def _packed_corr_mat(m):
         """Return a 1D flex array containing the upper diagonal values of the
@@ -361,48 +462,6 @@ def get_correlation_matrix_for_step(self, step):
             packed_mats[k] = corr_mat
         return packed_mats
 
-    def jacobian_condition_number(self):
-        """Calculate the condition number of the Jacobian, for tracking in the
-        refinement journal, if requested. The condition number of a matrix A is
-        defined as cond(A) = ||A|| ||inv(A)||. For a rectangular matrix the inverse
-        operation refers to the Moore-Penrose pseudoinverse. Various matrix norms
-        can be used, resulting in numerically different condition numbers, however
-        the 2-norm is commonly used. In that case, the definition is equivalent
-        to the ratio of the largest to smallest singular values of the matrix:
-        cond(A) = sig_(A) / sig_min(A). That is the calculation that is performed
-        here.
-
-        The condition number is a measure of how accurate the solution x to the
-        equation Ax = b will be. Essentially it measures how errors are amplified
-        through the linear equation. The condition number is large in the case that
-        the columns of A are nearly linearly-dependent (and infinite for a singular
-        matrix). We use it here then to detect situations where the correlation
-        between effects of different parameter shifts becomes large and therefore
-        refinement is problematic.
-
-        Note, the Jacobian used here does not include any additional rows due to
-        restraints terms that might be applied, or any parameter reduction due to
-        constraints. Therefore this condition number relates to the pure linearised
-        (Gauss-Newton) step, which might not actually be what the refinement engine
-        uses. It can be indicative of issues in the fundamental set up of the least
-        squares problem, even if these issues are avoided in practice (e.g. by
-        use of an algorithm like Levenberg-Marquardt, inclusion of restraints or
-        parameter reduction).
-        """
-        try:
-            # The Jacobian might be a sparse matrix
-            j = self._jacobian.as_dense_matrix().deep_copy()
-        except AttributeError:
-            j = self._jacobian.deep_copy()
-
-        from scitbx.linalg.svd import real as svd_real
-
-        svd = svd_real(j, False, False)
-
-        # The condition number is the ratio of the largest to the smallest singular
-        # values of the matrix
-        return max(svd.sigma) / min(svd.sigma)
-
     def test_for_termination(self):
         """Return True if refinement should be terminated"""
 
@@ -646,6 +705,9 @@ def __init__(
         # keep attribute for the Cholesky factor required for ESD calculation
         self.cf = None
 
+        # persistent pool of worker processes, available only during a run
+        self._pool = None
+
         normal_eqns.non_linear_ls.__init__(self, n_parameters=len(self.x))
 
     def restart(self):
@@ -655,6 +717,96 @@ def restart(self):
     def parameter_vector_norm(self):
         return self.x.norm()
 
+    def _new_jacobian_statistics(self):
+        """Return a JacobianStatistics to accumulate, if the journal needs it"""
+
+        if (
+            "parameter_correlation" not in self.history
+            and "condition_number" not in self.history
+        ):
+            return None
+        return JacobianStatistics(len(self._target.rmsd_names), len(self._parameters))
+
+    @contextlib.contextmanager
+    def worker_pool(self):
+        """Context manager providing a persistent pool of worker processes for
+        the duration of a refinement run, if nproc > 1.
+
+        The workers are forked once, so each holds its own copy of the target,
+        reflection data and prediction parameterisation. At each step they are
+        sent only the parameter vector and the indices of the block of matches to
+        process, and they return the normal matrix and right hand side
+        contributions for that block, rather than the Jacobian itself."""
+
+        global _pool_refinery
+
+        if self._nproc < 2 or "fork" not in multiprocessing.get_all_start_methods():
+            yield
+            return
+
+        _pool_refinery = self
+        try:
+            pool = multiprocessing.get_context("fork").Pool(processes=self._nproc)
+        finally:
+            _pool_refinery = None
+
+        self._pool = pool
+        try:
+            yield
+        finally:
+            self._pool = None
+            pool.terminate()
+            pool.join()
+
+    def reduced_equations_for_block(self, x, indices):
+        """Calculate the contribution of a block of matches to the normal
+        equations, for the parameter vector x. This is called in a worker process,
+        which predicts only the observations in the block, given by their indices.
+
+        Returns the residuals and weights (needed for the objective), with the
+        packed upper triangle of the normal matrix and the right hand side, and
+        the Jacobian statistics for the block, if these are tracked."""
+
+        self.x = x
+        self.set_parameter_values()
+        block = self._target.predict_for_block(indices)
+        residuals, jacobian, weights = self._target.compute_residuals_and_gradients(
+            block
+        )
+        statistics = self._new_jacobian_statistics()
+        if statistics is not None:
+            statistics.add(jacobian)
+        if self._constr_manager is not None:
+            jacobian = self._constr_manager.constrain_jacobian(jacobian)
+        ls = normal_eqns.non_linear_ls(n_parameters=len(x))
+        ls.add_equations(residuals, jacobian, weights)
+        step_equations = ls.step_equations()
+        return (
+            residuals,
+            weights,
+            step_equations.normal_matrix_packed_u(),
+            step_equations.right_hand_side(),
+            statistics,
+        )
+
+    def add_reduced_equations(
+        self, residuals, weights, normal_matrix, rhs, statistics=None
+    ):
+        """Add the contribution of a block of matches, as calculated by
+        reduced_equations_for_block, to the normal equations"""
+
+        self.add_residuals(residuals, weights)
+        step_equations = self.step_equations()
+        a = step_equations.normal_matrix_packed_u()
+        a += normal_matrix
+        b = step_equations.right_hand_side()
+        b += rhs
+        if statistics is not None:
+            if self._jacobian_statistics is None:
+                self._jacobian_statistics = statistics
+            else:
+                self._jacobian_statistics.merge(statistics)
+
     def build_up(self, objective_only=False):
 
         # code here to calculate the residuals. Rely on the target class
@@ -674,13 +826,26 @@ def build_up(self, objective_only=False):
         if objective_only:
             residuals, weights = self._target.compute_residuals()
             self.add_residuals(residuals, weights)
+        elif self._pool is not None:
+
+            # the Jacobian statistics are merged from those of each block
+            self._jacobian_statistics = None
+
+            indices = self._target.get_match_indices()
+            tasks = [
+                (self.x, indices[start:end])
+                for start, end in self._target.match_block_ranges(nproc=self._nproc)
+            ]
+            for result in self._pool.imap(_pool_reduced_equations_for_block, tasks):
+                self.add_reduced_equations(*result)
+
         else:
             blocks = self._target.split_matches_into_blocks(nproc=self._nproc)
 
             if self._nproc > 1:
 
                 # ensure the jacobian is not tracked
-                self._jacobian = None
+                self._jacobian_statistics = None
 
                 # processing functions
                 def task_wrapper(block):
@@ -712,13 +877,18 @@ def callback_wrapper(result):
                 )
 
             else:
+                # Fold each block into the normal equations as it is calculated,
+                # keeping only statistics of the Jacobian for the journal, so
+                # that the memory used is set by the block size
+                self._jacobian_statistics = self._new_jacobian_statistics()
                 for block in blocks:
                     (
                         residuals,
-                        self._jacobian,
+                        j,
                         weights,
                     ) = self._target.compute_residuals_and_gradients(block)
-                    j = self._jacobian
+                    if self._jacobian_statistics is not None:
+                        self._jacobian_statistics.add(j)
                     if self._constr_manager is not None:
                         j = self._constr_manager.constrain_jacobian(j)
                     self.add_equations(residuals, j, weights)
@@ -837,6 +1007,10 @@ def __init__(
         libtbx.adopt_optional_init_args(self, kwds)
 
     def run(self):
+        with self.worker_pool():
+            self._run_core()
+
+    def _run_core(self):
         self.n_iterations = 0
 
         # prepare for first step
@@ -1047,5 +1221,6 @@ def _run_core(self):
         self.calculate_esds()
 
     def run(self):
-        self._run_core()
+        with self.worker_pool():
+            self._run_core()
         self.calculate_esds()
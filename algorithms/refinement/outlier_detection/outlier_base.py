@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
+import multiprocessing
 from math import pi
 
 from libtbx.phil import parse
@@ -23,6 +24,7 @@ def __init__(
         separate_experiments=True,
         separate_panels=True,
         block_width=None,
+        nproc=1,
     ):
 
         # column names of the data in which to look for outliers
@@ -42,6 +44,9 @@ def __init__(
         # block width for splitting scans over phi, or None for no split
         self._block_width = block_width
 
+        # number of processes over which to run the outlier detection jobs
+        self._nproc = nproc
+
         # the number of rejections
         self.nreject = 0
 
@@ -71,6 +76,46 @@ def _detect_outliers(self, cols):
         # to be implemented by derived classes
         raise NotImplementedError()
 
+    def _detect_outliers_in_jobs(self, job_cols):
+        """Perform outlier detection for each job, given as a list of cols for
+        each job (or None for a job to skip), and return a list of the flex.bool
+        outliers for each job (or None). The jobs are independent, so are run in
+        parallel if nproc > 1"""
+
+        results = [None] * len(job_cols)
+        todo = [i for i, cols in enumerate(job_cols) if cols is not None]
+        nproc = min(self._nproc, len(todo))
+
+        # Each job sets its own random seed, drawn here, so that the results of
+        # randomised algorithms do not depend on nproc or on how the jobs are
+        # shared between the worker processes. A final seed leaves the random
+        # state of this process the same afterwards, whichever path is taken
+        seeds = [int(e * 2 ** 31) for e in flex.random_double(len(todo) + 1)]
+        final_seed = seeds.pop()
+        if nproc > 1:
+            with multiprocessing.Pool(
+                processes=nproc,
+                initializer=_init_outlier_worker,
+                initargs=(self, job_cols),
+            ) as pool:
+                outliers = pool.map(_detect_outliers_in_worker, zip(todo, seeds), 1)
+        else:
+            outliers = [
+                self._detect_outliers_with_seed(job_cols[i], seed)
+                for i, seed in zip(todo, seeds)
+            ]
+        flex.set_random_seed(final_seed)
+        for i, o in zip(todo, outliers):
+            results[i] = o
+        return results
+
+    def _detect_outliers_with_seed(self, cols, seed):
+        """Perform outlier detection for the input cols, having first set the
+        random seed"""
+
+        flex.set_random_seed(seed)
+        return self._detect_outliers(cols)
+
     def __call__(self, reflections):
         """Identify outliers in the input and set the centroid_outlier flag.
         Return True if any outliers were detected, otherwise False"""
@@ -198,10 +243,20 @@ def __call__(self, reflections):
         header.extend(["Nref", "Nout", "%out"])
         rows = []
 
+        # determine the position of outliers on each sub-dataset with enough
+        # reflections, getting the subset of data as a list of columns
+        job_outliers = self._detect_outliers_in_jobs(
+            [
+                [job["data"][col] for col in self._cols]
+                if len(job["indices"]) >= self._min_num_obs
+                else None
+                for job in jobs3
+            ]
+        )
+
         # now loop over the lowest level of splits
         for i, job in enumerate(jobs3):
 
-            data = job["data"]
             indices = job["indices"]
             iexp = job["id"]
             ipanel = job["panel"]
@@ -209,14 +264,8 @@ def __call__(self, reflections):
 
             if nref >= self._min_num_obs:
 
-                # get the subset of data as a list of columns
-                cols = [data[col] for col in self._cols]
-
-                # determine the position of outliers on this sub-dataset
-                outliers = self._detect_outliers(cols)
-
                 # get positions of outliers from the original matches
-                ioutliers = indices.select(outliers)
+                ioutliers = indices.select(job_outliers[i])
 
             elif nref > 0:
                 # too few reflections in the job
@@ -270,6 +319,22 @@ def __call__(self, reflections):
         return True
 
 
+# The outlier detector and the data for each job, shared by all the jobs run in
+# a worker process, set by _init_outlier_worker
+_outlier_worker_data = None
+
+
+def _init_outlier_worker(detector, job_cols):
+    global _outlier_worker_data
+    _outlier_worker_data = (detector, job_cols)
+
+
+def _detect_outliers_in_worker(args):
+    detector, job_cols = _outlier_worker_data
+    i, seed = args
+    return detector._detect_outliers_with_seed(job_cols[i], seed)
+
+
 # The phil scope for outlier rejection
 phil_str = """
 outlier
@@ -318,6 +383,12 @@ def __call__(self, reflections):
     .type = float(value_min=1.0)
     .expert_level = 1
 
+  nproc = 1
+    .help = "The number of processes over which to run the independent outlier"
+            "rejection jobs for each experiment, panel and block of phi."
+    .type = int(value_min=1)
+    .expert_level = 1
+
   tukey
     .help = "Options for the tukey outlier rejector"
     .expert_level = 1
@@ -448,6 +519,7 @@ def from_parameters_and_colnames(params, colnames):
             separate_experiments=params.outlier.separate_experiments,
             separate_panels=params.outlier.separate_panels,
             block_width=params.outlier.block_width,
+            nproc=params.outlier.nproc,
             **kwargs
         )
         return od
@@ -69,7 +69,7 @@ def build_gradients(self, parameterisation, isel=None, imatch=None):
                 ds_dp.set_selected(pair.iselection, pair.derivative)
 
             # First select only elements relevant to the current gradient calculation
-            # block (i.e. if nproc > 1 or gradient_calculation_blocksize was set)
+            # block (i.e. if the matches were split into more than one block)
             if imatch is not None:
                 ds_dp = ds_dp.select(imatch)
 
@@ -388,16 +388,8 @@ def __init__(
         # and proceed to sort by id and panel. This is required for the C++ extension
         # modules to allow for nlogn subselection of values used in refinement.
         l_id = reflections["id"]
-        id0 = l_id[0]
-        for id_x in l_id[1:]:
-            if id0 <= id_x:
-                id0 = id_x
-            else:
-                reflections.sort("id")  # Ensuring the ref_table is sorted by id
-                reflections.subsort(
-                    "id", "panel"
-                )  # Ensuring that within each sorted id block, sorting is next performed by panel
-                break
+        if len(l_id) > 1 and (l_id[1:] < l_id[:-1]).count(True):
+            reflections.sort(["id", "panel"])
 
         # set up the reflection inclusion criteria
         self._close_to_spindle_cutoff = close_to_spindle_cutoff  # close to spindle
@@ -33,7 +33,11 @@
     gradient_calculation_blocksize = None
       .help = "Maximum number of reflections to use for gradient calculation."
               "If there are more reflections than this in the manager then"
-              "the minimiser must do the full calculation in blocks."
+              "the minimiser must do the full calculation in blocks. For the"
+              "least squares engines, each block is folded into the normal"
+              "equations as it is calculated, so this bounds the memory"
+              "needed for the Jacobian, independent of the number of"
+              "reflections. If None, a maximum of 20000 reflections is used."
       .type = int(value_min=1)
 """
 phil_scope = parse(phil_str)
@@ -131,6 +135,10 @@ class Target(object):
     rmsd_names = ["RMSD_X", "RMSD_Y", "RMSD_Phi"]
     rmsd_units = ["mm", "mm", "rad"]
 
+    # Maximum number of reflections for a gradient calculation if not set, so
+    # that the memory needed for the Jacobian is always bounded
+    _default_gradient_calculation_blocksize = 20000
+
     def __init__(
         self,
         experiments,
@@ -151,8 +159,11 @@ def __init__(
         self._rmsds = None
         self._matches = None
 
-        # Keep maximum number of reflections used for Jacobian calculation, if
-        # a cutoff is required
+        # Keep maximum number of reflections used for Jacobian calculation
+        if gradient_calculation_blocksize is None:
+            gradient_calculation_blocksize = (
+                self._default_gradient_calculation_blocksize
+            )
         self._gradient_calculation_blocksize = gradient_calculation_blocksize
 
     @property
@@ -207,6 +218,14 @@ def predict(self):
         # collect the matches
         self.update_matches(force=True)
 
+    def predict_for_block(self, indices):
+        """perform prediction only for the observations with the specified
+        indices, as given by get_match_indices, and return them as a block of
+        matches"""
+
+        block = self._reflection_manager.get_obs().select(indices)
+        return self._predict_core(block)
+
     def predict_for_free_reflections(self):
         """perform prediction for the reflections not used for refinement"""
 
@@ -375,11 +394,12 @@ def compute_residuals(self):
         self.update_matches()
         return self._extract_residuals_and_weights(self._matches)
 
-    def split_matches_into_blocks(self, nproc=1):
-        """Return a list of the matches, split into blocks according to the
-        gradient_calculation_blocksize parameter and the number of processes (if relevant).
-        The number of blocks will be set such that the total number of reflections
-        being processed by concurrent processes does not exceed gradient_calculation_blocksize"""
+    def match_block_ranges(self, nproc=1):
+        """Return the (start, end) ranges of the blocks that the matches are split
+        into, according to the gradient_calculation_blocksize parameter and the
+        number of processes (if relevant). The number of blocks will be set such
+        that the total number of reflections being processed by concurrent
+        processes does not exceed gradient_calculation_blocksize"""
 
         self.update_matches()
 
@@ -388,27 +408,47 @@ def split_matches_into_blocks(self, nproc=1):
         # expensive) way to do this is to add an index column to the matches table
         self._matches["imatch"] = flex.size_t_range(len(self._matches))
 
-        if self._gradient_calculation_blocksize:
-            nblocks = int(
-                math.floor(
-                    len(self._matches) * nproc / self._gradient_calculation_blocksize
-                )
+        nblocks = int(
+            math.floor(
+                len(self._matches) * nproc / self._gradient_calculation_blocksize
             )
-        else:
-            nblocks = nproc
+        )
+        nblocks = max(nblocks, nproc)
         # ensure at least 100 reflections per block
         nblocks = min(nblocks, int(len(self._matches) / 100))
         nblocks = max(nblocks, 1)
         blocksize = int(math.floor(len(self._matches) / nblocks))
-        blocks = []
+        ranges = []
         for block_num in range(nblocks - 1):
             start = block_num * blocksize
             end = (block_num + 1) * blocksize
-            blocks.append(self._matches[start:end])
+            ranges.append((start, end))
         start = (nblocks - 1) * blocksize
         end = len(self._matches)
-        blocks.append(self._matches[start:end])
-        return blocks
+        ranges.append((start, end))
+        return ranges
+
+    def get_match_indices(self):
+        """return the indices of the matches in the managed observations"""
+
+        reflections = self._reflection_manager.get_obs()
+        return reflections.get_flags(reflections.flags.used_in_refinement).iselection()
+
+    def get_match_block(self, start, end):
+        """Return a block of the matches, with a range from match_block_ranges"""
+
+        return self._matches[start:end]
+
+    def split_matches_into_blocks(self, nproc=1):
+        """Return a list of the matches, split into blocks according to the
+        gradient_calculation_blocksize parameter and the number of processes (if relevant).
+        The number of blocks will be set such that the total number of reflections
+        being processed by concurrent processes does not exceed gradient_calculation_blocksize"""
+
+        return [
+            self.get_match_block(start, end)
+            for start, end in self.match_block_ranges(nproc=nproc)
+        ]
 
     def compute_residuals_and_gradients(self, block=None):
         """return the vector of residuals plus their gradients and weights for
@@ -144,6 +144,20 @@ def __init__(
 
         return
 
+    def _predict_core(self, reflections):
+        """perform prediction for the specified reflections"""
+
+        # set twotheta in place
+        self._reflection_predictor(reflections)
+
+        # calculate  residuals
+        reflections["2theta_resid"] = (
+            reflections["2theta_cal.rad"] - reflections["2theta_obs.rad"]
+        )
+        reflections["2theta_resid2"] = flex.pow2(reflections["2theta_resid"])
+
+        return reflections
+
     def predict(self):
         """perform reflection prediction for the working reflections and update the
         reflection manager"""
@@ -154,14 +168,8 @@ def predict(self):
         # reset the 'use' flag for all observations
         self._reflection_manager.reset_accepted_reflections()
 
-        # set twotheta in place
-        self._reflection_predictor(reflections)
-
-        # calculate  residuals
-        reflections["2theta_resid"] = (
-            reflections["2theta_cal.rad"] - reflections["2theta_obs.rad"]
-        )
-        reflections["2theta_resid2"] = flex.pow2(reflections["2theta_resid"])
+        # predict
+        reflections = self._predict_core(reflections)
 
         # set used_in_refinement flag to all those that had predictions
         mask = reflections.get_flags(reflections.flags.predicted)
@@ -12,6 +12,7 @@
 from scitbx import sparse
 
 from dials.array_family import flex
+from dials_scaling_ext import create_h_index_matrix, h_index_matrix_group_ids
 
 
 def map_indices_to_asu(miller_indices, space_group, anomalous=False):
@@ -476,8 +477,11 @@ def add_data(self, dataset_id, group_ids, reflections):
             dataset_id,
         )
         assert "asu_miller_index" in reflections
-        for i, id_ in enumerate(group_ids):
-            self.h_index_matrix[i + self._setup_info["next_row"], id_] = 1.0
+        self.h_index_matrix.assign_block(
+            create_h_index_matrix(group_ids, self.h_index_matrix.n_cols),
+            self._setup_info["next_row"],
+            0,
+        )
         self.dataset_info[dataset_id] = {"start_index": self._setup_info["next_row"]}
         self._setup_info["next_row"] += len(group_ids)
         self._setup_info["next_dataset"] += 1
@@ -507,12 +511,24 @@ def group_multiplicities(self):
 
     def select(self, sel):
         """Select a subset of the data, returning a new IhTableBlock object."""
+        return self._select(sel, h_index_matrix_group_ids(self.h_index_matrix))
+
+    def _select(self, sel, group_ids):
+        """Select a subset of the data, given the group id of each reflection."""
         Ih_table = self.Ih_table.select(sel)
-        h_idx_sel = self.h_expand_matrix.select_columns(sel.iselection())
-        reduced_h_idx = h_idx_sel.transpose()
-        unity = flex.double(reduced_h_idx.n_rows, 1.0)
-        nz_col_sel = (unity * reduced_h_idx) > 0
-        h_index_matrix = reduced_h_idx.select_columns(nz_col_sel.iselection())
+        # Renumber the remaining groups contiguously, then build the reduced
+        # h_index_matrix in a single pass from the selected group ids.
+        group_ids = group_ids.select(sel)
+        groups_present = flex.bool(self.n_groups, False)
+        groups_present.set_selected(group_ids, True)
+        n_groups = groups_present.count(True)
+        new_group_ids = flex.size_t(self.n_groups, 0)
+        new_group_ids.set_selected(
+            groups_present.iselection(), flex.size_t_range(n_groups)
+        )
+        h_index_matrix = create_h_index_matrix(
+            new_group_ids.select(group_ids), n_groups
+        )
         h_expand = h_index_matrix.transpose()
         newtable = IhTableBlock(n_groups=0, n_refl=0, n_datasets=self.n_datasets)
         newtable.Ih_table = Ih_table
@@ -533,17 +549,14 @@ def select(self, sel):
 
     def select_on_groups(self, sel):
         """Select a subset of the unique groups, returning a new IhTableBlock."""
-        reduced_h_idx = self.h_index_matrix.select_columns(sel.iselection())
-        unity = flex.double(reduced_h_idx.n_cols, 1.0)
-        nz_row_sel = (unity * reduced_h_idx.transpose()) > 0
-        return self.select(nz_row_sel)
+        group_ids = h_index_matrix_group_ids(self.h_index_matrix)
+        return self._select(sel.select(group_ids), group_ids)
 
     def select_on_groups_isel(self, isel):
         """Select a subset of the unique groups, returning a new IhTableBlock."""
-        reduced_h_idx = self.h_index_matrix.select_columns(isel)
-        unity = flex.double(reduced_h_idx.n_cols, 1.0)
-        nz_row_sel = (unity * reduced_h_idx.transpose()) > 0
-        return self.select(nz_row_sel)
+        sel = flex.bool(self.n_groups, False)
+        sel.set_selected(isel, True)
+        return self.select_on_groups(sel)
 
     def calc_Ih(self):
         """Calculate the current best estimate for Ih for each reflection group."""
@@ -18,6 +18,18 @@ namespace dials_scaling { namespace boost_python {
     def("elementwise_square", &elementwise_square, (arg("m")));
   }
 
+  void export_create_h_index_matrix() {
+    def("create_h_index_matrix",
+        &create_h_index_matrix<int>,
+        (arg("group_ids"), arg("n_groups")));
+    def("create_h_index_matrix",
+        &create_h_index_matrix<std::size_t>,
+        (arg("group_ids"), arg("n_groups")));
+    def("h_index_matrix_group_ids",
+        &h_index_matrix_group_ids,
+        (arg("h_index_matrix")));
+  }
+
   void export_calc_dIh_by_dpi() {
     def("calc_dIh_by_dpi",
         &calculate_dIh_by_dpi,
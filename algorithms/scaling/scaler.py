@@ -951,17 +951,6 @@ def _update_for_minimisation(self, apm, block_id, calc_Ih=True):
         self.Ih_table.update_weights(block_id)
         if calc_Ih:
             self.Ih_table.calc_Ih(block_id)
-        # The parallelisation below would work if sparse matrices were
-        # pickleable (I think!) - with more benefit for larger number of datasets.'''
-        """def task_wrapper(block):
-            s, d = RefinerCalculator.calculate_scales_and_derivatives(block)
-            return s, d
-        blocks = apm.apm_list
-        task_results = easy_mp.parallel_map(func=task_wrapper, iterable=blocks,
-            processes=n_datasets, method="multiprocessing",
-            preserve_exception_message=True
-        )
-        scales_list, derivs_list = zip(*task_results)"""
 
     def _update_model_data(self):
         for i, scaler in enumerate(self.active_scalers):
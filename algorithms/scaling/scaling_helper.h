@@ -121,6 +121,43 @@ scitbx::sparse::matrix<double> elementwise_square(scitbx::sparse::matrix<double>
   return result;
 }
 
+/**
+ * Create a sparse h_index_matrix from an array of group ids. The matrix has
+ * dimension n_refl x n_groups, with a single unit entry in each row i, in the
+ * column given by group_ids[i].
+ */
+template <typename IntType>
+scitbx::sparse::matrix<double> create_h_index_matrix(
+  scitbx::af::const_ref<IntType> group_ids,
+  std::size_t n_groups) {
+  scitbx::sparse::matrix<double> result(group_ids.size(), n_groups);
+  for (std::size_t i = 0; i < group_ids.size(); ++i) {
+    // A negative signed id wraps to a large value, so is also rejected here
+    std::size_t group_id = static_cast<std::size_t>(group_ids[i]);
+    DIALS_ASSERT(group_id < n_groups);
+    result(i, group_id) = 1.0;
+  }
+  result.compact();
+  return result;
+}
+
+/**
+ * The inverse of create_h_index_matrix: return the group id (column index) of
+ * the nonzero element in each row of a h_index_matrix.
+ */
+scitbx::af::shared<std::size_t> h_index_matrix_group_ids(
+  scitbx::sparse::matrix<double> h_index_mat) {
+  scitbx::af::shared<std::size_t> group_ids(h_index_mat.n_rows(), 0);
+  for (std::size_t j = 0; j < h_index_mat.n_cols(); j++) {
+    for (scitbx::sparse::matrix<double>::row_iterator p = h_index_mat.col(j).begin();
+         p != h_index_mat.col(j).end();
+         ++p) {
+      group_ids[p.index()] = j;
+    }
+  }
+  return group_ids;
+}
+
 scitbx::af::shared<double> limit_outlier_weights(
   scitbx::af::shared<double> weights,
   scitbx::sparse::matrix<double> h_index_mat) {
@@ -159,8 +159,8 @@
     nproc = 1
       .type = int(value_min=1)
       .help = "Number of blocks to divide the data into for minimisation.
-              This also sets the number of processes to use if the option is
-              available."
+              This also sets the number of worker processes used to evaluate
+              the blocks in parallel during minimisation."
       .expert_level = 2
     use_free_set = False
       .type = bool
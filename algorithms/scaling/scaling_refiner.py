@@ -5,9 +5,12 @@
 
 from __future__ import absolute_import, division, print_function
 
+import contextlib
 import logging
+import multiprocessing
 
 from libtbx.phil import parse
+from scitbx.lstbx import normal_eqns
 
 from dials.algorithms.refinement.engine import (
     GaussNewtonIterations,
@@ -149,6 +152,137 @@ def print_step_table(refinery):
     logger.info(refinery.history.reason_for_termination)
 
 
+# The BlockEvaluator used by the worker processes of its pool, which the
+# workers inherit when they are forked
+_pool_block_evaluator = None
+
+
+def _pool_evaluate_block(args):
+    """Task run in a persistent worker process, see BlockEvaluator.worker_pool"""
+    return _pool_block_evaluator.evaluate_block_in_worker(*args)
+
+
+class BlockEvaluator(object):
+    """
+    Update each minimisation block of a scaler and evaluate the target for it.
+
+    The per-block work is independent, as each block owns its own section of
+    the Ih_table. With nproc > 1, the blocks are evaluated by a persistent pool
+    of worker processes for the duration of a refinement run. The workers are
+    forked once, so each holds its own copy of the scaler, Ih_table and
+    parameter manager. At each step they are sent only the parameter vector,
+    and they return the target terms for a block, with the updated scale
+    factors and Ih values to keep the Ih_table of this process current. The
+    results are returned in block order, so that accumulation is
+    deterministic regardless of nproc.
+    """
+
+    def __init__(self, scaler, apm, nproc=1):
+        self._scaler = scaler
+        self._apm = apm
+        self._nproc = nproc
+        self._pool = None
+        # in a worker, the parameter vector the blocks were last updated for
+        self._pool_x = None
+
+    @contextlib.contextmanager
+    def worker_pool(self):
+        """Context manager providing the persistent pool of worker processes, if
+        nproc > 1 and there is more than one block. The pool requires the fork
+        start method, as the scaler cannot be pickled, so elsewhere the blocks
+        are evaluated serially."""
+
+        global _pool_block_evaluator
+
+        n_blocks = len(self._scaler.get_blocks_for_minimisation())
+        if (
+            self._nproc < 2
+            or n_blocks < 2
+            or "fork" not in multiprocessing.get_all_start_methods()
+        ):
+            yield
+            return
+
+        _pool_block_evaluator = self
+        try:
+            pool = multiprocessing.get_context("fork").Pool(
+                processes=min(self._nproc, n_blocks)
+            )
+        finally:
+            _pool_block_evaluator = None
+
+        self._pool = pool
+        try:
+            yield
+        finally:
+            self._pool = None
+            pool.terminate()
+            pool.join()
+
+    def __call__(self, method):
+        """Update each block for the current parameter values and return the list
+        of results of the named method for each block, in block order"""
+
+        work_blocks = self._scaler.get_blocks_for_minimisation()
+        if self._pool is None:
+            results = []
+            for block_id, block in enumerate(work_blocks):
+                self._scaler.update_for_minimisation(self._apm, block_id)
+                results.append(getattr(self, method)(block))
+            return results
+
+        x = self._apm.get_param_vals()
+        tasks = [(x, block_id, method) for block_id in range(len(work_blocks))]
+        results = []
+        for block, (result, scales, Ih_values) in zip(
+            work_blocks, self._pool.imap(_pool_evaluate_block, tasks)
+        ):
+            block.Ih_table["inverse_scale_factor"] = scales
+            block.Ih_table["Ih_values"] = Ih_values
+            results.append(result)
+        return results
+
+    def evaluate_block_in_worker(self, x, block_id, method):
+        """Update a block for the parameter vector x and evaluate the named method
+        for it. This is called in a worker process, for which the parameter values
+        are set only when x changes."""
+
+        if self._pool_x is None or not (
+            len(x) == len(self._pool_x) and (x == self._pool_x).all_eq(True)
+        ):
+            self._apm.set_param_vals(x)
+            self._pool_x = x.deep_copy()
+        self._scaler.update_for_minimisation(self._apm, block_id)
+        block = self._scaler.get_blocks_for_minimisation()[block_id]
+        return (
+            getattr(self, method)(block),
+            block.inverse_scale_factors,
+            block.Ih_values,
+        )
+
+    def functional_gradients(self, block):
+        return self._apm.compute_functional_gradients(block)
+
+    def residuals(self, block):
+        return self._apm.compute_residuals(block)
+
+    def reduced_equations(self, block):
+        """The residuals and weights for a block, with its contribution to the
+        normal matrix (as the packed upper triangle) and right hand side, rather
+        than the Jacobian itself, which cannot be pickled"""
+
+        residuals, jacobian, weights = self._apm.compute_residuals_and_gradients(block)
+        ls = normal_eqns.non_linear_ls(n_parameters=jacobian.n_cols)
+        ls.add_equations(residuals, jacobian, weights)
+        step_equations = ls.step_equations()
+        return (
+            residuals,
+            weights,
+            step_equations.normal_matrix_packed_u(),
+            step_equations.right_hand_side(),
+        )
+
+
 class ScalingRefinery(object):
     "mixin class to add extra return method"
 
@@ -157,6 +291,15 @@ def __init__(self, scaler, target, prediction_parameterisation, *args, **kwargs)
         self._scaler = scaler
         self._rmsd_tolerance = scaler.params.scaling_refinery.rmsd_tolerance
         self._parameters = prediction_parameterisation
+        self._block_evaluator = BlockEvaluator(
+            scaler,
+            prediction_parameterisation,
+            nproc=scaler.params.scaling_options.nproc,
+        )
+
+    def worker_pool(self):
+        """Provide the pool of processes evaluating the minimisation blocks"""
+        return self._block_evaluator.worker_pool()
 
     def print_step_table(self):
         print_step_table(self)
@@ -223,27 +366,15 @@ def __init__(self, scaler, *args, **kwargs):
         ScalingRefinery.__init__(self, scaler, *args, **kwargs)
         SimpleLBFGS.__init__(self, *args, **kwargs)
 
+    def run(self):
+        with self.worker_pool():
+            return SimpleLBFGS.run(self)
+
     def compute_functional_gradients_and_curvatures(self):
         """overwrite method to avoid calls to 'blocks' methods of target"""
         self.prepare_for_step()
 
-        work_blocks = self._scaler.get_blocks_for_minimisation()
-
-        f = []
-        gi = []
-        for block_id, block in enumerate(work_blocks):
-            self._scaler.update_for_minimisation(self._parameters, block_id)
-            fb, gb = self._parameters.compute_functional_gradients(block)
-            f.append(fb)
-            gi.append(gb)
-        """task_results = easy_mp.parallel_map(
-            func=self._target.compute_functional_gradients,
-            iterable=blocks,
-            processes=self._scaler.params.scaling_options.nproc,
-            method="multiprocessing",
-            preserve_exception_message=True
-        )
-        f, gi = zip(*task_results)"""
+        f, gi = zip(*self._block_evaluator("functional_gradients"))
 
         f = sum(f)
         g = gi[0]
@@ -275,32 +406,14 @@ def build_up(self, objective_only=False):
         # Reset the state to construction time, i.e. no equations accumulated
         self.reset()
 
-        work_blocks = self._scaler.get_blocks_for_minimisation()
-
-        # observation terms
+        # observation terms, evaluated per block (by the worker processes if
+        # nproc > 1) and accumulated in block order
         if objective_only:
-            for block_id, block in enumerate(work_blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                residuals, weights = self._parameters.compute_residuals(block)
+            for residuals, weights in self._block_evaluator("residuals"):
                 self.add_residuals(residuals, weights)
         else:
-            self._jacobian = None
-
-            for block_id, block in enumerate(work_blocks):
-                self._scaler.update_for_minimisation(self._parameters, block_id)
-                (
-                    residuals,
-                    jacobian,
-                    weights,
-                ) = self._parameters.compute_residuals_and_gradients(block)
-                self.add_equations(residuals, jacobian, weights)
-            """task_results = easy_mp.pool_map(
-                fixed_func=self._target.compute_residuals_and_gradients,
-                iterable=blocks,
-                processes=self._scaler.params.scaling_options.nproc
-            )
-            for result in task_results:
-                self.add_equations(result[0], result[1], result[2])"""
+            for result in self._block_evaluator("reduced_equations"):
+                self.add_reduced_equations(*result)
 
         restraints = self._parameters.compute_restraints_residuals_and_gradients(
             self._parameters
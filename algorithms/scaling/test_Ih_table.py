@@ -7,6 +7,7 @@
 
 from dials.algorithms.scaling.Ih_table import IhTable, IhTableBlock, map_indices_to_asu
 from dials.array_family import flex
+from dials_scaling_ext import create_h_index_matrix, h_index_matrix_group_ids
 
 
 @pytest.fixture()
@@ -132,6 +133,26 @@ def generated_refl_for_splitting_2():
     return reflections
 
 
+def test_create_h_index_matrix():
+    """Test the bulk construction of a h_index_matrix from group ids."""
+    group_ids = flex.int([0, 1, 0, 2, 3, 4, 4])
+    h_idx = create_h_index_matrix(group_ids, 5)
+    expected = sparse.matrix(7, 5)
+    for i, id_ in enumerate(group_ids):
+        expected[i, id_] = 1.0
+    assert h_idx == expected
+    assert h_idx.non_zeroes == 7
+    assert list(h_index_matrix_group_ids(h_idx)) == list(group_ids)
+
+    h_idx = create_h_index_matrix(flex.size_t([1, 1, 0]), 2)
+    assert h_idx.n_rows == 3
+    assert h_idx.n_cols == 2
+    assert list(h_index_matrix_group_ids(h_idx)) == [1, 1, 0]
+
+    with pytest.raises(RuntimeError):
+        create_h_index_matrix(flex.int([0, 2]), 2)
+
+
 def test_IhTableblock_onedataset(large_reflection_table, test_sg):
     """Test direct initialisation of Ih_table block"""
     asu_indices = map_indices_to_asu(large_reflection_table["miller_index"], test_sg)
@@ -0,0 +1,79 @@
+"""Tests for the scaling refinery helpers."""
+
+import pytest
+
+from scitbx.array_family import flex
+
+from dials.algorithms.scaling.scaling_refiner import BlockEvaluator
+
+
+class FakeBlock(object):
+    def __init__(self, n):
+        self.Ih_table = {
+            "intensity": flex.double(range(1, n + 1)),
+            "inverse_scale_factor": flex.double(n, 1.0),
+            "Ih_values": flex.double(n, 0.0),
+        }
+
+    @property
+    def inverse_scale_factors(self):
+        return self.Ih_table["inverse_scale_factor"]
+
+    @property
+    def Ih_values(self):
+        return self.Ih_table["Ih_values"]
+
+
+class FakeScaler(object):
+    def __init__(self, sizes):
+        self.blocks = [FakeBlock(n) for n in sizes]
+
+    def get_blocks_for_minimisation(self):
+        return self.blocks
+
+    def update_for_minimisation(self, apm, block_id):
+        block = self.blocks[block_id]
+        n = len(block.Ih_table["intensity"])
+        block.Ih_table["inverse_scale_factor"] = flex.double(n, apm.x[0])
+        block.Ih_table["Ih_values"] = block.Ih_table["intensity"] / apm.x[0]
+
+
+class FakeApm(object):
+    def __init__(self):
+        self.x = flex.double([1.0])
+
+    def set_param_vals(self, x):
+        self.x = x
+
+    def get_param_vals(self):
+        return self.x
+
+    def compute_functional_gradients(self, block):
+        scales = block.inverse_scale_factors
+        return flex.sum(scales * block.Ih_values), flex.double([flex.sum(scales)])
+
+
+@pytest.mark.parametrize("nproc", [1, 3])
+def test_block_evaluator(nproc):
+    """Test that each block is updated and evaluated, with ordered results,
+    and that the blocks of the parent process are kept current."""
+    sizes = [2, 3, 4, 5]
+    scaler = FakeScaler(sizes)
+    apm = FakeApm()
+    evaluator = BlockEvaluator(scaler, apm, nproc=nproc)
+
+    with evaluator.worker_pool():
+        for scale in (2.0, 4.0):
+            apm.set_param_vals(flex.double([scale]))
+            results = evaluator("functional_gradients")
+            assert [f for f, _ in results] == pytest.approx(
+                [n * (n + 1) / 2 for n in sizes]
+            )
+            assert [g[0] for _, g in results] == pytest.approx(
+                [n * scale for n in sizes]
+            )
+            for block, n in zip(scaler.blocks, sizes):
+                assert list(block.inverse_scale_factors) == [scale] * n
+                assert list(block.Ih_values) == pytest.approx(
+                    [i / scale for i in range(1, n + 1)]
+                )
@@ -33,6 +33,13 @@ def generate_phil_scope():
       .type = str
       .help = "Prefix for the hot mask pickle file"
 
+    merge_hot_mask = None
+      .type = path
+      .multiple = True
+      .help = "Existing hot pixel masks, e.g. from previous runs of"
+              "dials.find_spots or dials.find_hot_pixels, to merge with the"
+              "hot pixels found in this run. Only used with write_hot_mask=True."
+
     force_2d = False
       .type = bool
       .help = "Do spot finding in 2D"
@@ -125,6 +132,13 @@ def generate_phil_scope():
       min_chunksize = 20
         .type = int(value_min=1)
         .help = "When chunksize is auto, this is the minimum chunksize"
+
+      prefetch = 0
+        .type = int(value_min=0)
+        .help = "If greater than zero, read images in a separate thread, up to"
+                "this many images ahead, while nproc processes threshold the"
+                "images that have already been read. Only used with njobs=1."
+        .expert_level = 2
     }
   }
   """,
@@ -452,6 +466,7 @@ def from_parameters(params=None, experiments=None):
             scan_range=params.spotfinder.scan_range,
             write_hot_mask=params.spotfinder.write_hot_mask,
             hot_mask_prefix=params.spotfinder.hot_mask_prefix,
+            merge_hot_masks=params.spotfinder.merge_hot_mask,
             mp_method=params.spotfinder.mp.method,
             mp_nproc=params.spotfinder.mp.nproc,
             mp_njobs=params.spotfinder.mp.njobs,
@@ -464,6 +479,7 @@ def from_parameters(params=None, experiments=None):
             max_spot_size=params.spotfinder.filter.max_spot_size,
             no_shoeboxes_2d=no_shoeboxes_2d,
             min_chunksize=params.spotfinder.mp.min_chunksize,
+            mp_prefetch=params.spotfinder.mp.prefetch,
         )
 
     @staticmethod
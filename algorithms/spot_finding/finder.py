@@ -2,10 +2,16 @@
 Contains implementation interface for finding spots on one or many images
 """
 
+import collections
 import logging
 import math
+import multiprocessing
 import os
 import pickle
+import queue
+import threading
+import time
+import uuid
 import warnings
 from typing import Iterable, Tuple
 
@@ -14,6 +20,11 @@
 from dxtbx.imageset import ImageSequence, ImageSet
 from dxtbx.model import ExperimentList
 
+from dials.algorithms.integration.image_cache import load_image, store_image
+from dials.algorithms.integration.transport import (
+    release_shared_memory,
+    shared_memory_available,
+)
 from dials.array_family import flex
 from dials.model.data import PixelList, PixelListLabeller
 from dials.util import Sorry, log
@@ -43,6 +54,90 @@ def __init__(self, pixel_list):
         self.pixel_list = pixel_list
 
 
+class HotPixelAccumulator:
+    """
+    A class to accumulate hot pixel candidates across images and runs.
+
+    Candidates are held as arrays of flattened pixel indices for each panel, so
+    they can be combined cheaply, and are only converted to a mask when needed.
+    The mask format is the same as that written by dials.find_spots and
+    dials.find_hot_pixels, so existing masks can be loaded and merged.
+    """
+
+    def __init__(self, image_sizes):
+        """
+        Initialise the accumulator
+
+        :param image_sizes: The (width, height) of each panel
+        """
+        self.image_sizes = [tuple(size) for size in image_sizes]
+        self.hot_pixels = tuple(flex.size_t() for _ in self.image_sizes)
+
+    @classmethod
+    def from_detector(cls, detector):
+        """Create an empty accumulator for a detector"""
+        return cls([p.get_image_size() for p in detector])
+
+    @classmethod
+    def from_mask(cls, mask):
+        """Create an accumulator from a hot pixel mask (False for hot pixels)"""
+        accumulator = cls([m.all()[::-1] for m in mask])
+        accumulator.add([(~m).as_1d().iselection() for m in mask])
+        return accumulator
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load a hot pixel mask pickle file into an accumulator"""
+        with open(filename, "rb") as infile:
+            return cls.from_mask(pickle.load(infile))
+
+    def add(self, hot_pixels):
+        """
+        Add candidate hot pixels
+
+        :param hot_pixels: A flattened pixel index array for each panel
+        """
+        assert len(hot_pixels) == len(self.hot_pixels), "Inconsistent panels"
+        for h1, h2 in zip(self.hot_pixels, hot_pixels):
+            h1.extend(h2)
+
+    def add_xy(self, panel, x, y):
+        """
+        Add candidate hot pixels given as pixel coordinates on a panel
+
+        :param panel: The panel number
+        :param x: The fast pixel coordinates
+        :param y: The slow pixel coordinates
+        """
+        width = self.image_sizes[panel][0]
+        self.hot_pixels[panel].extend(flex.size_t(y) * width + flex.size_t(x))
+
+    def merge(self, other):
+        """Merge the candidates of another accumulator into this one"""
+        assert self.image_sizes == other.image_sizes, "Inconsistent detectors"
+        self.add(other.hot_pixels)
+
+    def as_mask(self):
+        """Return the hot pixel mask, with False marking the hot pixels"""
+        mask = []
+        for (width, height), hp in zip(self.image_sizes, self.hot_pixels):
+            m = flex.bool(flex.grid(height, width), True)
+            m.set_selected(hp, False)
+            mask.append(m)
+        return tuple(mask)
+
+    def num_hot(self, mask=None):
+        """The number of distinct hot pixels"""
+        if mask is None:
+            mask = self.as_mask()
+        return sum(m.count(False) for m in mask)
+
+    def to_file(self, filename):
+        """Write the hot pixel mask as a pickle file"""
+        with open(filename, "wb") as outfile:
+            pickle.dump(self.as_mask(), outfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
 class ExtractPixelsFromImage:
     """
     A class to extract pixels from a single image
@@ -83,6 +178,16 @@ def __call__(self, index):
 
         :param index: The index of the image
         """
+        image, mask = self.read(index)
+        return self.process(index, image, mask)
+
+    def read(self, index):
+        """
+        Read the corrected image data and the mask for an image
+
+        :param index: The index of the image
+        :return: A tuple of the image data and mask
+        """
         # Parallel reading of HDF5 from the same handle is not allowed. Python
         # multiprocessing is a bit messed up and used fork on linux so need to
         # close and reopen file.
@@ -91,18 +196,6 @@ def __call__(self, index):
                 self.imageset.reader().nullify_format_instance()
             self.first = False
 
-        # Get the frame number
-        if isinstance(self.imageset, ImageSequence):
-            frame = self.imageset.get_array_range()[0] + index
-        else:
-            ind = self.imageset.indices()
-            if len(ind) > 1:
-                assert all(i1 + 1 == i2 for i1, i2 in zip(ind[0:-1], ind[1:-1]))
-            frame = ind[index]
-
-        # Create the list of pixel lists
-        pixel_list = []
-
         # Get the image and mask
         image = self.imageset.get_corrected_data(index)
         mask = self.imageset.get_mask(index)
@@ -116,6 +209,27 @@ def __call__(self, index):
             "Number of masked pixels for image %i: %i"
             % (index, sum(m.count(False) for m in mask))
         )
+        return image, mask
+
+    def process(self, index, image, mask):
+        """
+        Threshold an image that has already been read
+
+        :param index: The index of the image
+        :param image: The corrected image data
+        :param mask: The image mask
+        """
+        # Get the frame number
+        if isinstance(self.imageset, ImageSequence):
+            frame = self.imageset.get_array_range()[0] + index
+        else:
+            ind = self.imageset.indices()
+            if len(ind) > 1:
+                assert all(i1 + 1 == i2 for i1, i2 in zip(ind[0:-1], ind[1:-1]))
+            frame = ind[index]
+
+        # Create the list of pixel lists
+        pixel_list = []
 
         # Add the images to the pixel lists
         num_strong = 0
@@ -222,18 +336,20 @@ def __init__(
         self.max_spot_size = max_spot_size
         self.filter_spots = filter_spots
 
-    def __call__(self, index):
+    def process(self, index, image, mask):
         """
-        Extract strong pixels from an image
+        Extract the strong spots from an image that has already been read
 
         :param index: The index of the image
+        :param image: The corrected image data
+        :param mask: The image mask
         """
         # Initialise the pixel labeller
         num_panels = len(self.imageset.get_detector())
         pixel_labeller = [PixelListLabeller() for p in range(num_panels)]
 
         # Call the super function
-        result = super().__call__(index)
+        result = super().process(index, image, mask)
 
         # Add pixel lists to the labeller
         assert len(pixel_labeller) == len(result.pixel_list), "Inconsistent size"
@@ -281,6 +397,145 @@ def __call__(self, task):
         return result, handlers[0].messages()
 
 
+# The ExtractPixelsFromImage used by the threshold worker processes of
+# extract_pixels_pipelined, set by _init_threshold_worker
+_threshold_worker_function = None
+
+
+def _init_threshold_worker(function):
+    global _threshold_worker_function
+    _threshold_worker_function = function
+
+
+def _threshold_image(args):
+    """Threshold an image in a worker process, returning the result and the
+    log messages"""
+    log.config_simple_cached()
+    index, image, mask = args
+    if isinstance(image, str):
+        # The image data was passed in the named shared memory segment
+        name = image
+        image = load_image(name)
+        assert image is not None, "Missing image data in %s" % name
+    result = _threshold_worker_function.process(index, image, mask)
+    handlers = logging.getLogger("dials").handlers
+    assert len(handlers) == 1, "Invalid number of logging handlers"
+    return result, handlers[0].messages()
+
+
+def extract_pixels_pipelined(function, indices, nproc=1, prefetch=1):
+    """
+    Extract strong pixels, overlapping the reading of images with thresholding
+
+    A single reader thread reads and decompresses images into a bounded buffer
+    of prefetch images, so that only one file handle is used. With nproc > 1,
+    the images are thresholded by a pool of nproc worker processes, each with
+    its own copy of the threshold function, otherwise in this thread. Where
+    shared memory is available, the reader thread writes the image data of
+    each image into a shared memory segment, which is removed once the image
+    has been thresholded, so that only the segment name and the much smaller
+    mask are pickled to the workers. The results are yielded in the order of
+    the indices.
+
+    :param function: An ExtractPixelsFromImage instance
+    :param indices: The image indices to process
+    :param nproc: The number of threshold worker processes
+    :param prefetch: The maximum number of images read ahead of thresholding
+    """
+    buffer = queue.Queue(maxsize=prefetch)
+    finished = object()
+    stop = threading.Event()
+    segments = []
+    prefix = None
+    if nproc > 1 and shared_memory_available():
+        prefix = "dials_%d_%s_" % (os.getpid(), uuid.uuid4().hex[:6])
+
+    def put(item):
+        # Wait for space in the buffer, unless the consumer has stopped
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(index):
+        image, mask = function.read(index)
+        if prefix is None:
+            return index, image, mask
+        name = prefix + str(index)
+        segments.append(name)
+        store_image(name, image)
+        return index, name, mask
+
+    def reader():
+        try:
+            for index in indices:
+                if stop.is_set() or not put(read(index)):
+                    return
+        except Exception as e:
+            put((finished, e, None))
+        else:
+            put((finished, None, None))
+
+    def images():
+        while True:
+            index, data, mask = buffer.get()
+            if index is finished:
+                if data is not None:
+                    raise data
+                return
+            yield index, data, mask
+
+    def release(args):
+        if prefix is not None:
+            release_shared_memory(args[1])
+
+    # Start the worker processes before the reader thread, so that they are
+    # not forked from a process with a running thread
+    pool = None
+    if nproc > 1:
+        pool = multiprocessing.Pool(
+            processes=nproc,
+            initializer=_init_threshold_worker,
+            initargs=(function,),
+        )
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        if pool is None:
+            for args in images():
+                yield function.process(*args)
+        else:
+            pending = collections.deque()
+            for args in images():
+                pending.append((args, pool.apply_async(_threshold_image, (args,))))
+                while len(pending) > nproc or (pending and pending[0][1].ready()):
+                    args, result = pending.popleft()
+                    result, messages = result.get()
+                    release(args)
+                    for message in messages:
+                        logger.handle(message)
+                    yield result
+            while pending:
+                args, result = pending.popleft()
+                result, messages = result.get()
+                release(args)
+                for message in messages:
+                    logger.handle(message)
+                yield result
+    finally:
+        # Stop the reader thread, which may be waiting for space in the buffer
+        stop.set()
+        thread.join()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        for name in segments:
+            release_shared_memory(name)
+
+
 def pixel_list_to_shoeboxes(
     imageset: ImageSet,
     pixel_labeller: Iterable[PixelListLabeller],
@@ -397,6 +652,7 @@ def __init__(
         no_shoeboxes_2d=False,
         min_chunksize=50,
         write_hot_pixel_mask=False,
+        mp_prefetch=0,
     ):
         """
         Initialise the class with the strategy
@@ -406,6 +662,8 @@ def __init__(
         :param mp_method: The multi processing method
         :param nproc: The number of processors
         :param max_strong_pixel_fraction: The maximum number of strong pixels
+        :param mp_prefetch: If > 0, overlap image reading with thresholding,
+                            reading up to this many images ahead
         """
         # Set the required strategies
         self.threshold_function = threshold_function
@@ -423,6 +681,7 @@ def __init__(
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
         self.write_hot_pixel_mask = write_hot_pixel_mask
+        self.mp_prefetch = mp_prefetch
 
     def __call__(self, imageset):
         """
@@ -510,7 +769,15 @@ def _find_spots(self, imageset):
 
         # Do the processing
         logger.info("Extracting strong pixels from images")
-        if mp_njobs > 1:
+        use_pipeline = self.mp_prefetch > 0 and mp_njobs == 1
+        if use_pipeline:
+            logger.info(
+                " Using a pipeline of 1 reader thread and %d threshold process(es),"
+                " reading up to %d image(s) ahead\n",
+                mp_nproc,
+                self.mp_prefetch,
+            )
+        elif mp_njobs > 1:
             logger.info(
                 " Using %s with %d parallel job(s) and %d processes per node\n",
                 mp_method,
@@ -519,7 +786,25 @@ def _find_spots(self, imageset):
             )
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n", mp_nproc)
-        if mp_nproc > 1 or mp_njobs > 1:
+        if use_pipeline:
+            st = time.time()
+            for result in extract_pixels_pipelined(
+                function, indices, nproc=mp_nproc, prefetch=self.mp_prefetch
+            ):
+                assert len(pixel_labeller) == len(
+                    result.pixel_list
+                ), "Inconsistent size"
+                for plabeller, plist in zip(pixel_labeller, result.pixel_list):
+                    plabeller.add(plist)
+                result.pixel_list = None
+            elapsed = time.time() - st
+            logger.info(
+                "Extracted strong pixels from %d images in %.2f seconds (%.1f frames/s)",
+                len(indices),
+                elapsed,
+                len(indices) / elapsed if elapsed > 0 else 0.0,
+            )
+        elif mp_nproc > 1 or mp_njobs > 1:
 
             def process_output(result):
                 for message in result[1]:
@@ -616,7 +901,15 @@ def _find_spots_2d_no_shoeboxes(self, imageset):
 
         # Do the processing
         logger.info("Extracting strong spots from images")
-        if mp_njobs > 1:
+        use_pipeline = self.mp_prefetch > 0 and mp_njobs == 1
+        if use_pipeline:
+            logger.info(
+                " Using a pipeline of 1 reader thread and %d threshold process(es),"
+                " reading up to %d image(s) ahead\n",
+                mp_nproc,
+                self.mp_prefetch,
+            )
+        elif mp_njobs > 1:
             logger.info(
                 " Using %s with %d parallel job(s) and %d processes per node\n",
                 mp_method,
@@ -625,7 +918,12 @@ def _find_spots_2d_no_shoeboxes(self, imageset):
             )
         else:
             logger.info(" Using multiprocessing with %d parallel job(s)\n", mp_nproc)
-        if mp_nproc > 1 or mp_njobs > 1:
+        if use_pipeline:
+            for result in extract_pixels_pipelined(
+                function, indices, nproc=mp_nproc, prefetch=self.mp_prefetch
+            ):
+                reflections.extend(result[0])
+        elif mp_nproc > 1 or mp_njobs > 1:
 
             def process_output(result):
                 for message in result[1]:
@@ -671,10 +969,12 @@ def __init__(
         scan_range=None,
         write_hot_mask=True,
         hot_mask_prefix="hot_mask",
+        merge_hot_masks=None,
         min_spot_size=1,
         max_spot_size=20,
         no_shoeboxes_2d=False,
         min_chunksize=50,
+        mp_prefetch=0,
     ):
         """
         Initialise the class.
@@ -682,6 +982,8 @@ def __init__(
         :param find_spots: The spot finding algorithm
         :param filter_spots: The spot filtering algorithm
         :param scan_range: The scan range to find spots over
+        :param merge_hot_masks: Hot pixel mask files from previous runs to
+                                merge into the hot mask
         """
 
         # Set the filter and some other stuff
@@ -695,6 +997,7 @@ def __init__(
         self.scan_range = scan_range
         self.write_hot_mask = write_hot_mask
         self.hot_mask_prefix = hot_mask_prefix
+        self.merge_hot_masks = merge_hot_masks or []
         self.min_spot_size = min_spot_size
         self.max_spot_size = max_spot_size
         self.mp_method = mp_method
@@ -703,6 +1006,7 @@ def __init__(
         self.mp_njobs = mp_njobs
         self.no_shoeboxes_2d = no_shoeboxes_2d
         self.min_chunksize = min_chunksize
+        self.mp_prefetch = mp_prefetch
 
     def __call__(self, experiments):
         warnings.warn(
@@ -817,6 +1121,7 @@ def _find_spots_in_imageset(self, imageset):
             no_shoeboxes_2d=self.no_shoeboxes_2d,
             min_chunksize=self.min_chunksize,
             write_hot_pixel_mask=self.write_hot_mask,
+            mp_prefetch=self.mp_prefetch,
         )
 
         # Get the max scan range
@@ -832,7 +1137,7 @@ def _find_spots_in_imageset(self, imageset):
             scan_range = self.scan_range
 
         # Get spots from bits of scan
-        hot_pixels = tuple(flex.size_t() for i in range(len(imageset.get_detector())))
+        hot_pixels = HotPixelAccumulator.from_detector(imageset.get_detector())
         reflections = flex.reflection_table()
         for j0, j1 in scan_range:
             # Make sure we were asked to do something sensible
@@ -850,8 +1155,7 @@ def _find_spots_in_imageset(self, imageset):
             r, h = extract_spots(imageset[j0:j1])
             reflections.extend(r)
             if h is not None:
-                for h1, h2 in zip(hot_pixels, h):
-                    h1.extend(h2)
+                hot_pixels.add(h)
 
         # Find hot pixels
         hot_mask = self._create_hot_mask(imageset, hot_pixels)
@@ -865,20 +1169,18 @@ def _create_hot_mask(self, imageset, hot_pixels):
         """
         # Write the hot mask
         if self.write_hot_mask:
-
-            # Create the hot pixel mask
-            hot_mask = tuple(
-                flex.bool(flex.grid(p.get_image_size()[::-1]), True)
-                for p in imageset.get_detector()
-            )
-            num_hot = 0
-            if hot_pixels:
-                for hp, hm in zip(hot_pixels, hot_mask):
-                    for i in range(len(hp)):
-                        hm[hp[i]] = False
-                    num_hot += len(hp)
+            num_hot = sum(len(hp) for hp in hot_pixels.hot_pixels)
             logger.info("Found %d possible hot pixel(s)", num_hot)
-
+            for filename in self.merge_hot_masks:
+                previous = HotPixelAccumulator.from_file(filename)
+                if previous.image_sizes != hot_pixels.image_sizes:
+                    logger.warning(
+                        "Not merging hot mask %s: inconsistent detector", filename
+                    )
+                    continue
+                hot_pixels.merge(previous)
+                logger.info("Merged hot mask %s", filename)
+            hot_mask = hot_pixels.as_mask()
         else:
             hot_mask = None
 
@@ -24,8 +24,6 @@ def __call__(self, observed, predicted):
 
         :returns: The list of matched reflections
         """
-        from dials.array_family import flex
-
         # Find the nearest neighbours and distances
         nn, dist = self._find_nearest_neighbours(observed, predicted)
 
@@ -36,7 +34,7 @@ def __call__(self, observed, predicted):
         index = self._filter_duplicates(index, nn, dist)
 
         # Copy all of the reflection data for the matched reflections
-        return flex.size_t(index), flex.size_t([nn[i] for i in index])
+        return index, nn.select(index)
 
     def _find_nearest_neighbours(self, observed, predicted):
         """
@@ -101,8 +99,7 @@ def _filter_by_distance(self, nn, dist):
 
         :returns: A reduced list of nearest neighbours
         """
-        index = range(len(nn))
-        return flex.int(i for i in index if dist[i] <= self._max_separation)
+        return (dist <= self._max_separation).iselection()
 
     def _filter_duplicates(self, index, nn, dist):
         """
@@ -114,15 +111,17 @@ def _filter_duplicates(self, index, nn, dist):
 
         :returns: A reduced list of nearest neighbours
         """
-        seen = {}
-        for i in index:
-            p = nn[i]
-            if p in seen:
-                j = seen[p]
-                if dist[i] < dist[j]:
-                    seen[p] = i
-            else:
-                seen[p] = i
-
-        index = list(seen.values())
-        return index
+        if len(index) == 0:
+            return index
+        nn = nn.select(index)
+        dist = dist.select(index)
+
+        # Sort by nearest neighbour then distance, and keep the closest spot
+        # (or the first, for equal distances) for each nearest neighbour
+        perm = flex.sort_permutation(dist, stable=True)
+        perm = perm.select(flex.sort_permutation(nn.select(perm), stable=True))
+        nn = nn.select(perm)
+        first = flex.bool(len(nn), True)
+        first.set_selected(flex.size_t_range(1, len(nn)), nn[1:] != nn[:-1])
+        index = index.select(perm.select(first))
+        return index.select(flex.sort_permutation(index))
@@ -0,0 +1,69 @@
+import os
+import pickle
+import threading
+
+import pytest
+
+from dials.algorithms.spot_finding.finder import (
+    HotPixelAccumulator,
+    extract_pixels_pipelined,
+)
+from dials.array_family import flex
+
+
+def test_hot_pixel_accumulator(tmpdir):
+    accumulator = HotPixelAccumulator([(4, 3), (2, 2)])
+    accumulator.add((flex.size_t([1, 5, 5]), flex.size_t([3])))
+    accumulator.add_xy(0, [2], [2])
+
+    mask = accumulator.as_mask()
+    assert len(mask) == 2
+    assert mask[0].all() == (3, 4)
+    assert mask[1].all() == (2, 2)
+    assert list((~mask[0]).as_1d().iselection()) == [1, 5, 10]
+    assert list((~mask[1]).as_1d().iselection()) == [3]
+    assert accumulator.num_hot() == 4
+
+    # Round trip through a mask file and merge with another accumulator
+    filename = tmpdir.join("hot_mask.pickle").strpath
+    accumulator.to_file(filename)
+    with open(filename, "rb") as fh:
+        assert len(pickle.load(fh)) == 2
+    other = HotPixelAccumulator.from_file(filename)
+    assert other.num_hot() == 4
+
+    new = HotPixelAccumulator([(4, 3), (2, 2)])
+    new.add_xy(1, [0], [0])
+    new.merge(other)
+    assert new.num_hot() == 5
+    assert list((~new.as_mask()[1]).as_1d().iselection()) == [0, 3]
+
+
+class _SumImage:
+    """A stand-in for ExtractPixelsFromImage, summing each image."""
+
+    def read(self, index):
+        image = flex.double(flex.grid(3, 4), index)
+        return (image,), (flex.bool(image.accessor(), True),)
+
+    def process(self, index, image, mask):
+        return index, flex.sum(image[0]), mask[0].count(True)
+
+
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_extract_pixels_pipelined(nproc):
+    shm = os.listdir("/dev/shm") if os.path.isdir("/dev/shm") else None
+    results = list(
+        extract_pixels_pipelined(_SumImage(), range(10), nproc=nproc, prefetch=2)
+    )
+    assert results == [(i, 12.0 * i, 12) for i in range(10)]
+    if shm is not None:
+        # The shared memory used to pass the images has been removed
+        assert os.listdir("/dev/shm") == shm
+
+    # Closing the generator early stops the reader thread
+    threads = set(threading.enumerate())
+    pipeline = extract_pixels_pipelined(_SumImage(), range(10), nproc=nproc)
+    assert next(pipeline) == (0, 0.0, 12)
+    pipeline.close()
+    assert set(threading.enumerate()) <= threads
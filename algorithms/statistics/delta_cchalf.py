@@ -3,9 +3,9 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
-from collections import defaultdict
 from math import floor, sqrt
 
+import numpy as np
 import six
 
 from cctbx import crystal, miller
@@ -73,6 +73,17 @@ def index(self, h):
             bin_index = 0
         return bin_index
 
+    def indices(self, miller_indices):
+        """
+        Get the bin indices for an array of miller indices
+
+        :param miller_indices: The miller indices
+        :returns: A numpy array of bin indices
+        """
+        d = self._unit_cell.d(miller_indices).as_numpy_array()
+        bin_index = np.floor((1 / d ** 2 - self._xmin) / self._bin_size)
+        return np.clip(bin_index, 0, self._nbins - 1).astype(np.int64)
+
 
 class ReflectionSum(object):
     """
@@ -157,6 +168,55 @@ def compute_cchalf_from_reflection_sums(reflection_sums, binner):
     return compute_mean_cchalf_in_bins(bin_data)
 
 
+def _bin_sums(bin_index, sum_x, sum_x2, n, weight=1, minlength=0):
+    """
+    Compute the per-bin sums needed for the CC 1/2 of a set of unique reflections
+
+    Only reflections with more than one observation contribute. The sums are
+    the number of reflections, the sum of their mean intensities, the sum of
+    the squared mean intensities and the sum of the variances of the means.
+
+    :param bin_index: The bin (or combined group and bin) index of each reflection
+    :param sum_x: The sum of the intensities of each reflection
+    :param sum_x2: The sum of the squared intensities of each reflection
+    :param n: The number of observations of each reflection
+    :param weight: A weight (e.g. +1 or -1) for the contribution of each reflection
+    :param minlength: The minimum number of bins
+    :returns: A (4, nbins) array of sums
+    """
+    sel = n > 1
+    n = n[sel]
+    mean = sum_x[sel] / n
+    var = (sum_x2[sel] - sum_x[sel] ** 2 / n) / (n - 1) / n
+    weight = np.broadcast_to(weight, sel.shape)[sel]
+    bin_index = bin_index[sel]
+    return np.array(
+        [
+            np.bincount(bin_index, weights=weight * v, minlength=minlength)
+            for v in (np.ones(n.size), mean, mean ** 2, var)
+        ]
+    )
+
+
+def _mean_cchalf_from_bin_sums(sums):
+    """
+    Compute the mean CC 1/2, weighted by the number of reflections in each bin,
+    from the sums calculated by _bin_sums
+
+    :param sums: A (4, ..., nbins) array of sums
+    :returns: The mean CC 1/2 (an array of shape ... for multidimensional sums)
+    """
+    count, sum_mean, sum_mean2, sum_var = sums
+    # Only bins with more than one reflection contribute
+    count = np.where(count > 1, count, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma_e = sum_var / count
+        sigma_y = (sum_mean2 - sum_mean ** 2 / count) / (count - 1)
+        cchalf = (sigma_y - sigma_e) / (sigma_y + sigma_e)
+    cchalf = np.where(count > 0, cchalf, 0)
+    return np.sum(count * cchalf, axis=-1) / np.sum(count, axis=-1)
+
+
 class PerGroupCChalfStatistics(object):
     def __init__(
         self,
@@ -196,30 +256,35 @@ def __init__(
             self.d_max = flex.max(self.reflection_table["d"])
         self.binner = ResolutionBinner(mean_unit_cell, self.d_min, self.d_max, n_bins)
 
-        self.reflection_sums = defaultdict(ReflectionSum)
         self.compute_overall_stats()
 
     def compute_overall_stats(self):
-        # Create lookups for elements by miller index
-        index_lookup = defaultdict(list)
-        for i, h in enumerate(self.reflection_table["miller_index"]):
-            index_lookup[h].append(i)
-
-        # Compute the Overall Sum(X) and Sum(X^2) for each unique reflection
+        # Group the observations by unique miller index, using integer codes of
+        # the asu indices, and compute the overall Sum(X) and Sum(X^2) for each
+        # unique reflection
+        hkl = self.reflection_table["miller_index"].as_vec3_double().as_numpy_array()
+        hkl = np.rint(hkl).astype(np.int64)
+        offset = int(np.abs(hkl).max()) + 1 if hkl.size else 1
+        hkl += offset
+        base = 2 * offset + 1
+        codes = (hkl[:, 0] * base + hkl[:, 1]) * base + hkl[:, 2]
+        unique_codes, self._unique_index = np.unique(codes, return_inverse=True)
+        first = np.unique(self._unique_index, return_index=True)[1]
+        unique_indices = self.reflection_table["miller_index"].select(
+            flex.size_t(first.tolist())
+        )
+        self._bin_index = self.binner.indices(unique_indices)
 
-        for h in index_lookup:
-            sel = flex.size_t(index_lookup[h])
-            intensities = self.reflection_table["intensity"].select(sel)
-            n = intensities.size()
-            sum_x = flex.sum(intensities)
-            sum_x2 = flex.sum(flex.pow2(intensities))
-            self.reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
+        self._intensity = self.reflection_table["intensity"].as_numpy_array()
+        self._sum_x = np.bincount(self._unique_index, weights=self._intensity)
+        self._sum_x2 = np.bincount(self._unique_index, weights=self._intensity ** 2)
+        self._n = np.bincount(self._unique_index)
 
         # Compute some numbers
         self._num_datasets = len(set(self.reflection_table["dataset"]))
         self._num_groups = len(set(self.reflection_table["group"]))
         self._num_reflections = self.reflection_table.size()
-        self._num_unique = len(self.reflection_sums)
+        self._num_unique = unique_codes.size
 
         logger.info(
             """
@@ -257,57 +322,64 @@ def d_filter(self):
 
     def run(self):
         """Compute the ΔCC½ for all the data"""
-        self._cchalf_mean = compute_cchalf_from_reflection_sums(
-            self.reflection_sums, self.binner
+        nbins = self.binner.nbins()
+        self._bin_sums = _bin_sums(
+            self._bin_index, self._sum_x, self._sum_x2, self._n, minlength=nbins
         )
+        self._cchalf_mean = float(_mean_cchalf_from_bin_sums(self._bin_sums))
         logger.info("CC 1/2 mean: %.3f", (100 * self._cchalf_mean))
         self._cchalf = self._compute_cchalf_excluding_each_group()
 
     def _compute_cchalf_excluding_each_group(self):
-        #   self, reflection_sums, binner, miller_index, dataset, intensity
-        # ):
         """
-        Compute the CC 1/2 with an image excluded.
+        Compute the CC 1/2 with each group excluded.
 
-        For each image, update the sums by removing the contribution from the image
-        and then compute the CC 1/2 of the remaining data
+        The sums of each unique reflection over the observations of each group are
+        computed in one pass. Removing a group changes the contribution of only
+        those unique reflections observed in the group to the binned sums, so the
+        binned sums excluding each group are the overall binned sums minus the old,
+        and plus the new, contributions of those reflections.
         """
+        nbins = self.binner.nbins()
+        group = self.reflection_table["group"].as_numpy_array()
+        groups, group_index = np.unique(group, return_inverse=True)
+        ngroups = groups.size
+
+        # The sums for each (group, unique reflection) pair
+        pair_codes, pair_index = np.unique(
+            group_index.astype(np.int64) * self._num_unique + self._unique_index,
+            return_inverse=True,
+        )
+        pair_group = pair_codes // self._num_unique
+        pair_unique = pair_codes % self._num_unique
+        pair_sum_x = np.bincount(pair_index, weights=self._intensity)
+        pair_sum_x2 = np.bincount(pair_index, weights=self._intensity ** 2)
+        pair_n = np.bincount(pair_index)
+
+        # Accumulate the change in the binned sums on removing each group
+        pair_bin = pair_group * nbins + self._bin_index[pair_unique]
+        old = _bin_sums(
+            pair_bin,
+            self._sum_x[pair_unique],
+            self._sum_x2[pair_unique],
+            self._n[pair_unique],
+            weight=-1,
+            minlength=ngroups * nbins,
+        )
+        new = _bin_sums(
+            pair_bin,
+            self._sum_x[pair_unique] - pair_sum_x,
+            self._sum_x2[pair_unique] - pair_sum_x2,
+            self._n[pair_unique] - pair_n,
+            minlength=ngroups * nbins,
+        )
+        sums = (old + new).reshape(4, ngroups, nbins) + self._bin_sums[:, None, :]
+        cchalf = _mean_cchalf_from_bin_sums(sums)
 
-        # Create a lookup table for each reflection by dataset i.e. group of images
-        dataset_lookup = defaultdict(list)
-        for i, b in enumerate(self.reflection_table["group"]):
-            dataset_lookup[b].append(i)
-
-        # Compute CC1/2 minus each dataset
         cchalf_i = {}
-        for dataset in dataset_lookup:
-
-            # Find all observations from this dataset and create a lookup based on
-            # miller index
-            index_lookup = defaultdict(list)
-            for i in dataset_lookup[dataset]:
-                index_lookup[self.reflection_table["miller_index"][i]].append(i)
-
-            # Loop through all the reflections and remove the contribution of
-            # reflections from the current dataset
-            dataset_reflection_sums = defaultdict(ReflectionSum)
-            for h in self.reflection_sums:
-                sum_x = self.reflection_sums[h].sum_x
-                sum_x2 = self.reflection_sums[h].sum_x2
-                n = self.reflection_sums[h].n
-                for i in index_lookup[h]:
-                    sum_x -= self.reflection_table["intensity"][i]
-                    sum_x2 -= self.reflection_table["intensity"][i] ** 2
-                    n -= 1
-                dataset_reflection_sums[h] = ReflectionSum(sum_x, sum_x2, n)
-
-            # Compute the CC 1/2 without the reflections from the current dataset
-            cchalf = compute_cchalf_from_reflection_sums(
-                dataset_reflection_sums, self.binner
-            )
-            cchalf_i[dataset] = cchalf
-            logger.info("CC 1/2 excluding group %d: %.3f", dataset, 100 * cchalf)
-
+        for dataset, value in zip(groups.tolist(), cchalf.tolist()):
+            cchalf_i[dataset] = value
+            logger.info("CC 1/2 excluding group %d: %.3f", dataset, 100 * value)
         return cchalf_i
 
     def num_datasets(self):
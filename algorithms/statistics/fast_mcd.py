@@ -2,12 +2,83 @@
 
 import math
 
+import numpy as np
+
 from scitbx.array_family import flex
 
-from dials_refinement_helpers_ext import maha_dist_sq as maha_dist_sq_cpp
 from dials_refinement_helpers_ext import mcd_consistency
 
 
+def _as_numpy_array(values):
+    if hasattr(values, "as_numpy_array"):
+        return values.as_numpy_array()
+    return np.asarray(values, dtype=np.float64)
+
+
+def _as_matrix(cols):
+    """Stack a list of equal length vectors as the columns of an (n, p) array"""
+
+    return np.column_stack([_as_numpy_array(col) for col in cols]).astype(np.float64)
+
+
+def _as_flex_matrix(S):
+    """Convert a square numpy array to a flex.double with a flex.grid"""
+
+    m = flex.double(np.ascontiguousarray(S).ravel())
+    m.reshape(flex.grid(S.shape[0], S.shape[1]))
+    return m
+
+
+def _means_and_covariances(X, subsets):
+    """Calculate the mean vector, sample covariance matrix and its determinant
+    for each subset of the rows of the (n, p) array X. subsets is a (t, m) array
+    of row indices, giving t subsets of size m. Returns arrays of shape (t, p),
+    (t, p, p) and (t,)"""
+
+    Xs = X[subsets]
+    T = Xs.mean(axis=1)
+    D = Xs - T[:, np.newaxis, :]
+    S = np.einsum("tmi,tmj->tij", D, D) / (subsets.shape[1] - 1)
+    return T, S, np.linalg.det(S)
+
+
+def _maha_dist_sq(X, T, S):
+    """Calculate the squared Mahalanobis distances of all rows of the (n, p)
+    array X from each of t centers T, with respect to the corresponding
+    covariance matrices S. Returns an array of shape (t, n)"""
+
+    D = X[np.newaxis, :, :] - T[:, np.newaxis, :]
+    Sinv = np.linalg.inv(S)
+    return np.einsum("tni,tij,tnj->tn", D, Sinv, D)
+
+
+def _concentration_step(X, h, T, S):
+    """Practical application of Theorem 1 of R&vD to t trials at once. Returns a
+    (t, h) array of the rows of X closest to each center T with respect to S"""
+
+    d2s = _maha_dist_sq(X, T, S)
+    return np.argpartition(d2s, h - 1, axis=1)[:, :h]
+
+
+def _concentration_steps(X, h, T, S, detS, n_steps, until_converged=False):
+    """Take n_steps concentration steps for each of the trials (T, S, detS)
+    together. If until_converged, a trial is left unchanged once a step does not
+    change its determinant, and the iteration stops early when all have
+    converged"""
+
+    active = np.arange(len(detS))
+    for _ in range(n_steps):
+        H = _concentration_step(X, h, T[active], S[active])
+        Tnew, Snew, detSnew = _means_and_covariances(X, H)
+        converged = detSnew == detS[active]
+        T[active], S[active], detS[active] = Tnew, Snew, detSnew
+        if until_converged:
+            active = active[~converged]
+            if len(active) == 0:
+                break
+    return T, S, detS
+
+
 def sample_covariance(a, b):
     """Calculate sample covariance of two vectors"""
 
@@ -23,14 +94,9 @@ def cov(*args):
     lens = [len(e) for e in args]
     assert all(e == lens[0] for e in lens)
 
-    ncols = len(args)
-    cov = flex.double(flex.grid(ncols, ncols))
-    for i in range(ncols):
-        for j in range(i, ncols):
-            cov[i, j] = sample_covariance(args[i], args[j])
-
-    cov.matrix_copy_upper_to_lower_triangle_in_place()
-    return cov
+    X = _as_matrix(args)
+    _, S, _ = _means_and_covariances(X, np.arange(len(X))[np.newaxis, :])
+    return _as_flex_matrix(S[0])
 
 
 def maha_dist_sq(cols, center, cov):
@@ -38,17 +104,14 @@ def maha_dist_sq(cols, center, cov):
     vectors contained in the list cols) from the center vector with respect to
     the covariance matrix cov"""
 
-    n = len(cols[0])
     p = len(cols)
     assert len(center) == p
 
-    # observation matrix
-    obs = flex.double(flex.grid(n, p))
-    for i, col in enumerate(cols):
-        obs.matrix_paste_column_in_place(col, i)
-
-    d2 = maha_dist_sq_cpp(obs, flex.double(center), cov)
-    return d2
+    X = _as_matrix(cols)
+    T = np.asarray(list(center), dtype=np.float64)
+    S = np.asarray(list(cov), dtype=np.float64).reshape(p, p)
+    d2 = _maha_dist_sq(X, T[np.newaxis, :], S[np.newaxis, :, :])
+    return flex.double(d2[0])
 
 
 def mcd_finite_sample(p, n, alpha):
@@ -130,7 +193,8 @@ def mcd_finite_sample(p, n, alpha):
 
 class FastMCD(object):
     """Experimental implementation of the FAST-MCD algorithm of Rousseeuw and
-    van Driessen"""
+    van Driessen. The trials at each stage are carried through the concentration
+    steps together, as stacks of location and scatter estimates"""
 
     def __init__(
         self,
@@ -163,6 +227,9 @@ def __init__(
         # some input checks
         assert self._n > self._p
 
+        # the full dataset as an (n, p) matrix of observations
+        self._X = _as_matrix(self._data)
+
         # default initial subset size
         self._alpha = alpha
         n2 = (self._n + self._p + 1) // 2
@@ -216,130 +283,69 @@ def get_corrected_T_and_S(self):
         fac = self._consistency_fac * self._finite_samp_fac
         return self._T_raw, self._S_raw * fac
 
-    @staticmethod
-    def means_and_covariance(vecs):
-        """Prepare a dataset of equal length vectors for Mahalanobis distance
-        squared calculation. The maha_dist_sq function requires the vectors,
-        the vector of their means and their covariance matrix. Given the vectors,
-        return the latter pair as a tuple"""
-
-        center = flex.double([flex.mean(e) for e in vecs])
-        covmat = cov(*vecs)
-        return (center, covmat)
-
-    @staticmethod
-    def sample_data(data, sample_size):
-        """sample (without replacement) the data vectors to select the same
-        sample_size rows from each."""
-
-        n = len(data[0])
-        rows = flex.random_selection(n, sample_size)
-        cols = [e.select(rows) for e in data]
-        return cols
-
-    def split_into_groups(self, sample, ngroups):
-        """Split each vector in the data sample into groups of approximately equal
-        size."""
-
-        # number of obs in the sample
-        sample_size = len(sample[0])
-
-        # random permutation
-        p = flex.random_permutation(sample_size)
-        permuted = [col.select(p) for col in sample]
-
-        # determine groups
-        blocksize = int(sample_size / ngroups)
-        rem = sample_size % ngroups
-        blocksizes = [blocksize] * (ngroups - rem) + [blocksize + 1] * rem
-
-        starts = [0]
-        ends = [blocksizes[0]]
-        for b in blocksizes[1:]:
-            starts.append(ends[-1])
-            ends.append(ends[-1] + b)
-        blocks = zip(starts, ends)
-
-        # split into groups
-        groups = [[col[start:end] for col in permuted] for start, end in blocks]
-
-        return groups
-
-    def form_initial_subset(self, h, data):
-        """Method 2 of subsection 3.1 of R&vD"""
-
-        # permutation of input data for sampling
-        p = flex.random_permutation(len(data[0]))
-        permuted = [col.select(p) for col in data]
-
-        # draw random p+1 subset J (or larger if required)
-        detS0 = 0.0
-        i = 0
-        while not detS0 > 0.0:
-            subset_size = self._p + 1 + i
-            J = [e[0:subset_size] for e in permuted]
-            i += 1
-            T0, S0 = self.means_and_covariance(J)
-            detS0 = S0.matrix_determinant_via_lu()
-
-        H1 = self.concentration_step(h, data, T0, S0)
-        return H1
-
-    @staticmethod
-    def concentration_step(h, data, T, S):
-        """Practical application of Theorem 1 of R&vD"""
-
-        d2s = maha_dist_sq(data, T, S)
-        p = flex.sort_permutation(d2s)
-        H1 = [col.select(p)[0:h] for col in data]
-        return H1
+    def initial_trials(self, h, X, n_trials):
+        """Form n_trials initial estimates from the rows of X by method 2 of
+        subsection 3.1 of R&vD, and take k1 concentration steps from each"""
+
+        # a random permutation of the rows for each trial
+        n = len(X)
+        perms = np.array(
+            [flex.random_permutation(n).as_numpy_array() for _ in range(n_trials)],
+            dtype=np.intp,
+        ).reshape(n_trials, n)
+
+        # estimates from random p+1 subsets J, made larger where required
+        T0, S0, detS0 = _means_and_covariances(X, perms[:, : self._p + 1])
+        for i in np.flatnonzero(~(detS0 > 0.0)):
+            subset_size = self._p + 1
+            while not detS0[i] > 0.0:
+                subset_size += 1
+                T, S, detS = _means_and_covariances(X, perms[i : i + 1, :subset_size])
+                T0[i], S0[i], detS0[i] = T[0], S[0], detS[0]
+
+        H1 = _concentration_step(X, h, T0, S0)
+        Tcurr, Scurr, detScurr = _means_and_covariances(X, H1)
+
+        # perform concentration steps
+        for j in range(self._k1):
+            H = _concentration_step(X, h, Tcurr, Scurr)
+            Tnew, Snew, detSnew = _means_and_covariances(X, H)
+
+            # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
+            # this is not always the case here. Ensure that detScurr is no smaller than
+            # one billionth the value of detSnew less than detSnew
+            assert np.all(detScurr > (detSnew - detSnew / 1.0e9))
+            Tcurr, Scurr, detScurr = Tnew, Snew, detSnew
+
+        return Tcurr, Scurr, detScurr
+
+    def _best_estimate(self, T, S, detS):
+        """Return the trial with the minimum covariance determinant as a
+        flex.double location and flex.grid covariance matrix"""
+
+        best = np.argmin(detS)
+        return flex.double(np.ascontiguousarray(T[best])), _as_flex_matrix(S[best])
 
     def small_dataset_estimate(self):
         """When a dataset is small, perform the initial trials directly on the
         whole dataset"""
 
-        trials = []
-        for i in range(self._n_trials):
-
-            H1 = self.form_initial_subset(h=self._h, data=self._data)
-            T1, S1 = self.means_and_covariance(H1)
-            detS1 = S1.matrix_determinant_via_lu()
-
-            # perform concentration steps
-            detScurr, Tcurr, Scurr = detS1, T1, S1
-            for j in range(self._k1):  # take maximum of k1 steps
-
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
-
-                # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                # this is not always the case here. Ensure that detScurr is no smaller than
-                # one billionth the value of detSnew less than detSnew
-                assert detScurr > (detSnew - detSnew / 1.0e9)
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-            trials.append((detSnew, Tnew, Snew))
-
-        # choose 10 trials with the lowest detS3
-        trials.sort(key=lambda x: x[0])
-        best_trials = []
-        for i in range(10):
-            detCurr, Tcurr, Scurr = trials[i]
-            for j in range(self._k3):  # take maximum of k3 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            best_trials.append((detNew, Tnew, Snew))
+        T, S, detS = self.initial_trials(self._h, self._X, self._n_trials)
+
+        # choose 10 trials with the lowest detS3 and take a maximum of k3 steps
+        best = np.argsort(detS, kind="stable")[:10]
+        T, S, detS = _concentration_steps(
+            self._X,
+            self._h,
+            T[best],
+            S[best],
+            detS[best],
+            self._k3,
+            until_converged=True,
+        )
 
         # Find the minimum covariance determinant from that set of 10
-        best_trials.sort(key=lambda x: x[0])
-        _, Tbest, Sbest = best_trials[0]
-        return Tbest, Sbest
+        return self._best_estimate(T, S, detS)
 
     def large_dataset_estimate(self):
         """When a dataset is large, construct disjoint subsets of the full data
@@ -354,62 +360,35 @@ def large_dataset_estimate(self):
             ngroups = self._max_n_groups
             sample_size = self._min_group_size * self._max_n_groups
 
-        # sample the data and split into groups
-        sampled = self.sample_data(self._data, sample_size=sample_size)
-        groups = self.split_into_groups(sample=sampled, ngroups=ngroups)
+        # sample the data (without replacement) and randomly permute the sample
+        sampled = flex.random_selection(self._n, sample_size).as_numpy_array()
+        permuted = sampled[flex.random_permutation(sample_size).as_numpy_array()]
 
-        # work within the groups now
+        # split into groups of approximately equal size
+        blocksize = int(sample_size / ngroups)
+        rem = sample_size % ngroups
+        blocksizes = [blocksize] * (ngroups - rem) + [blocksize + 1] * rem
+        ends = np.cumsum(blocksizes)
+        groups = [permuted[end - size : end] for size, end in zip(blocksizes, ends)]
+
+        # work within the groups now, keeping the 10 trials with the lowest
+        # determinant from each
         n_trials = self._n_trials // ngroups
-        trials = []
         h_frac = self._h / self._n
+        trials = []
         for group in groups:
-
-            h_sub = int(len(group[0]) * h_frac)
-            gp_trials = []
-            for i in range(n_trials):
-
-                H1 = self.form_initial_subset(h=h_sub, data=group)
-                T1, S1 = self.means_and_covariance(H1)
-                detS1 = S1.matrix_determinant_via_lu()
-
-                # perform concentration steps
-                detScurr, Tcurr, Scurr = detS1, T1, S1
-                for j in range(self._k1):  # take k1 steps
-
-                    Hnew = self.concentration_step(h_sub, group, Tcurr, Scurr)
-                    Tnew, Snew = self.means_and_covariance(Hnew)
-                    detSnew = Snew.matrix_determinant_via_lu()
-
-                    # detS3 < detS2 < detS1 by Theorem 1. In practice (rounding errors?)
-                    # this is not always the case here. Ensure that detScurr is no smaller than
-                    # one billionth the value of detSnew less than detSnew
-                    assert detScurr > (detSnew - detSnew / 1.0e9)
-                    detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-                gp_trials.append((detSnew, Tnew, Snew))
-
-            # choose 10 trials with the lowest determinant and put in the outer list
-            gp_trials.sort(key=lambda x: x[0])
-            trials.extend(gp_trials[0:10])
+            h_sub = int(len(group) * h_frac)
+            T, S, detS = self.initial_trials(h_sub, self._X[group], n_trials)
+            best = np.argsort(detS, kind="stable")[:10]
+            trials.append((T[best], S[best], detS[best]))
+        T, S, detS = (np.concatenate(e) for e in zip(*trials))
 
         # now have 10 best trials from each group. Work with the merged (==sampled)
-        # set
-        mrgd_trials = []
+        # set, taking k2 steps
         h_mrgd = int(sample_size * h_frac)
-        for trial in trials:
-
-            detScurr, Tcurr, Scurr = trial
-            for j in range(self._k2):  # take k2 steps
-
-                Hnew = self.concentration_step(h_mrgd, sampled, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detSnew = Snew.matrix_determinant_via_lu()
-                detScurr, Tcurr, Scurr = detSnew, Tnew, Snew
-
-            mrgd_trials.append((detSnew, Tnew, Snew))
-
-        # sort trials by the lowest detS3 and work with the whole dataset now
-        mrgd_trials.sort(key=lambda x: x[0])
+        T, S, detS = _concentration_steps(
+            self._X[sampled], h_mrgd, T, S, detS, self._k2
+        )
 
         # choose number of steps to iterate based on dataset size (ugly)
         size = self._n * self._p
@@ -439,24 +418,12 @@ def large_dataset_estimate(self):
         # choose number of trials to look at based on number of obs (ugly)
         n_reps = 1 if self._n > 5000 else 10
 
-        best_trials = []
-        for i in range(n_reps):
-            detCurr, Tcurr, Scurr = mrgd_trials[i]
-            for j in range(k4):  # take maximum of k4 steps
-                Hnew = self.concentration_step(self._h, self._data, Tcurr, Scurr)
-                Tnew, Snew = self.means_and_covariance(Hnew)
-                detNew = Snew.matrix_determinant_via_lu()
-                if detNew == detCurr:
-                    # print "trial {0}; iteration {1}; convergence".format(i,j)
-                    break
-                detCurr, Tcurr, Scurr = detNew, Tnew, Snew
-            # print "determinant", detNew
-            # print "location:", list(Tnew)
-            # print "covariance:"
-            # print Snew.as_scitbx_matrix()
-            best_trials.append((detNew, Tnew, Snew))
+        # sort trials by the lowest detS3 and work with the whole dataset now,
+        # taking a maximum of k4 steps
+        best = np.argsort(detS, kind="stable")[:n_reps]
+        T, S, detS = _concentration_steps(
+            self._X, self._h, T[best], S[best], detS[best], k4, until_converged=True
+        )
 
-        # Find the minimum covariance determinant from that set of 10
-        best_trials.sort(key=lambda x: x[0])
-        _, Tbest, Sbest = best_trials[0]
-        return Tbest, Sbest
+        # Find the minimum covariance determinant from that set of trials
+        return self._best_estimate(T, S, detS)
@@ -110,6 +110,19 @@
   }
 }
 
+use_sparse = False
+  .type = bool
+  .help = "Store the Rij matrix as a sparse matrix, and avoid forming dense"
+          "outer products of the coordinates when evaluating the target function."
+          "Recommended for analyses with many thousands of datasets."
+
+pair_fraction = None
+  .type = float(value_min=0, value_max=1)
+  .help = "Only calculate correlation coefficients for a random fraction of the"
+          "pairs of datasets. Requires use_sparse=True and weights to be set, so"
+          "that pairs that are not sampled do not contribute to the target"
+          "function."
+
 nproc = 1
   .type = int(value_min=1)
   .help = "The number of processes to use."
@@ -151,6 +164,10 @@ def __init__(self, intensities, params):
         )
 
         self.params = params
+        if self.params.pair_fraction is not None and (
+            not self.params.use_sparse or self.params.weights is None
+        ):
+            raise dials.util.Sorry("pair_fraction requires use_sparse=True and weights")
         if self.params.space_group is not None:
 
             def _map_space_group_to_input_cell(intensities, space_group):
@@ -227,6 +244,8 @@ def _intialise_target(self):
             dimensions=dimensions,
             weights=self.params.weights,
             nproc=self.params.nproc,
+            use_sparse=self.params.use_sparse,
+            pair_fraction=self.params.pair_fraction,
         )
 
     def _determine_dimensions(self):
@@ -2,6 +2,7 @@
 from __future__ import absolute_import, division, print_function
 
 import numpy as np
+from scipy import sparse
 
 from scitbx.array_family import flex
 
@@ -78,7 +79,10 @@ def plot_rij_histogram(rij_matrix, key="cosym_rij_histogram"):
       plot_name (str): The file name to save the plot to.
         If this is not defined then the plot is displayed in interactive mode.
     """
-    rij = rij_matrix.as_1d()
+    if sparse.issparse(rij_matrix):
+        rij = flex.double(rij_matrix.data)
+    else:
+        rij = rij_matrix.as_1d()
     rij = rij.select(rij != 0)
     hist = flex.histogram(
         rij,
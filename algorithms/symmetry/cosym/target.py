@@ -5,6 +5,7 @@
 import logging
 import math
 
+import numpy as np
 from orderedset import OrderedSet
 from scipy import sparse
 
@@ -32,6 +33,9 @@ def __init__(
         lattice_group=None,
         dimensions=None,
         nproc=1,
+        use_sparse=False,
+        pair_fraction=None,
+        seed=0,
     ):
         r""" "Intialise a Target object.
 
@@ -56,12 +60,29 @@ def __init__(
             equal to the greater of 2 or the number of symmetry operations in the
             lattice group.
           nproc (int): number of processors to use for computing the rij matrix.
+          use_sparse (bool): Store the rij and wij matrices as sparse matrices, and
+            evaluate the target function and gradients via products with the
+            coordinate matrix, rather than forming dense outer products. This
+            scales to tens of thousands of lattices.
+          pair_fraction (float): Optionally only calculate correlation coefficients
+            for a random fraction of the pairs of lattices. Requires use_sparse
+            and weights, so that the pairs which are not sampled have zero
+            weight rather than being treated as uncorrelated.
+          seed (int): The random seed used to select pairs of lattices if
+            pair_fraction is set.
         """
         if weights is not None:
             assert weights in ("count", "standard_error")
+        if pair_fraction is not None:
+            assert use_sparse, "pair_fraction requires use_sparse"
+            assert weights is not None, "pair_fraction requires weights"
+            assert 0 < pair_fraction <= 1
         self._weights = weights
         self._min_pairs = min_pairs
         self._nproc = nproc
+        self._use_sparse = use_sparse
+        self._pair_fraction = pair_fraction
+        self._seed = seed
 
         data = intensities.customized_copy(anomalous_flag=False)
         cb_op_to_primitive = data.change_of_basis_op_to_primitive_setting()
@@ -156,6 +177,9 @@ def _lattice_lower_upper_index(self, lattice_id):
 
     def _compute_rij_wij(self, use_cache=True):
         """Compute the rij_wij matrix."""
+        if self._use_sparse:
+            return self._compute_rij_wij_sparse()
+
         n_lattices = self._lattices.size()
         n_sym_ops = len(self._sym_ops)
 
@@ -304,6 +328,225 @@ def _compute_rij_matrix_one_row_block(i):
 
         return self.rij_matrix, self.wij_matrix
 
+    def _sorted_asu_indices(self):
+        """Precompute the sorted, reindexed asu indices of each lattice.
+
+        The miller indices are encoded as integer keys, so that the common
+        reflections of two lattices may be found by a binary search.
+
+        Returns:
+          List[List[Tuple[numpy.ndarray, numpy.ndarray]]]: For each symmetry
+          operation, and each lattice, the sorted keys of the reindexed indices
+          and the corresponding intensities. Reflections with epsilon > 1 are
+          excluded.
+        """
+        space_group_type = self._data.space_group().type()
+        intensities = self._data.data().as_numpy_array()
+        bounds = list(self._lattices) + [self._data.size()]
+
+        hkl = []
+        sel = []
+        for cb_op in self._sym_ops:
+            cb_op = sgtbx.change_of_basis_op(cb_op)
+            indices = cb_op.apply(self._data.indices())
+            miller.map_to_asu(space_group_type, False, indices)
+            sel.append((self._patterson_group.epsilon(indices) == 1).as_numpy_array())
+            hkl.append(
+                np.rint(indices.as_vec3_double().as_numpy_array()).astype(np.int64)
+            )
+        offset = max(int(np.abs(h).max()) if h.size else 0 for h in hkl) + 1
+        base = 2 * offset + 1
+
+        result = []
+        for h, s in zip(hkl, sel):
+            h = h + offset
+            keys = (h[:, 0] * base + h[:, 1]) * base + h[:, 2]
+            lattices = []
+            for lower, upper in zip(bounds[:-1], bounds[1:]):
+                keep = s[lower:upper]
+                k = keys[lower:upper][keep]
+                order = np.argsort(k, kind="stable")
+                lattices.append((k[order], intensities[lower:upper][keep][order]))
+            result.append(lattices)
+        return result
+
+    def _compute_rij_wij_sparse(self):
+        """Compute sparse rij and wij matrices.
+
+        Only the upper triangle of lattice pairs is calculated, and mirrored.
+        If pair_fraction is set, then each pair of distinct lattices is included
+        with that probability.
+        """
+        n_lattices = self._lattices.size()
+        n_sym_ops = len(self._sym_ops)
+        NN = n_lattices * n_sym_ops
+        cb_ops = [sgtbx.change_of_basis_op(cb_op) for cb_op in self._sym_ops]
+        sorted_indices = self._sorted_asu_indices()
+
+        # concatenate the sorted keys of all lattices for each symmetry
+        # operation, offset by lattice, so that the common reflections of one
+        # lattice with a block of other lattices are found by a single search
+        key_base = 1
+        for lattices in sorted_indices:
+            for keys, _ in lattices:
+                if keys.size:
+                    key_base = max(key_base, int(keys[-1]) + 1)
+        all_keys = []
+        all_data = []
+        for lattices in sorted_indices:
+            all_keys.append(
+                np.concatenate(
+                    [keys + j * key_base for j, (keys, _) in enumerate(lattices)]
+                )
+            )
+            all_data.append(np.concatenate([data for _, data in lattices]))
+
+        def _correlations(keys_i, data_i, others, kk):
+            # the correlation coefficients and number of common reflections of
+            # lattice i with each of the other lattices
+            cc = np.full(others.size, np.nan)
+            n = np.zeros(others.size, dtype=np.int64)
+            keys_j = all_keys[kk]
+            if not keys_i.size or not keys_j.size:
+                return cc, n
+            block_size = max(1, 2 ** 20 // keys_i.size)
+            for lower in range(0, others.size, block_size):
+                block = slice(lower, lower + block_size)
+                query = others[block, None] * key_base + keys_i
+                pos = np.searchsorted(keys_j, query)
+                pos[pos == keys_j.size] = 0
+                match = keys_j[pos] == query
+                n_block = match.sum(axis=1)
+                x = np.where(match, data_i, 0)
+                y = np.where(match, all_data[kk][pos], 0)
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    dx = np.where(match, x - (x.sum(axis=1) / n_block)[:, None], 0)
+                    dy = np.where(match, y - (y.sum(axis=1) / n_block)[:, None], 0)
+                    denominator = np.sqrt((dx * dx).sum(axis=1) * (dy * dy).sum(axis=1))
+                    cc_block = (dx * dy).sum(axis=1) / denominator
+                cc_block[(n_block < 2) | ~(denominator > 0)] = np.nan
+                cc[block] = cc_block
+                n[block] = n_block
+            return cc, n
+
+        def _compute_rij_matrix_one_row_block(i):
+            rows = []
+            cols = []
+            rij = []
+            wij = []
+
+            others = np.arange(i, n_lattices)
+            if self._pair_fraction is not None:
+                rng = np.random.RandomState([self._seed, i])
+                keep = rng.random_sample(others.size) < self._pair_fraction
+                keep[0] = True
+                others = others[keep]
+
+            rij_cache = {}
+            for k, cb_op_k in enumerate(cb_ops):
+                keys_i, data_i = sorted_indices[k][i]
+                for kk, cb_op_kk in enumerate(cb_ops):
+                    key = str(cb_op_k.inverse() * cb_op_kk)
+                    if key not in rij_cache:
+                        rij_cache[key] = _correlations(keys_i, data_i, others, kk)
+                    cc, n = rij_cache[key]
+                    sel = ~np.isnan(cc)
+                    if self._min_pairs is not None:
+                        sel &= n >= self._min_pairs
+                    if k >= kk:
+                        # the diagonal is excluded, and the lower triangle
+                        # of the block is the mirror of the upper triangle
+                        sel &= others != i
+                    if self._weights == "count":
+                        wij.append(n[sel])
+                    elif self._weights == "standard_error":
+                        assert (n[sel] > 2).all()
+                        se = np.sqrt((1 - cc[sel] ** 2) / (n[sel] - 2))
+                        wij.append(1 / se)
+                    rows.append(np.full(sel.sum(), i + (n_lattices * k)))
+                    cols.append(others[sel] + (n_lattices * kk))
+                    rij.append(cc[sel])
+
+            return (
+                np.concatenate(rows).astype(np.int64),
+                np.concatenate(cols).astype(np.int64),
+                np.concatenate(rij).astype(np.float64),
+                np.concatenate(wij or [[]]).astype(np.float64),
+            )
+
+        args = [(i,) for i in range(n_lattices)]
+        results = easy_mp.parallel_map(
+            _compute_rij_matrix_one_row_block,
+            args,
+            processes=self._nproc,
+            iterable_type=easy_mp.posiargs,
+            method="multiprocessing",
+        )
+        rows, cols, rij, wij = (np.concatenate(r) for r in zip(*results))
+
+        # mirror the upper triangle, and sort the pairs by row then column
+        rows, cols = np.concatenate((rows, cols)), np.concatenate((cols, rows))
+        order = np.lexsort((cols, rows))
+        self._pair_rows = rows[order]
+        self._pair_cols = cols[order]
+        self._pair_indptr = np.searchsorted(self._pair_rows, np.arange(NN + 1))
+        self._pair_rij = np.concatenate((rij, rij))[order]
+        if self._weights is not None:
+            # the dense wij matrix accumulates the weight of each pair from both
+            # lattices of the pair, so double the weights to match
+            self._pair_wij = 2 * np.concatenate((wij, wij))[order]
+        else:
+            self._pair_wij = None
+
+        self.rij_matrix = self._pair_matrix(self._pair_rij)
+        if self._pair_wij is not None:
+            self.wij_matrix = self._pair_matrix(self._pair_wij)
+        else:
+            self.wij_matrix = None
+        logger.debug(
+            "Sparse rij matrix: %i non-zero elements (%.2f%%)"
+            % (self._pair_rij.size, 100 * self._pair_rij.size / max(NN * NN, 1))
+        )
+
+        return self.rij_matrix, self.wij_matrix
+
+    def _pair_matrix(self, values):
+        """A sparse matrix with the given values for each of the pairs."""
+        NN = self._pair_indptr.size - 1
+        return sparse.csr_matrix(
+            (values, self._pair_cols, self._pair_indptr), shape=(NN, NN)
+        )
+
+    def _coords_matrix(self, x):
+        """The NN x dim matrix of coordinates for the flattened coordinates x."""
+        return x.as_numpy_array().reshape(self.dim, -1).T
+
+    def _compute_functional_and_gradients_sparse(self, x):
+        """Compute the target function and gradients using the sparse matrices.
+
+        Without weights, the sum over all elements of (R - XX^T)^2 is evaluated
+        via the dim x dim matrix X^T X, so that XX^T is never formed. With
+        weights, only the elements for which the weights are non-zero contribute.
+        """
+        X = self._coords_matrix(x)
+        if self._pair_wij is None:
+            XtX = np.dot(X.T, X)
+            RX = self.rij_matrix.dot(X)
+            f = 0.5 * (
+                np.dot(self._pair_rij, self._pair_rij)
+                - 2 * np.sum(X * RX)
+                + np.sum(XtX * XtX)
+            )
+            grad = -2 * (RX - np.dot(X, XtX))
+        else:
+            residuals = self._pair_rij - np.einsum(
+                "ij,ij->i", X[self._pair_rows], X[self._pair_cols]
+            )
+            weighted = self._pair_wij * residuals
+            f = 0.5 * np.dot(weighted, residuals)
+            grad = -2 * self._pair_matrix(weighted).dot(X)
+        return f, flex.double(np.ascontiguousarray(grad.T).ravel())
+
     def compute_functional(self, x):
         """Compute the target function at coordinates `x`.
 
@@ -317,6 +560,8 @@ def compute_functional(self, x):
           f (float): The value of the target function at coordinates `x`.
         """
         assert (x.size() // self.dim) == (self._lattices.size() * len(self._sym_ops))
+        if self._use_sparse:
+            return self._compute_functional_and_gradients_sparse(x)[0]
         inner = self.rij_matrix.deep_copy()
         NN = x.size() // self.dim
         for i in range(self.dim):
@@ -368,6 +613,8 @@ def compute_functional_and_gradients(self, x):
           f: The value of the target function at coordinates `x`.
           grad: The gradients of the target function with respect to the parameters.
         """
+        if self._use_sparse:
+            return self._compute_functional_and_gradients_sparse(x)
         f = self.compute_functional(x)
         grad = flex.double()
         if self.wij_matrix is not None:
@@ -412,6 +659,14 @@ def curvatures(self, x):
           curvs (scitbx.array_family.flex.double):
           The curvature of the target function with respect to the parameters.
         """
+        if self._use_sparse:
+            X = self._coords_matrix(x)
+            if self._pair_wij is None:
+                curvs = np.tile(np.sum(X * X, axis=0), (X.shape[0], 1))
+            else:
+                curvs = self.wij_matrix.dot(X * X)
+            return flex.double(np.ascontiguousarray(2 * curvs.T).ravel())
+
         coords = []
         NN = x.size() // self.dim
         for i in range(self.dim):
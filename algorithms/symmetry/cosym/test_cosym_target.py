@@ -46,3 +46,55 @@ def test_cosym_target(space_group):
         assert f < f0
         assert pytest.approx(g, abs=1e-3) == [0] * len(g)
         assert pytest.approx(g_fd, abs=1e-3) == [0] * len(g)
+
+
+@pytest.mark.parametrize("weights", [None, "count", "standard_error"])
+def test_cosym_target_sparse(weights):
+    datasets, expected_reindexing_ops = generate_test_data(
+        space_group=sgtbx.space_group_info(symbol="P3").group(), sample_size=20
+    )
+
+    intensities = datasets[0]
+    dataset_ids = flex.double(intensities.size(), 0)
+    for i, d in enumerate(datasets[1:]):
+        intensities = intensities.concatenate(d, assert_is_similar_symmetry=False)
+        dataset_ids.extend(flex.double(d.size(), i + 1))
+
+    dense = target.Target(intensities, dataset_ids, weights=weights)
+    t = target.Target(intensities, dataset_ids, weights=weights, use_sparse=True)
+    assert t.dim == dense.dim
+    assert list(t.rij_matrix.toarray().flatten()) == pytest.approx(
+        list(dense.rij_matrix)
+    )
+
+    x = flex.random_double(dense.rij_matrix.all()[0] * t.dim)
+    f, g = t.compute_functional_and_gradients(x)
+    f_dense, g_dense = dense.compute_functional_and_gradients(x)
+    assert f == pytest.approx(f_dense)
+    assert list(g) == pytest.approx(list(g_dense))
+    assert list(t.curvatures(x)) == pytest.approx(list(dense.curvatures(x)))
+
+    if weights is None:
+        # Unsampled pairs would be treated as uncorrelated without weights
+        with pytest.raises(AssertionError):
+            target.Target(
+                intensities,
+                dataset_ids,
+                use_sparse=True,
+                pair_fraction=0.5,
+            )
+        return
+
+    # Only a subset of the pairs of datasets are included
+    t = target.Target(
+        intensities,
+        dataset_ids,
+        weights=weights,
+        use_sparse=True,
+        pair_fraction=0.5,
+    )
+    assert 0 < t.rij_matrix.nnz < (dense.rij_matrix != 0).count(True)
+    assert (t.rij_matrix != t.rij_matrix.T).nnz == 0
+    f, g = t.compute_functional_and_gradients(x)
+    g_fd = t.compute_gradients_fd(x)
+    assert list(g) == pytest.approx(list(g_fd), rel=2e-3, abs=1e-6)
@@ -12,7 +12,9 @@
 #include <boost/python/def.hpp>
 #include <boost/python/suite/indexing/map_indexing_suite.hpp>
 #include <dials/util/python_streambuf.h>
+#include <algorithm>
 #include <numeric>
+#include <vector>
 #include <dials/array_family/boost_python/flex_table_suite.h>
 #include <dials/array_family/reflection_table.h>
 #include <dials/array_family/reflection.h>
@@ -582,6 +584,165 @@ namespace dials { namespace af { namespace boost_python {
     return result;
   }
 
+  /**
+   * A key to match reflections on miller index, entering flag, experiment
+   * id and panel
+   */
+  struct reference_match_key {
+    cctbx::miller::index<> h;
+    bool entering;
+    int id;
+    std::size_t panel;
+
+    reference_match_key(cctbx::miller::index<> h_,
+                        bool entering_,
+                        int id_,
+                        std::size_t panel_)
+        : h(h_), entering(entering_), id(id_), panel(panel_) {}
+
+    bool operator<(const reference_match_key &other) const {
+      for (std::size_t i = 0; i < 3; ++i) {
+        if (h[i] != other.h[i]) {
+          return h[i] < other.h[i];
+        }
+      }
+      if (entering != other.entering) {
+        return entering < other.entering;
+      }
+      if (id != other.id) {
+        return id < other.id;
+      }
+      return panel < other.panel;
+    }
+
+    bool operator==(const reference_match_key &other) const {
+      return h == other.h && entering == other.entering && id == other.id
+             && panel == other.panel;
+    }
+  };
+
+  /**
+   * Functor to compare the match keys of reflections by index
+   */
+  struct compare_reference_match_key {
+    const std::vector<reference_match_key> &keys;
+
+    compare_reference_match_key(const std::vector<reference_match_key> &keys_)
+        : keys(keys_) {}
+
+    bool operator()(std::size_t a, std::size_t b) const {
+      return keys[a] < keys[b];
+    }
+  };
+
+  /**
+   * Get the match keys of the reflections and the permutation sorting them
+   */
+  template <typename T>
+  std::vector<reference_match_key> reference_match_keys(
+    const T &self,
+    std::vector<std::size_t> &index) {
+    af::const_ref<cctbx::miller::index<> > h =
+      self.template get<cctbx::miller::index<> >("miller_index").const_ref();
+    af::const_ref<bool> entering = self.template get<bool>("entering").const_ref();
+    af::const_ref<int> id = self.template get<int>("id").const_ref();
+    af::const_ref<std::size_t> panel =
+      self.template get<std::size_t>("panel").const_ref();
+    std::vector<reference_match_key> keys;
+    keys.reserve(self.nrows());
+    index.resize(self.nrows());
+    for (std::size_t i = 0; i < self.nrows(); ++i) {
+      keys.push_back(reference_match_key(h[i], entering[i], id[i], panel[i]));
+      index[i] = i;
+    }
+    std::stable_sort(index.begin(), index.end(), compare_reference_match_key(keys));
+    return keys;
+  }
+
+  /**
+   * Match the reflections with those in a reference table with the same miller
+   * index, entering flag, experiment id and panel. Where the match is
+   * ambiguous, each reflection is paired with its nearest reference reflection
+   * by calculated position, and only the nearest reflection is kept for each
+   * reference reflection.
+   * @param self The reflection table
+   * @param other The reference reflection table
+   * @returns A tuple of the matching indices in each table, sorted by the
+   *          indices in self
+   */
+  template <typename T>
+  boost::python::tuple match_with_reference_indices(const T &self, const T &other) {
+    std::vector<std::size_t> index1, index2;
+    std::vector<reference_match_key> keys1 = reference_match_keys(self, index1);
+    std::vector<reference_match_key> keys2 = reference_match_keys(other, index2);
+    af::const_ref<vec3<double> > xyz1 =
+      self.template get<vec3<double> >("xyzcal.px").const_ref();
+    af::const_ref<vec3<double> > xyz2 =
+      other.template get<vec3<double> >("xyzcal.px").const_ref();
+
+    // Merge the sorted keys, and match the reflections within each group
+    std::vector<std::pair<std::size_t, std::size_t> > matches;
+    std::size_t a0 = 0, b0 = 0;
+    while (a0 < index1.size() && b0 < index2.size()) {
+      const reference_match_key &ka = keys1[index1[a0]];
+      const reference_match_key &kb = keys2[index2[b0]];
+      if (ka < kb) {
+        a0++;
+      } else if (kb < ka) {
+        b0++;
+      } else {
+        std::size_t a1 = a0 + 1, b1 = b0 + 1;
+        while (a1 < index1.size() && keys1[index1[a1]] == ka) {
+          a1++;
+        }
+        while (b1 < index2.size() && keys2[index2[b1]] == kb) {
+          b1++;
+        }
+        if (a1 - a0 == 1 && b1 - b0 == 1) {
+          matches.push_back(std::make_pair(index1[a0], index2[b0]));
+        } else {
+          std::size_t nb = b1 - b0;
+          std::vector<std::size_t> best(nb, index1.size());
+          std::vector<double> best_distance(nb);
+          for (std::size_t a = a0; a < a1; ++a) {
+            std::size_t i = index1[a];
+            std::size_t nearest = 0;
+            double nearest_distance = 0;
+            for (std::size_t b = 0; b < nb; ++b) {
+              double d = (xyz1[i] - xyz2[index2[b0 + b]]).length_sq();
+              if (b == 0 || d < nearest_distance) {
+                nearest = b;
+                nearest_distance = d;
+              }
+            }
+            if (best[nearest] == index1.size()
+                || nearest_distance < best_distance[nearest]) {
+              best[nearest] = i;
+              best_distance[nearest] = nearest_distance;
+            }
+          }
+          for (std::size_t b = 0; b < nb; ++b) {
+            if (best[b] != index1.size()) {
+              matches.push_back(std::make_pair(best[b], index2[b0 + b]));
+            }
+          }
+        }
+        a0 = a1;
+        b0 = b1;
+      }
+    }
+
+    // Sort by self index
+    std::sort(matches.begin(), matches.end());
+    af::shared<std::size_t> sind(matches.size());
+    af::shared<std::size_t> oind(matches.size());
+    for (std::size_t i = 0; i < matches.size(); ++i) {
+      sind[i] = matches[i].first;
+      oind[i] = matches[i].second;
+    }
+    return boost::python::make_tuple(sind, oind);
+  }
+
   /**
    * Select a number of rows from the table via an index array
    * @param self The current table
@@ -846,21 +1007,77 @@ namespace dials { namespace af { namespace boost_python {
     return true;
   }
 
+  /**
+   * A read-only view of the data of a Python object supporting the buffer
+   * protocol, e.g. bytes or a memoryview of a shared memory segment, so that
+   * it can be unpacked without a copy. The view is released on destruction.
+   */
+  class python_buffer_view {
+  public:
+    python_buffer_view(boost::python::object obj) {
+      if (PyObject_GetBuffer(obj.ptr(), &view_, PyBUF_SIMPLE) != 0) {
+        boost::python::throw_error_already_set();
+      }
+    }
+
+    ~python_buffer_view() {
+      PyBuffer_Release(&view_);
+    }
+
+    const char *data() const {
+      return static_cast<const char *>(view_.buf);
+    }
+
+    std::size_t size() const {
+      return view_.len;
+    }
+
+  private:
+    Py_buffer view_;
+  };
+
   /**
    * Unpack the reflection table from msgpack format
-   * @param the msgpack string
+   * @param the msgpack bytes, or any object supporting the buffer protocol
    * @returns The reflection table
    */
   reflection_table reflection_table_from_msgpack(boost::python::object packed) {
-    const char *data = PyBytes_AsString(packed.ptr());
-    std::size_t size = PyBytes_Size(packed.ptr());
+    python_buffer_view buffer(packed);
     msgpack::unpacked result;
     std::size_t off = 0;
-    msgpack::unpack(result, data, size, off, reflection_table_reference_func);
+    msgpack::unpack(
+      result, buffer.data(), buffer.size(), off, reflection_table_reference_func);
     reflection_table r = result.get().as<reflection_table>();
     return r;
   }
 
+  /**
+   * Unpack selected columns of the reflection table from msgpack format. The
+   * data for any other columns is skipped without being decoded.
+   * @param the msgpack bytes, or any object supporting the buffer protocol
+   * @param columns The names of the columns to unpack
+   * @param exclude Unpack all the columns except the named ones instead
+   * @returns The reflection table
+   */
+  reflection_table reflection_table_from_msgpack_columns(
+    boost::python::object packed,
+    boost::python::object columns,
+    bool exclude) {
+    std::set<std::string> names;
+    for (std::size_t i = 0; i < boost::python::len(columns); ++i) {
+      names.insert(boost::python::extract<std::string>(columns[i])());
+    }
+    python_buffer_view buffer(packed);
+    msgpack::unpacked result;
+    std::size_t off = 0;
+    msgpack::unpack(
+      result, buffer.data(), buffer.size(), off, reflection_table_reference_func);
+    reflection_table r;
+    msgpack::adaptor::convert_reflection_table_columns(names, exclude)(result.get(),
+                                                                       r);
+    return r;
+  }
+
   /*
    * Class to pickle and unpickle the table
    */
@@ -1000,9 +1217,16 @@ namespace dials { namespace af { namespace boost_python {
         .def("split_indices_by_experiment_id",
              &split_indices_by_experiment_id<flex_table_type>)
         .def("compute_phi_range", &compute_phi_range<flex_table_type>)
+        .def("match_with_reference_indices",
+             &match_with_reference_indices<flex_table_type>)
         .def("as_msgpack", &reflection_table_as_msgpack)
         .def("as_msgpack_to_file", &reflection_table_as_msgpack_to_file)
         .def("from_msgpack", &reflection_table_from_msgpack)
+        .def("from_msgpack",
+             &reflection_table_from_msgpack_columns,
+             (boost::python::arg("packed"),
+              boost::python::arg("columns"),
+              boost::python::arg("exclude") = false))
         .staticmethod("from_msgpack")
         .def("experiment_identifiers", &T::experiment_identifiers)
         .def("select", &reflection_table_select_rows_index<flex_table_type>)
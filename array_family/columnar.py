@@ -0,0 +1,309 @@
+"""
+A columnar, memory-mappable file format for reflection tables.
+
+The table is split into groups of rows, and each column of each row group is
+stored as a separate msgpack-encoded blob. A JSON footer at the end of the
+file records the position of every blob, along with the experiment
+identifiers. A reader memory-maps the file and only decodes the blobs for the
+requested columns and rows, so that e.g. the miller indices and intensities
+can be read from a large integrated file without touching the shoeboxes.
+
+The layout of the file is::
+
+  MAGIC | blob ... blob | footer (JSON) | footer length (uint64 LE) | MAGIC
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import mmap
+import os
+import struct
+
+from cctbx.array_family import flex
+
+import dials_array_family_flex_ext
+
+MAGIC = b"DIALSCOL"
+VERSION = 1
+DEFAULT_ROW_GROUP_SIZE = 1000000
+
+
+def is_columnar_file(filename):
+    """Check whether a file is a columnar reflection file."""
+    try:
+        with open(filename, "rb") as infile:
+            return infile.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+
+def write_columnar_file(table, filename, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """
+    Write a reflection table to a columnar file.
+
+    :param table: The reflection table
+    :param filename: The output filename
+    :param row_group_size: The number of rows in each row group
+    """
+    with ColumnarFileWriter(filename, row_group_size=row_group_size) as writer:
+        writer.write(table)
+
+
+class ColumnarFileWriter(object):
+    """
+    Write a columnar file incrementally, one reflection table at a time.
+
+    The rows of each table are appended to those already written, so that a
+    file can be built from many tables while only holding one in memory. The
+    columns of the file are the union of those of the tables: each row group
+    records its own columns, and any column missing from a row group is read
+    with default values, as by reflection_table.extend(). The footer is
+    written on close().
+    """
+
+    def __init__(self, filename, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+        """
+        :param filename: The output filename
+        :param row_group_size: The maximum number of rows in each row group
+        """
+        assert row_group_size > 0, "Invalid row group size"
+        self._row_group_size = row_group_size
+        self._footer = {
+            "version": VERSION,
+            "nrows": 0,
+            "columns": None,
+            "identifiers": {},
+            "row_groups": [],
+        }
+        self._file = open(filename, "wb")
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def nrows(self):
+        """The number of rows written so far."""
+        return self._footer["nrows"]
+
+    def write(self, table):
+        """
+        Append the rows and experiment identifiers of a reflection table.
+
+        :param table: The reflection table
+        """
+        columns = list(table.keys())
+        if self._footer["columns"] is None:
+            self._footer["columns"] = []
+        self._footer["columns"].extend(
+            name for name in columns if name not in self._footer["columns"]
+        )
+        identifiers = table.experiment_identifiers()
+        for k, v in zip(identifiers.keys(), identifiers.values()):
+            self._footer["identifiers"][str(k)] = v
+
+        nrows = table.size()
+        # Always write one row group, so that an empty table keeps its columns
+        end = nrows if self._footer["row_groups"] else max(nrows, 1)
+        for start in range(0, end, self._row_group_size):
+            stop = min(start + self._row_group_size, nrows)
+            rows = table[start:stop]
+            group = {
+                "start": self._footer["nrows"] + start,
+                "nrows": stop - start,
+                "columns": {},
+            }
+            for name in columns:
+                column_table = dials_array_family_flex_ext.reflection_table()
+                column_table[name] = rows[name]
+                blob = column_table.as_msgpack()
+                self._file.write(blob)
+                group["columns"][name] = [self._offset, len(blob)]
+                self._offset += len(blob)
+            self._footer["row_groups"].append(group)
+        self._footer["nrows"] += nrows
+
+    def close(self):
+        """Write the footer and close the file."""
+        if self._file is None:
+            return
+        if self._footer["columns"] is None:
+            self._footer["columns"] = []
+        footer = json.dumps(self._footer).encode("utf-8")
+        self._file.write(footer)
+        self._file.write(struct.pack("<Q", len(footer)))
+        self._file.write(MAGIC)
+        self._file.close()
+        self._file = None
+
+
+class ColumnarReflectionFile(object):
+    """
+    A memory-mapped columnar reflection file, from which columns and ranges
+    of rows can be loaded on demand.
+    """
+
+    def __init__(self, filename):
+        self._file = open(filename, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise RuntimeError("%s is not a columnar reflection file" % filename)
+        n = len(MAGIC)
+        if self._mmap[:n] != MAGIC or self._mmap[-n:] != MAGIC:
+            self.close()
+            raise RuntimeError("%s is not a columnar reflection file" % filename)
+        (footer_size,) = struct.unpack("<Q", self._mmap[-n - 8 : -n])
+        footer_start = len(self._mmap) - n - 8 - footer_size
+        footer = json.loads(self._mmap[footer_start : -n - 8].decode("utf-8"))
+        if footer["version"] > VERSION:
+            self.close()
+            raise RuntimeError(
+                "Unsupported columnar reflection file version %d" % footer["version"]
+            )
+        self.nrows = footer["nrows"]
+        self.columns = footer["columns"]
+        self.identifiers = {int(k): v for k, v in footer["identifiers"].items()}
+        self._row_groups = footer["row_groups"]
+        self._empty_columns = {}
+
+    def __len__(self):
+        return self.nrows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the memory map and the underlying file."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read(self, columns=None, rows=None, where=None, exclude_columns=None):
+        """
+        Load a reflection table from the file.
+
+        The selection is applied one row group at a time, so that only the
+        selected rows of the requested columns are ever held in memory.
+
+        :param columns: The column names to load (default all columns)
+        :param rows: A (start, stop) range of rows to load (default all rows)
+        :param where: A list of reflection_table_selector objects. Only the
+                      rows matching all of the selectors are loaded.
+        :param exclude_columns: The column names not to load
+        :return: The reflection table
+        """
+        if columns is None:
+            columns = self.columns
+        exclude_columns = exclude_columns or []
+        columns = [name for name in columns if name not in exclude_columns]
+        where = list(where or [])
+        where_columns = []
+        for selector in where:
+            where_columns.extend(
+                name for name in selector.columns if name not in where_columns
+            )
+        missing = [name for name in columns + where_columns if name not in self.columns]
+        if missing:
+            raise KeyError("Columns not in file: %s" % ", ".join(missing))
+        start, stop = (0, self.nrows) if rows is None else rows
+        start = max(0, start)
+        stop = min(stop, self.nrows)
+        stop = max(start, stop)
+
+        # The row groups overlapping the range, or the first row group if the
+        # range is empty, so that the columns are still created
+        groups = [
+            group
+            for group in self._row_groups
+            if group["start"] < stop and group["start"] + group["nrows"] > start
+        ] or self._row_groups[:1]
+
+        result = None
+        for group in groups:
+            hi = max(0, min(stop - group["start"], group["nrows"]))
+            lo = min(max(0, start - group["start"]), hi)
+            part = dials_array_family_flex_ext.reflection_table(hi - lo)
+            mask = None
+            if where:
+                for name in where_columns:
+                    part[name] = self._column(group, name, lo, hi)
+                mask = flex.bool(hi - lo, True)
+                for selector in where:
+                    mask &= selector(part)
+                part = part.select(mask)
+                for name in where_columns:
+                    if name not in columns:
+                        del part[name]
+            for name in columns:
+                if name in part:
+                    continue
+                data = self._column(group, name, lo, hi)
+                part[name] = data if mask is None else data.select(mask)
+            if result is None:
+                result = part
+            else:
+                result.extend(part)
+        if result is None:
+            # A file written without any tables has no row groups
+            result = dials_array_family_flex_ext.reflection_table()
+        for k, v in self.identifiers.items():
+            result.experiment_identifiers()[k] = v
+        return result
+
+    def _column(self, group, name, lo, hi):
+        if name not in group["columns"]:
+            return self._default_column(name, hi - lo)
+        offset, size = group["columns"][name]
+        # Decode the blob straight from the memory map, without copying it
+        with memoryview(self._mmap) as view, view[offset : offset + size] as blob:
+            table = dials_array_family_flex_ext.reflection_table.from_msgpack(blob)
+        data = table[name]
+        if (lo, hi) != (0, group["nrows"]):
+            data = data[lo:hi]
+        return data
+
+    def _default_column(self, name, n):
+        """
+        A column of n default values, for a row group written without it.
+
+        The type of the column is taken from the first row group that has it.
+        """
+        if name not in self._empty_columns:
+            group = next(g for g in self._row_groups if name in g["columns"])
+            self._empty_columns[name] = self._column(group, name, 0, 0)
+        table = dials_array_family_flex_ext.reflection_table()
+        table[name] = self._empty_columns[name][0:0]
+        table.resize(n)
+        return table[name]
+
+
+def read_columnar_file(
+    filename, columns=None, rows=None, where=None, exclude_columns=None
+):
+    """
+    Read a reflection table from a columnar file.
+
+    :param filename: The input filename
+    :param columns: The column names to load (default all columns)
+    :param rows: A (start, stop) range of rows to load (default all rows)
+    :param where: A list of row selectors (default all rows)
+    :param exclude_columns: The column names not to load
+    :return: The reflection table
+    """
+    with ColumnarReflectionFile(os.fspath(filename)) as reader:
+        return reader.read(
+            columns=columns, rows=rows, where=where, exclude_columns=exclude_columns
+        )
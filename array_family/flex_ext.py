@@ -5,12 +5,12 @@
 from __future__ import absolute_import, division, print_function
 
 import collections
-import copy
 import functools
 import itertools
 import logging
 import operator
 import os
+import weakref
 
 import six
 import six.moves.cPickle as pickle
@@ -43,6 +43,82 @@
     raise TypeError('unknown "real" type')
 
 
+def _sort_components(data, order=None):
+    """
+    Split a column into the scalar arrays to sort on, most significant first.
+
+    :param data: The column
+    :param order: For multi element items specify order
+    :return: A list of arrays
+    """
+    if isinstance(data, cctbx.array_family.flex.miller_index):
+        parts = data.as_vec3_double().parts()
+    elif isinstance(
+        data,
+        (
+            cctbx.array_family.flex.vec2_double,
+            cctbx.array_family.flex.vec3_double,
+            dials_array_family_flex_ext.int6,
+        ),
+    ):
+        parts = data.parts()
+    elif isinstance(data, cctbx.array_family.flex.mat3_double):
+        flat = data.as_double()
+        parts = [
+            flat.select(cctbx.array_family.flex.size_t_range(i, len(flat), 9))
+            for i in range(9)
+        ]
+    else:
+        return [data]
+    if order:
+        assert len(order) == len(parts)
+        parts = [parts[i] for i in order]
+    return list(parts)
+
+
+def _check_columns(table, columns):
+    """Raise a KeyError if any of the requested columns were not in the file."""
+    missing = [name for name in columns if name not in table]
+    if missing:
+        raise KeyError("Columns not in file: %s" % ", ".join(missing))
+
+
+class _ExperimentPartition(object):
+    """
+    The rows of a reflection table for each experiment id.
+
+    The rows are sorted by id with a stable sort, so the rows for each id are
+    a contiguous range of the permutation, in their original order.
+    """
+
+    def __init__(self, ids):
+        self.permutation = cctbx.array_family.flex.sort_permutation(ids, stable=True)
+        sorted_ids = ids.select(self.permutation)
+        n = len(sorted_ids)
+        starts = [0]
+        if n > 1:
+            starts.extend(
+                i + 1 for i in (sorted_ids[1:] != sorted_ids[:-1]).iselection()
+            )
+        self.ids = [sorted_ids[i] for i in starts] if n else []
+        self._ranges = dict(zip(self.ids, zip(starts, starts[1:] + [n])))
+
+    def count(self, i):
+        """The number of rows with id i."""
+        start, end = self._ranges.get(i, (0, 0))
+        return end - start
+
+    def indices(self, i):
+        """The indices of the rows with id i, in table order."""
+        start, end = self._ranges.get(i, (0, 0))
+        return self.permutation[start:end]
+
+
+# Experiment partitions of reflection tables, keyed by id(table), each with a
+# weak reference to the table and a copy of the id column it was built from
+_experiment_partitions = {}
+
+
 @boost_adaptbx.boost.python.inject_into(dials_array_family_flex_ext.reflection_table)
 class _(object):
     """
@@ -201,37 +277,160 @@ def as_msgpack_file(self, filename):
             self.as_msgpack_to_file(dials.util.ext.streambuf(python_file_obj=outfile))
 
     @staticmethod
-    def from_msgpack_file(filename):
+    def from_msgpack_file(filename, columns=None, exclude_columns=None):
         """
-        Read the reflection table from file in msgpack format
+        Read the reflection table from file in msgpack format. A file in the
+        columnar format, e.g. a merged dials.stills_process composite file, is
+        also accepted.
+
+        :param filename: The input filename
+        :param columns: The names of the columns to read (default all). The
+                        data for other columns is skipped without decoding.
+        :param exclude_columns: The names of columns not to read, e.g.
+                                ["shoebox"], if they are in the file
+        :return: The reflection table
         """
+        from dials.array_family import columnar
+
         if filename and hasattr(filename, "__fspath__"):
             filename = filename.__fspath__()
+        if columnar.is_columnar_file(filename):
+            return columnar.read_columnar_file(
+                filename, columns=columns, exclude_columns=exclude_columns
+            )
+        if columns is not None and exclude_columns:
+            columns = [name for name in columns if name not in exclude_columns]
         with libtbx.smart_open.for_reading(filename, "rb") as infile:
-            return dials_array_family_flex_ext.reflection_table.from_msgpack(
-                infile.read()
+            if columns is None and exclude_columns:
+                return dials_array_family_flex_ext.reflection_table.from_msgpack(
+                    infile.read(), list(exclude_columns), exclude=True
+                )
+            if columns is None:
+                return dials_array_family_flex_ext.reflection_table.from_msgpack(
+                    infile.read()
+                )
+            table = dials_array_family_flex_ext.reflection_table.from_msgpack(
+                infile.read(), list(columns)
             )
+        _check_columns(table, columns)
+        return table
+
+    def as_columnar_file(self, filename, row_group_size=None):
+        """
+        Write the reflection table to file in the columnar format, which may be
+        memory-mapped and read one column or range of rows at a time.
+
+        :param filename: The output filename
+        :param row_group_size: The number of rows stored together
+        """
+        from dials.array_family import columnar
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        # Clean up any removed experiments from the identifiers map
+        self.clean_experiment_identifiers_map()
+        if row_group_size is None:
+            row_group_size = columnar.DEFAULT_ROW_GROUP_SIZE
+        columnar.write_columnar_file(self, filename, row_group_size=row_group_size)
+
+    @staticmethod
+    def from_columnar_file(
+        filename, columns=None, rows=None, where=None, exclude_columns=None
+    ):
+        """
+        Read the reflection table from file in the columnar format
+
+        :param filename: The input filename
+        :param columns: The names of the columns to read (default all)
+        :param rows: A (start, stop) range of rows to read (default all)
+        :param where: A list of reflection_table_selector objects. Only the
+                      rows matching all of the selectors are read.
+        :param exclude_columns: The names of columns not to read
+        :return: The reflection table
+        """
+        from dials.array_family import columnar
+
+        return columnar.read_columnar_file(
+            filename,
+            columns=columns,
+            rows=rows,
+            where=where,
+            exclude_columns=exclude_columns,
+        )
 
     def as_file(self, filename):
         """
-        Write the reflection table to file in either msgpack or pickle format
+        Write the reflection table to file in either msgpack or pickle format,
+        or in the columnar format if the DIALS_USE_COLUMNAR environment variable
+        is set
         """
         if os.getenv("DIALS_USE_PICKLE"):
             self.as_pickle(filename)
+        elif os.getenv("DIALS_USE_COLUMNAR"):
+            self.as_columnar_file(filename)
         else:
             self.as_msgpack_file(filename)
 
     @staticmethod
-    def from_file(filename):
+    def from_file(filename, columns=None, where=None, exclude_columns=None):
         """
-        Read the reflection table from either pickle or msgpack
+        Read the reflection table from either pickle, msgpack or columnar format
+
+        :param filename: The input filename
+        :param columns: The names of the columns to read (default all)
+        :param where: A list of reflection_table_selector objects, e.g. on the
+                      "id" or "flags" columns. Only the rows matching all of
+                      the selectors are kept.
+        :param exclude_columns: The names of columns not to read, e.g.
+                                ["shoebox"], if they are in the file
+        :return: The reflection table
         """
+        from dials.array_family import columnar
+
+        if filename and hasattr(filename, "__fspath__"):
+            filename = filename.__fspath__()
+        if columnar.is_columnar_file(filename):
+            return dials_array_family_flex_ext.reflection_table.from_columnar_file(
+                filename, columns=columns, where=where, exclude_columns=exclude_columns
+            )
+
+        where = list(where or [])
+        where_columns = []
+        for selector in where:
+            where_columns.extend(
+                name for name in selector.columns if name not in where_columns
+            )
+        exclude_columns = list(exclude_columns or [])
+        if columns is not None:
+            columns = [name for name in columns if name not in exclude_columns]
+
+        # Decode only the requested columns and those needed for the selection
+        decode_columns = None
+        if columns is not None:
+            decode_columns = columns + [
+                name for name in where_columns if name not in columns
+            ]
         try:
-            return dials_array_family_flex_ext.reflection_table.from_msgpack_file(
-                filename
+            table = dials_array_family_flex_ext.reflection_table.from_msgpack_file(
+                filename,
+                columns=decode_columns,
+                exclude_columns=[
+                    name for name in exclude_columns if name not in where_columns
+                ],
             )
         except RuntimeError:
-            return dials_array_family_flex_ext.reflection_table.from_pickle(filename)
+            table = dials_array_family_flex_ext.reflection_table.from_pickle(filename)
+            if columns is not None:
+                _check_columns(table, columns)
+        if where:
+            mask = cctbx.array_family.flex.bool(table.size(), True)
+            for selector in where:
+                mask &= selector(table)
+            table = table.select(mask)
+        for name in list(table.keys()):
+            if name in exclude_columns or (columns is not None and name not in columns):
+                del table[name]
+        return table
 
     @staticmethod
     def empty_standard(nrows):
@@ -417,41 +616,61 @@ def copy(self):
         """
         return self.select(cctbx.array_family.flex.bool(len(self), True))
 
+    def sort_permutation(self, keys, reverse=False, order=None):
+        """
+        Get the permutation which sorts the reflection table by one or more keys.
+
+        The keys are compared lexicographically, with vector valued columns
+        compared component by component. The sort is done with a stable native
+        sort on each component in turn, from the least significant to the most.
+
+        :param keys: The name of the column, or a list of keys. Each key is a
+                     column name, or a (name, component) tuple to sort on a
+                     single component of a vector valued column.
+        :param reverse: Reverse the sort order, either for all keys or as a
+                        list with a value for each key
+        :param order: For multi element items specify order
+        :return: The permutation
+        """
+        if isinstance(keys, (six.string_types, tuple)):
+            keys = [keys]
+        assert len(keys) > 0, "No sort keys given"
+        if isinstance(reverse, bool):
+            reverse = [reverse] * len(keys)
+        assert len(reverse) == len(keys)
+
+        # The scalar arrays to sort on, most significant first
+        arrays = []
+        for key, key_reverse in zip(keys, reverse):
+            if isinstance(key, tuple):
+                name, component = key
+                arrays.append((_sort_components(self[name])[component], key_reverse))
+            else:
+                arrays.extend(
+                    (data, key_reverse)
+                    for data in _sort_components(self[key], order=order)
+                )
+
+        perm = None
+        for data, key_reverse in reversed(arrays):
+            if perm is not None:
+                data = data.select(perm)
+            p = cctbx.array_family.flex.sort_permutation(
+                data, reverse=key_reverse, stable=True
+            )
+            perm = p if perm is None else perm.select(p)
+        return perm
+
     def sort(self, name, reverse=False, order=None):
         """
         Sort the reflection table by a key.
 
-        :param name: The name of the column
+        :param name: The name of the column, or a list of keys to sort by in
+                     turn (see sort_permutation)
         :param reverse: Reverse the sort order
         :param order: For multi element items specify order
         """
-
-        if type(self[name]) in (
-            cctbx.array_family.flex.vec2_double,
-            cctbx.array_family.flex.vec3_double,
-            cctbx.array_family.flex.mat3_double,
-            dials_array_family_flex_ext.int6,
-            cctbx.array_family.flex.miller_index,
-        ):
-            data = self[name]
-            if not order:
-                perm = cctbx.array_family.flex.size_t(
-                    sorted(range(len(self)), key=lambda x: data[x], reverse=reverse)
-                )
-            else:
-                assert len(order) == len(data[0])
-                perm = cctbx.array_family.flex.size_t(
-                    sorted(
-                        range(len(self)),
-                        key=lambda x: tuple(data[x][i] for i in order),
-                        reverse=reverse,
-                    )
-                )
-        else:
-            perm = cctbx.array_family.flex.sort_permutation(
-                self[name], reverse=reverse, stable=True
-            )
-        self.reorder(perm)
+        self.reorder(self.sort_permutation(name, reverse=reverse, order=order))
 
     """
     Sorting the reflection table within an already sorted column
@@ -464,12 +683,9 @@ def subsort(self, key0, key1, reverse=False):
         :param key0: The name of the column values to sort within
         :param key1: The sorting key name within the selected column
         """
-        uniq_values = self[key0]
-        for ii in set(uniq_values):
-            val = (uniq_values == ii).iselection()
-            ref_tmp = copy.deepcopy(self[min(val) : (max(val) + 1)])
-            ref_tmp.sort(key1, reverse)
-            self[min(val) : (max(val) + 1)] = ref_tmp
+        data = self[key0]
+        reverse0 = len(data) > 1 and data[0] > data[len(data) - 1]
+        self.sort([key0, key1], reverse=[reverse0, reverse])
 
     def match(self, other):
         """
@@ -496,74 +712,9 @@ def match_with_reference(self, other):
         logger.info(" %d observed reflections input" % len(other))
         logger.info(" %d reflections predicted" % len(self))
 
-        # Get the miller index, entering flag and turn number for
-        # Both sets of reflections
-        i1 = self["id"]
-        h1 = self["miller_index"]
-        e1 = self["entering"].as_int()
-        x1, y1, z1 = self["xyzcal.px"].parts()
-        p1 = self["panel"]
-
-        i2 = other["id"]
-        h2 = other["miller_index"]
-        e2 = other["entering"].as_int()
-        x2, y2, z2 = other["xyzcal.px"].parts()
-        p2 = other["panel"]
-
-        class Match(object):
-            def __init__(self):
-                self.a = []
-                self.b = []
-
-        # Create the match lookup
-        lookup = collections.defaultdict(Match)
-        for i in range(len(self)):
-            item = h1[i] + (e1[i], i1[i], p1[i])
-            lookup[item].a.append(i)
-
-        # Add matches from input reflections
-        for i in range(len(other)):
-            item = h2[i] + (e2[i], i2[i], p2[i])
-            if item in lookup:
-                lookup[item].b.append(i)
-
-        # Create the list of matches
-        match1 = []
-        match2 = []
-        for item, value in lookup.items():
-            if len(value.b) == 0:
-                continue
-            elif len(value.a) == 1 and len(value.b) == 1:
-                match1.append(value.a[0])
-                match2.append(value.b[0])
-            else:
-                matched = {}
-                for i in value.a:
-                    d = []
-                    for j in value.b:
-                        dx = x1[i] - x2[j]
-                        dy = y1[i] - y2[j]
-                        dz = z1[i] - z2[j]
-                        d.append((i, j, dx ** 2 + dy ** 2 + dz ** 2))
-                    i, j, d = min(d, key=lambda x: x[2])
-                    if j not in matched:
-                        matched[j] = (i, d)
-                    elif d < matched[j][1]:
-                        matched[j] = (i, d)
-                for key1, value1 in matched.items():
-                    match1.append(value1[0])
-                    match2.append(key1)
-
-        # Select everything which matches
-        sind = cctbx.array_family.flex.size_t(match1)
-        oind = cctbx.array_family.flex.size_t(match2)
-
-        # Sort by self index
-        sort_index = cctbx.array_family.flex.size_t(
-            sorted(range(len(sind)), key=lambda x: sind[x])
-        )
-        sind = sind.select(sort_index)
-        oind = oind.select(sort_index)
+        # Match on the miller index, entering flag, experiment id and panel,
+        # choosing the nearest reflection where the match is ambiguous
+        sind, oind = self.match_with_reference_indices(other)
 
         s2 = self.select(sind)
         o2 = other.select(oind)
@@ -1025,6 +1176,73 @@ def compute_miller_indices_in_asu(self, experiments):
 
         return self["miller_index_asu"]
 
+    def experiment_partition(self):
+        """
+        Get the rows of the table for each experiment id.
+
+        The partition is computed with a single sort of the id column, and
+        cached until the id column changes, so per-experiment operations cost
+        O(n_reflections) in total rather than a selection over the whole
+        table for every experiment.
+
+        :return: The partition, with the sorted ids present in the table as
+                 partition.ids, and partition.indices(i) and partition.count(i)
+                 giving the rows with id i
+        """
+        ids = self["id"]
+        key = id(self)
+        entry = _experiment_partitions.get(key)
+        if entry is not None:
+            table_ref, cached_ids, partition = entry
+            if (
+                table_ref() is self
+                and len(cached_ids) == len(ids)
+                and cached_ids.all_eq(ids)
+            ):
+                return partition
+        partition = _ExperimentPartition(ids)
+        try:
+            table_ref = weakref.ref(
+                self, lambda ref: _experiment_partitions.pop(key, None)
+            )
+        except TypeError:
+            return partition
+        _experiment_partitions[key] = (table_ref, ids.deep_copy(), partition)
+        return partition
+
+    def iter_experiments(self):
+        """
+        Iterate over the reflections for each experiment id.
+
+        Reflections with a negative id, i.e. not assigned to an experiment, are
+        skipped. Each table keeps the rows in their original order, and the
+        full experiment identifiers map, as from a selection on the id column.
+
+        :return: A generator of (id, reflection table) tuples, in order of id
+        """
+        partition = self.experiment_partition()
+        for i in partition.ids:
+            if i >= 0:
+                yield i, self.select(partition.indices(i))
+
+    def select_experiments(self, ids):
+        """
+        Select the reflections for a set of experiment ids.
+
+        This gives the same table as selecting on the rows whose id is any of
+        ids, keeping the rows in their original order.
+
+        :param ids: An iterable of the experiment ids to select
+        :return: The selected reflection table
+        """
+        partition = self.experiment_partition()
+        indices = cctbx.array_family.flex.size_t()
+        for i in set(ids):
+            indices.extend(partition.indices(i))
+        return self.select(
+            indices.select(cctbx.array_family.flex.sort_permutation(indices))
+        )
+
     def select_on_experiment_identifiers(self, list_of_identifiers):
         """
         Given a list of experiment identifiers (strings), perform a selection
@@ -1046,12 +1264,7 @@ def select_on_experiment_identifiers(self, list_of_identifiers):
 Found %s"""
                 % (list_of_identifiers, id_values)
             )
-        # Build up a selection and use this
-        sel = cctbx.array_family.flex.bool(self.size(), False)
-        for id_val, exp_id in zip(id_values, list_of_identifiers):
-            id_sel = self["id"] == id_val
-            sel.set_selected(id_sel, True)
-        self = self.select(sel)
+        self = self.select_experiments(id_values)
         # Remove entries from the experiment_identifiers map
         for k in self.experiment_identifiers().keys():
             if k not in id_values:
@@ -1079,11 +1292,13 @@ def remove_on_experiment_identifiers(self, list_of_identifiers):
 Found %s"""
                 % (list_of_identifiers, id_values)
             )
-        # Now delete the selections, also removing the entry from the map
+        # Now delete the selections, also removing the entries from the map
+        partition = self.experiment_partition()
+        sel = cctbx.array_family.flex.bool(self.size(), False)
         for id_val in id_values:
-            sel = self["id"] == id_val
-            self.del_selected(sel)
+            sel.set_selected(partition.indices(id_val), True)
             del self.experiment_identifiers()[id_val]
+        self.del_selected(sel)
         return self
 
     def clean_experiment_identifiers_map(self):
@@ -1298,6 +1513,17 @@ def __init__(self, column, op, value):
         else:
             self.op = op
 
+    @property
+    def columns(self):
+        """
+        Return the names of the columns needed to make the selection
+        """
+        if self.column == "intensity.sum.i_over_sigma":
+            return ["intensity.sum.value", "intensity.sum.variance"]
+        elif self.column == "intensity.prf.i_over_sigma":
+            return ["intensity.prf.value", "intensity.prf.variance"]
+        return [self.column]
+
     @property
     def op_string(self):
         """
@@ -11,6 +11,8 @@
 #ifndef DIALS_ARRAY_FAMILY_REFLECTION_TABLE_MSGPACK_ADAPTER_H
 #define DIALS_ARRAY_FAMILY_REFLECTION_TABLE_MSGPACK_ADAPTER_H
 
+#include <set>
+#include <string>
 #include <scitbx/array_family/shared.h>
 #include <dials/array_family/reflection_table.h>
 #include <msgpack.hpp>
@@ -706,9 +708,19 @@ MSGPACK_API_VERSION_NAMESPACE(MSGPACK_DEFAULT_API_NS) {
      * The first entry identifies the data as a reflection table.
      * The second entry gives the version number in case this changes
      * The third entry is a dictionary containing data and metadata
+     *
+     * If a set of column names is given, then only those columns are decoded
+     * and the data for all other columns is skipped. If exclude is true, the
+     * given columns are skipped and all the other columns are decoded.
      */
-    template <>
-    struct convert<dials::af::reflection_table> {
+    struct convert_reflection_table_columns {
+      convert_reflection_table_columns()
+          : select_columns_(false), exclude_(false) {}
+
+      convert_reflection_table_columns(const std::set<std::string>& columns,
+                                       bool exclude = false)
+          : select_columns_(true), exclude_(exclude), columns_(columns) {}
+
       msgpack::object const& operator()(msgpack::object const& o,
                                         dials::af::reflection_table& v) const {
         typedef dials::af::reflection_table::key_type key_type;
@@ -827,14 +839,34 @@ MSGPACK_API_VERSION_NAMESPACE(MSGPACK_DEFAULT_API_NS) {
           msgpack::object_kv* last = first + map_object->via.map.size;
           for (msgpack::object_kv* it = first; it != last; ++it) {
             key_type key;
-            mapped_type value;
             it->key.convert(key);
+            if (select_columns_
+                && (columns_.find(key) == columns_.end()) != exclude_) {
+              continue;
+            }
+            mapped_type value;
             it->val.convert(value);
             v[key] = value;
           }
         }
         return o;
       }
+
+    private:
+      bool select_columns_;
+      bool exclude_;
+      std::set<std::string> columns_;
+    };
+
+    /**
+     * Convert a msgpack structure into a reflection table with all columns
+     */
+    template <>
+    struct convert<dials::af::reflection_table> {
+      msgpack::object const& operator()(msgpack::object const& o,
+                                        dials::af::reflection_table& v) const {
+        return convert_reflection_table_columns()(o, v);
+      }
     };
 
   }  // namespace adaptor
@@ -0,0 +1,90 @@
+"""Benchmark the scaling of the cosym target function with the number of lattices.
+
+Compares the time and memory needed to construct the target and to evaluate the
+functional and gradients for the dense and sparse implementations, e.g.::
+
+  dials.python benchmarks/benchmark_cosym_target.py 100 1000 10000
+"""
+from __future__ import absolute_import, division, print_function
+
+import sys
+import time
+
+from cctbx import sgtbx
+from scitbx.array_family import flex
+
+import dials.util
+from dials.algorithms.symmetry.cosym import target
+from dials.algorithms.symmetry.cosym._generate_test_data import generate_test_data
+
+# The dense rij matrix needs 8 * NN^2 bytes, so don't try beyond this
+MAX_DENSE_LATTICES = 2000
+
+
+def benchmark(sample_size, use_sparse, pair_fraction=None, weights="count"):
+    datasets, _ = generate_test_data(
+        space_group=sgtbx.space_group_info(symbol="P4").group(),
+        sample_size=sample_size,
+    )
+    intensities = datasets[0]
+    dataset_ids = flex.double(intensities.size(), 0)
+    for i, d in enumerate(datasets[1:]):
+        intensities = intensities.concatenate(d, assert_is_similar_symmetry=False)
+        dataset_ids.extend(flex.double(d.size(), i + 1))
+
+    t0 = time.time()
+    t = target.Target(
+        intensities,
+        dataset_ids,
+        weights=weights,
+        min_pairs=3,
+        use_sparse=use_sparse,
+        pair_fraction=pair_fraction,
+    )
+    t1 = time.time()
+    NN = sample_size * len(t.get_sym_ops())
+    x = flex.random_double(NN * t.dim)
+    t.compute_functional_and_gradients(x)
+    t2 = time.time()
+    if use_sparse:
+        nbytes = t.rij_matrix.data.nbytes + t.rij_matrix.indices.nbytes
+    else:
+        nbytes = t.rij_matrix.size() * 8
+    return t1 - t0, t2 - t1, nbytes / 1e6
+
+
+def run(args=None):
+    sample_sizes = [int(arg) for arg in (args or sys.argv[1:])] or [50, 100, 200]
+    rows = []
+    for sample_size in sample_sizes:
+        for use_sparse, pair_fraction in ((False, None), (True, None), (True, 0.1)):
+            if not use_sparse and sample_size > MAX_DENSE_LATTICES:
+                continue
+            rij_time, f_time, mb = benchmark(sample_size, use_sparse, pair_fraction)
+            rows.append(
+                (
+                    sample_size,
+                    "sparse" if use_sparse else "dense",
+                    pair_fraction or 1,
+                    "%.2f" % rij_time,
+                    "%.4f" % f_time,
+                    "%.1f" % mb,
+                )
+            )
+    print(
+        dials.util.tabulate(
+            rows,
+            headers=(
+                "Lattices",
+                "Mode",
+                "Pair fraction",
+                "Rij time (s)",
+                "f, g time (s)",
+                "Rij size (MB)",
+            ),
+        )
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,209 @@
+"""Benchmark the FAST-MCD estimate and MCD centroid outlier rejection.
+
+Compares the time taken by FastMCD with that of the previous implementation,
+which took the concentration steps for one trial at a time using covariance
+matrices and Mahalanobis distances built column by column, for datasets with
+the given numbers of observations. Then times the MCD outlier rejection of a
+multi-panel dataset, with its jobs run in 1 and nproc processes, e.g.::
+
+  dials.python benchmarks/benchmark_fast_mcd.py 100 500 5000
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from scitbx.array_family import flex
+
+import dials.util
+from dials.algorithms.refinement.outlier_detection import MCD
+from dials.algorithms.statistics.fast_mcd import FastMCD, sample_covariance
+from dials_refinement_helpers_ext import maha_dist_sq as maha_dist_sq_cpp
+
+
+def _loop_means_and_covariance(vecs):
+    """The location and scatter of a subset, as previously calculated"""
+
+    ncols = len(vecs)
+    S = flex.double(flex.grid(ncols, ncols))
+    for i in range(ncols):
+        for j in range(i, ncols):
+            S[i, j] = sample_covariance(vecs[i], vecs[j])
+    S.matrix_copy_upper_to_lower_triangle_in_place()
+    return flex.double([flex.mean(e) for e in vecs]), S
+
+
+def _loop_concentration_step(h, data, T, S):
+    """The concentration step for a single trial, as previously calculated"""
+
+    obs = flex.double(flex.grid(len(data[0]), len(data)))
+    for i, col in enumerate(data):
+        obs.matrix_paste_column_in_place(col, i)
+    p = flex.sort_permutation(maha_dist_sq_cpp(obs, T, S))
+    return [col.select(p)[0:h] for col in data]
+
+
+def _loop_steps(h, data, T, S, detS, n_steps, until_converged=False):
+    for _ in range(n_steps):
+        Tnew, Snew = _loop_means_and_covariance(_loop_concentration_step(h, data, T, S))
+        detSnew = Snew.matrix_determinant_via_lu()
+        if until_converged and detSnew == detS:
+            break
+        T, S, detS = Tnew, Snew, detSnew
+    return detS, T, S
+
+
+class LoopFastMCD(FastMCD):
+    """FastMCD taking the trials through the concentration steps one by one"""
+
+    def _loop_initial_trials(self, h, data, n_trials):
+        trials = []
+        for _ in range(n_trials):
+            p = flex.random_permutation(len(data[0]))
+            permuted = [col.select(p) for col in data]
+            detS0 = 0.0
+            subset_size = self._p + 1
+            while not detS0 > 0.0:
+                T0, S0 = _loop_means_and_covariance(
+                    [e[0:subset_size] for e in permuted]
+                )
+                detS0 = S0.matrix_determinant_via_lu()
+                subset_size += 1
+            T1, S1 = _loop_means_and_covariance(
+                _loop_concentration_step(h, data, T0, S0)
+            )
+            detS1 = S1.matrix_determinant_via_lu()
+            trials.append(_loop_steps(h, data, T1, S1, detS1, self._k1))
+        trials.sort(key=lambda x: x[0])
+        return trials[:10]
+
+    def small_dataset_estimate(self):
+        trials = self._loop_initial_trials(self._h, self._data, self._n_trials)
+        best = [
+            _loop_steps(self._h, self._data, T, S, detS, self._k3, True)
+            for detS, T, S in trials
+        ]
+        best.sort(key=lambda x: x[0])
+        return best[0][1], best[0][2]
+
+    def large_dataset_estimate(self):
+        ngroups = min(self._n // self._min_group_size, self._max_n_groups)
+        sample_size = self._n
+        if ngroups == self._max_n_groups:
+            sample_size = self._min_group_size * self._max_n_groups
+        rows = flex.random_selection(self._n, sample_size)
+        sampled = [e.select(rows) for e in self._data]
+        p = flex.random_permutation(sample_size)
+        permuted = [col.select(p) for col in sampled]
+        blocksize, rem = divmod(sample_size, ngroups)
+        bounds = [0]
+        for b in [blocksize] * (ngroups - rem) + [blocksize + 1] * rem:
+            bounds.append(bounds[-1] + b)
+        h_frac = self._h / self._n
+        trials = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            group = [col[start:end] for col in permuted]
+            h_sub = int((end - start) * h_frac)
+            n_trials = self._n_trials // ngroups
+            trials.extend(self._loop_initial_trials(h_sub, group, n_trials))
+        h_mrgd = int(sample_size * h_frac)
+        trials = [
+            _loop_steps(h_mrgd, sampled, T, S, detS, self._k2) for detS, T, S in trials
+        ]
+        trials.sort(key=lambda x: x[0])
+        n_reps = 1 if self._n > 5000 else 10
+        # only the first tier of the number of final steps is benchmarked
+        assert self._n * self._p <= 100000
+        k4 = self._k3
+        best = [
+            _loop_steps(self._h, self._data, T, S, detS, k4, True)
+            for detS, T, S in trials[:n_reps]
+        ]
+        best.sort(key=lambda x: x[0])
+        return best[0][1], best[0][2]
+
+
+def generate_residuals(n, seed=0):
+    """Correlated normal residuals in X, Y and phi with 10% outliers"""
+
+    rs = np.random.RandomState(seed)
+    X = rs.multivariate_normal(
+        (0.0, 0.0, 0.0),
+        ((0.01, 0.002, -0.001), (0.002, 0.01, -0.002), (-0.001, -0.002, 0.005)),
+        size=n,
+    )
+    n_out = n // 10
+    X[:n_out] += rs.uniform(-1.0, 1.0, size=(n_out, 3))
+    return [flex.double(np.ascontiguousarray(col)) for col in X.T]
+
+
+def benchmark_fast_mcd(n, mcd_class):
+    data = generate_residuals(n)
+    flex.set_random_seed(42)
+    t0 = time.time()
+    T, _ = mcd_class(data).get_raw_T_and_S()
+    return time.time() - t0, T
+
+
+def benchmark_outlier_rejection(n_panels, n_per_panel, nproc):
+    n = n_panels * n_per_panel
+    x, y, phi = generate_residuals(n)
+    reflections = flex.reflection_table()
+    reflections["id"] = flex.int(n, 0)
+    reflections["panel"] = flex.size_t([i % n_panels for i in range(n)])
+    reflections["x_resid"] = x
+    reflections["y_resid"] = y
+    reflections["phi_resid"] = phi
+    reflections["xyzobs.mm.value"] = flex.vec3_double(n)
+    reflections.set_flags(flex.bool(n, True), reflections.flags.predicted)
+    detector = MCD(separate_panels=True, nproc=nproc)
+    flex.set_random_seed(42)
+    t0 = time.time()
+    detector(reflections)
+    return time.time() - t0, detector.nreject
+
+
+def run(args=None):
+    sizes = [int(arg) for arg in (args or sys.argv[1:])] or [100, 500, 2000]
+    rows = []
+    for n in sizes:
+        loop_time, T_loop = benchmark_fast_mcd(n, LoopFastMCD)
+        time_, T = benchmark_fast_mcd(n, FastMCD)
+        rows.append(
+            (
+                n,
+                "%.2f" % loop_time,
+                "%.2f" % time_,
+                "%.1f" % (loop_time / time_),
+                "%.2g" % max(abs(a - b) for a, b in zip(T, T_loop)),
+            )
+        )
+    print(
+        dials.util.tabulate(
+            rows,
+            headers=(
+                "Nobs",
+                "Loop time (s)",
+                "Time (s)",
+                "Speedup",
+                "Max |delta T|",
+            ),
+        )
+    )
+
+    rows = []
+    for nproc in sorted({1, multiprocessing.cpu_count()}):
+        elapsed, nreject = benchmark_outlier_rejection(24, 400, nproc)
+        rows.append((24, nproc, "%.2f" % elapsed, nreject))
+    print(
+        dials.util.tabulate(
+            rows, headers=("Panels", "nproc", "Rejection time (s)", "Nout")
+        )
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,112 @@
+"""Benchmark the setup time of the scaling IhTable with the number of reflections.
+
+Compares the bulk construction of the h_index_matrix from an array of group ids
+with filling it one element at a time in Python, and times the setup of a full
+IhTable, with and without a free set, e.g.::
+
+  dials.python benchmarks/benchmark_ih_table.py 10000 100000 1000000
+"""
+from __future__ import absolute_import, division, print_function
+
+import random
+import sys
+import time
+
+from cctbx import sgtbx
+from scitbx import sparse
+
+import dials.util
+from dials.algorithms.scaling.Ih_table import IhTable
+from dials.array_family import flex
+from dials_scaling_ext import create_h_index_matrix
+
+# Filling the matrix in Python takes minutes beyond this
+MAX_LOOP_REFLECTIONS = 1000000
+
+
+def generate_reflections(n_refl, multiplicity=4):
+    """Generate a reflection table with about multiplicity observations of each
+    unique reflection."""
+    n_unique = max(1, n_refl // multiplicity)
+    hmax = int(round((2 * n_unique) ** (1 / 3))) + 1
+    reflections = flex.reflection_table()
+    reflections["miller_index"] = flex.miller_index(
+        [
+            (
+                random.randint(-hmax, hmax),
+                random.randint(-hmax, hmax),
+                random.randint(1, hmax),
+            )
+            for _ in range(n_refl)
+        ]
+    )
+    reflections["intensity"] = flex.random_double(n_refl) * 100 + 1
+    reflections["variance"] = flex.random_double(n_refl) * 10 + 1
+    reflections["inverse_scale_factor"] = flex.double(n_refl, 1.0)
+    return reflections
+
+
+def time_h_index_matrix(group_ids, n_groups, use_loop):
+    t0 = time.time()
+    if use_loop:
+        h_index_matrix = sparse.matrix(group_ids.size(), n_groups)
+        for i, id_ in enumerate(group_ids):
+            h_index_matrix[i, id_] = 1.0
+    else:
+        create_h_index_matrix(group_ids, n_groups)
+    return time.time() - t0
+
+
+def time_ih_table(reflections, space_group, free_set_percentage=0):
+    t0 = time.time()
+    IhTable(
+        [reflections],
+        space_group,
+        nblocks=1,
+        free_set_percentage=free_set_percentage,
+    )
+    return time.time() - t0
+
+
+def run(args=None):
+    n_reflections = [int(arg) for arg in (args or sys.argv[1:])] or [
+        10000,
+        100000,
+        1000000,
+    ]
+    space_group = sgtbx.space_group_info(symbol="P 2").group()
+    rows = []
+    for n_refl in n_reflections:
+        reflections = generate_reflections(n_refl)
+        n_groups = max(1, n_refl // 4)
+        group_ids = flex.int([random.randrange(n_groups) for _ in range(n_refl)])
+        if n_refl <= MAX_LOOP_REFLECTIONS:
+            loop_time = "%.3f" % time_h_index_matrix(group_ids, n_groups, True)
+        else:
+            loop_time = "-"
+        rows.append(
+            (
+                n_refl,
+                loop_time,
+                "%.3f" % time_h_index_matrix(group_ids, n_groups, False),
+                "%.3f" % time_ih_table(reflections, space_group),
+                "%.3f"
+                % time_ih_table(reflections, space_group, free_set_percentage=10),
+            )
+        )
+    print(
+        dials.util.tabulate(
+            rows,
+            headers=(
+                "Reflections",
+                "Python loop (s)",
+                "Bulk (s)",
+                "IhTable setup (s)",
+                "With free set (s)",
+            ),
+        )
+    )
+
+
+if __name__ == "__main__":
+    run()
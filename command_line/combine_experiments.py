@@ -208,6 +208,31 @@ def find_experiment_in(experiment, all_experiments):
     raise ValueError("Experiment not found")
 
 
+def select_experiments_by_identifier(reflections, experiments):
+    """Select the reflections for a list of experiments by their identifiers.
+
+    This gives the same table as reflections.select(experiments) followed by
+    reset_ids(), with the rows for each experiment in turn, but partitions the
+    table once rather than scanning every row for each experiment.
+
+    :param reflections: The reflection table, with experiment identifiers
+    :param experiments: The experiments to select
+    :returns: The selected reflections, with ids numbered from zero
+    """
+    id_values = {}
+    for id_value, identifier in reflections.experiment_identifiers():
+        id_values.setdefault(identifier, id_value)
+    partition = reflections.experiment_partition()
+    indices = flex.size_t()
+    for experiment in experiments:
+        id_value = id_values.get(experiment.identifier)
+        if id_value is not None:
+            indices.extend(partition.indices(id_value))
+    selected = reflections.select(indices)
+    selected.reset_ids()
+    return selected
+
+
 class ComparisonError(Exception):
     """Exception to indicate problem with tolerance comparisons"""
 
@@ -520,9 +545,9 @@ def average_detectors(target, panelgroups, depth):
             ids_map = dict(refs.experiment_identifiers())
             for k in refs.experiment_identifiers().keys():
                 del refs.experiment_identifiers()[k]
+            partition = refs.experiment_partition()
             for i, exp in enumerate(exps):
-                sel = refs["id"] == i
-                sub_ref = refs.select(sel)
+                sub_ref = refs.select(partition.indices(i))
                 n_sub_ref = len(sub_ref)
                 if (
                     params.output.min_reflections_per_experiment is not None
@@ -603,13 +628,15 @@ def average_detectors(target, panelgroups, depth):
                     # make sure select in order.
                     for idx in sorted(indices_to_sel):
                         subset_exp.append(experiments[idx])
-                    subset_refls = reflections.select(subset_exp)
-                    subset_refls.reset_ids()
+                    subset_refls = select_experiments_by_identifier(
+                        reflections, subset_exp
+                    )
                 else:
+                    partition = reflections.experiment_partition()
                     while n_picked < params.output.n_subset:
                         idx = indices.pop(random.randint(0, len(indices) - 1))
                         subset_exp.append(experiments[idx])
-                        refls = reflections.select(reflections["id"] == idx)
+                        refls = reflections.select(partition.indices(idx))
                         refls["id"] = flex.int(len(refls), n_picked)
                         subset_refls.extend(refls)
                         n_picked += 1
@@ -626,19 +653,22 @@ def average_detectors(target, panelgroups, depth):
                     for p in params.output.n_refl_panel_list:
                         sel |= reflections["panel"] == p
                     refls_subset = reflections.select(sel)
-                refl_counts = flex.int()
-                for expt_id in range(len(experiments)):
-                    refl_counts.append((refls_subset["id"] == expt_id).count(True))
+                partition = refls_subset.experiment_partition()
+                refl_counts = flex.int(
+                    [partition.count(expt_id) for expt_id in range(len(experiments))]
+                )
                 sort_order = flex.sort_permutation(refl_counts, reverse=True)
                 if reflections.experiment_identifiers().keys():
                     for idx in sorted(sort_order[: params.output.n_subset]):
                         subset_exp.append(experiments[idx])
-                    subset_refls = reflections.select(subset_exp)
-                    subset_refls.reset_ids()
+                    subset_refls = select_experiments_by_identifier(
+                        reflections, subset_exp
+                    )
                 else:
+                    partition = reflections.experiment_partition()
                     for expt_id, idx in enumerate(sort_order[: params.output.n_subset]):
                         subset_exp.append(experiments[idx])
-                        refls = reflections.select(reflections["id"] == idx)
+                        refls = reflections.select(partition.indices(idx))
                         refls["id"] = flex.int(len(refls), expt_id)
                         subset_refls.extend(refls)
                 print(
@@ -651,19 +681,22 @@ def average_detectors(target, panelgroups, depth):
                 params.output.significance_filter.enable = True
                 sig_filter = SignificanceFilter(params.output)
                 refls_subset = sig_filter(experiments, reflections)
-                refl_counts = flex.int()
-                for expt_id in range(len(experiments)):
-                    refl_counts.append((refls_subset["id"] == expt_id).count(True))
+                partition = refls_subset.experiment_partition()
+                refl_counts = flex.int(
+                    [partition.count(expt_id) for expt_id in range(len(experiments))]
+                )
                 sort_order = flex.sort_permutation(refl_counts, reverse=True)
                 if reflections.experiment_identifiers().keys():
                     for idx in sorted(sort_order[: params.output.n_subset]):
                         subset_exp.append(experiments[idx])
-                    subset_refls = reflections.select(subset_exp)
-                    subset_refls.reset_ids()
+                    subset_refls = select_experiments_by_identifier(
+                        reflections, subset_exp
+                    )
                 else:
+                    partition = reflections.experiment_partition()
                     for expt_id, idx in enumerate(sort_order[: params.output.n_subset]):
                         subset_exp.append(experiments[idx])
-                        refls = reflections.select(reflections["id"] == idx)
+                        refls = reflections.select(partition.indices(idx))
                         refls["id"] = flex.int(len(refls), expt_id)
                         subset_refls.extend(refls)
 
@@ -683,12 +716,14 @@ def save_in_batches(
                 if reflections.experiment_identifiers().keys():
                     for sub_idx in indices:
                         batch_expts.append(experiments[sub_idx])
-                    batch_refls = reflections.select(batch_expts)
-                    batch_refls.reset_ids()
+                    batch_refls = select_experiments_by_identifier(
+                        reflections, batch_expts
+                    )
                 else:
+                    partition = reflections.experiment_partition()
                     for sub_id, sub_idx in enumerate(indices):
                         batch_expts.append(experiments[sub_idx])
-                        sub_refls = reflections.select(reflections["id"] == sub_idx)
+                        sub_refls = reflections.select(partition.indices(sub_idx))
                         sub_refls["id"] = flex.int(len(sub_refls), sub_id)
                         batch_refls.extend(sub_refls)
                 exp_filename = os.path.splitext(exp_name)[0] + "_%03d.expt" % i
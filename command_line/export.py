@@ -477,6 +477,7 @@ def run(args=None):
         check_format=False,
         phil=phil_scope,
         epilog=help_message,
+        read_shoeboxes=False,
     )
 
     # Get the parameters
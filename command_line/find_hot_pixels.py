@@ -5,12 +5,21 @@
 import iotbx.phil
 
 import dials.util
+from dials.algorithms.spot_finding.finder import HotPixelAccumulator
 from dials.util.options import OptionParser, reflections_and_experiments_from_files
 
 logger = logging.getLogger("dials.command_line.find_hot_pixels")
 
 phil_scope = iotbx.phil.parse(
     """\
+input {
+  mask = None
+    .type = path
+    .multiple = True
+    .help = "Existing hot pixel masks, e.g. from previous runs of"
+            "dials.find_hot_pixels or dials.find_spots, to merge with the"
+            "hot pixels found in this run."
+}
 output {
   mask = hot_pixels.pickle
     .type = path
@@ -32,7 +41,9 @@
   likely to be reasonably accurate.
 
   The program returns a file names hot_pixels.pickle which contains a boolean mask
-  with True pixels being OK and False pixels being "hot" pixels.
+  with True pixels being OK and False pixels being "hot" pixels. Masks from
+  previous runs may be given with input.mask, in which case their hot pixels
+  are merged into the output mask.
 
   Examples::
     dials.find_hot_pixels models.expt strong.refl
@@ -41,8 +52,6 @@
 
 @dials.util.show_mail_handle_errors()
 def run(args=None):
-    import six.moves.cPickle as pickle
-
     from dials.util import Sorry, log
 
     usage = "dials.find_hot_pixels [options] models.expt strong.refl"
@@ -89,41 +98,32 @@ def run(args=None):
     assert len(reflections) == 1
     reflections = reflections[0]
 
-    mask = hot_pixel_mask(imagesets[0], reflections)
-    with open(params.output.mask, "wb") as fh:
-        pickle.dump(mask, fh, pickle.HIGHEST_PROTOCOL)
+    accumulator = hot_pixel_accumulator(imagesets[0], reflections)
+    for filename in params.input.mask:
+        accumulator.merge(HotPixelAccumulator.from_file(filename))
+    accumulator.to_file(params.output.mask)
 
     print("Wrote hot pixel mask to %s" % params.output.mask)
 
 
-def hot_pixel_mask(imageset, reflections):
+def hot_pixel_accumulator(imageset, reflections):
     depth = imageset.get_array_range()[1] - imageset.get_array_range()[0]
-    xylist = filter_reflections(reflections, depth)
-
-    from dials.array_family import flex
+    accumulator = HotPixelAccumulator.from_detector(imageset.get_detector())
 
-    mask = flex.bool(
-        flex.grid(reversed(imageset.get_detector()[0].get_image_size())), True
-    )
-
-    for x, y in xylist:
-        mask[y, x] = False
-
-    print("Found %d hot pixels" % len(xylist))
+    x0, _, y0, _, z0, z1 = reflections["bbox"].parts()
+    hot = (z1 - z0) == depth
+    panel = reflections["panel"]
+    for i in set(panel.select(hot)):
+        sel = hot & (panel == i)
+        accumulator.add_xy(i, x0.select(sel), y0.select(sel))
 
-    return (mask,)
+    print("Found %d hot pixels" % accumulator.num_hot())
 
+    return accumulator
 
-def filter_reflections(reflections, depth):
-    xylist = []
 
-    for i in range(len(reflections)):
-        refl = reflections[i]
-        s = refl["shoebox"]
-        if s.zsize() == depth:
-            xylist.append((s.xoffset(), s.yoffset()))
-
-    return xylist
+def hot_pixel_mask(imageset, reflections):
+    return hot_pixel_accumulator(imageset, reflections).as_mask()
 
 
 if __name__ == "__main__":
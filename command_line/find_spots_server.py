@@ -4,6 +4,7 @@
 
 standard_library.install_aliases()
 
+import functools
 import http.server as server_base
 import json
 import logging
@@ -60,6 +61,21 @@
 
   dials.find_spots_client /path/to/image.cbf min_spot_size=2 d_min=2
 
+Many images may be submitted in a single request by POSTing a JSON document
+to the server, which returns a JSON list of results, one per image::
+
+  {"filenames": ["/path/to/image_0001.cbf", ...], "params": ["d_min=2"]}
+
+Worker processes are long-lived: each caches the parsed parameters for a
+given set of arguments and the image format class of the most recently
+processed image, so that repeated requests for images from the same detector
+avoid the setup cost. Requests that arrive while all workers are busy wait in
+the listen queue, the length of which is set by request_queue_size; once
+this is full further connections are refused. Request counts and timings
+summed over all workers are available from::
+
+  http://hostname:1234/metrics
+
 To stop the server::
 
   dials.find_spots_client stop [host=hostname] [port=1234]
@@ -67,13 +83,8 @@
 
 stop = False
 
-
-def work(filename, cl=None):
-    if cl is None:
-        cl = []
-
-    phil_scope = libtbx.phil.parse(
-        """\
+work_phil_scope = libtbx.phil.parse(
+    """\
 ice_rings {
   filter = True
     .type = bool
@@ -87,32 +98,85 @@ def work(filename, cl=None):
 indexing_min_spots = 10
   .type = int(value_min=1)
 """
-    )
-    interp = phil_scope.command_line_argument_interpreter()
-    params, unhandled = interp.process_and_fetch(
-        cl, custom_processor="collect_remaining"
-    )
-    filter_ice = params.extract().ice_rings.filter
-    ice_rings_width = params.extract().ice_rings.width
-    index = params.extract().index
-    integrate = params.extract().integrate
-    indexing_min_spots = params.extract().indexing_min_spots
+)
 
-    from dxtbx.model.experiment_list import ExperimentListFactory
 
-    from dials.array_family import flex
+@functools.lru_cache(maxsize=32)
+def _fetch_phil_scopes(cl):
+    """
+    Interpret the command line arguments for each stage of the processing.
+
+    The result is cached for each distinct tuple of arguments, so that the
+    worker processes only need to parse the parameters once for a series of
+    requests with the same arguments.
+    """
+    interp = work_phil_scope.command_line_argument_interpreter()
+    work_phil, unhandled = interp.process_and_fetch(
+        list(cl), custom_processor="collect_remaining"
+    )
+
     from dials.command_line.find_spots import phil_scope as find_spots_phil_scope
 
     interp = find_spots_phil_scope.command_line_argument_interpreter()
-    phil_scope, unhandled = interp.process_and_fetch(
+    find_spots_phil, unhandled = interp.process_and_fetch(
         unhandled, custom_processor="collect_remaining"
     )
     logger.info("The following spotfinding parameters have been modified:")
-    logger.info(find_spots_phil_scope.fetch_diff(source=phil_scope).as_str())
+    logger.info(find_spots_phil_scope.fetch_diff(source=find_spots_phil).as_str())
+    return work_phil, find_spots_phil, unhandled
+
+
+# The format class of the most recently processed image in this process
+_cached_format_class = None
+
+
+def _experiments_from_filename(filename):
+    """
+    Create an experiment list for a single image file.
+
+    The format class of the previous image is tried first, avoiding a search
+    of the full format registry when a series of images from the same
+    detector is processed.
+    """
+    global _cached_format_class
+
+    from dxtbx.model.experiment_list import ExperimentListFactory
+
+    if _cached_format_class is not None:
+        try:
+            understood = _cached_format_class.understand(filename)
+        except Exception:
+            understood = False
+        if understood:
+            imageset = _cached_format_class.get_imageset([filename])
+            return ExperimentListFactory.from_imageset_and_crystal(imageset, None)
+
+    experiments = ExperimentListFactory.from_filenames([filename])
+    imagesets = experiments.imagesets()
+    if len(imagesets) == 1:
+        _cached_format_class = imagesets[0].get_format_class()
+    return experiments
+
+
+def work(filename, cl=None):
+    if cl is None:
+        cl = []
+
+    work_phil, phil_scope, unhandled = _fetch_phil_scopes(tuple(cl))
+    unhandled = list(unhandled)
+    work_params = work_phil.extract()
+    filter_ice = work_params.ice_rings.filter
+    ice_rings_width = work_params.ice_rings.width
+    index = work_params.index
+    integrate = work_params.integrate
+    indexing_min_spots = work_params.indexing_min_spots
+
+    from dials.array_family import flex
+
     params = phil_scope.extract()
     # no need to write the hot mask in the server/client
     params.spotfinder.write_hot_mask = False
-    experiments = ExperimentListFactory.from_filenames([filename])
+    experiments = _experiments_from_filename(filename)
     t0 = time.time()
     reflections = flex.reflection_table.from_observations(experiments, params)
     t1 = time.time()
@@ -260,6 +324,62 @@ def work(filename, cl=None):
     return stats
 
 
+class Metrics(object):
+    """Request counters and timings, shared between the worker processes."""
+
+    def __init__(self):
+        self._lock = multiprocessing.Lock()
+        self._start_time = time.time()
+        self._n_requests = multiprocessing.Value("l", 0, lock=False)
+        self._n_images = multiprocessing.Value("l", 0, lock=False)
+        self._n_errors = multiprocessing.Value("l", 0, lock=False)
+        self._total_time = multiprocessing.Value("d", 0.0, lock=False)
+        self._max_time = multiprocessing.Value("d", 0.0, lock=False)
+
+    def record(self, n_images, n_errors, elapsed):
+        """Record the processing of a single request."""
+        with self._lock:
+            self._n_requests.value += 1
+            self._n_images.value += n_images
+            self._n_errors.value += n_errors
+            self._total_time.value += elapsed
+            self._max_time.value = max(self._max_time.value, elapsed)
+
+    def as_dict(self):
+        """Summarise the metrics, including mean latency and throughput."""
+        with self._lock:
+            n_requests = self._n_requests.value
+            n_images = self._n_images.value
+            d = {
+                "n_requests": n_requests,
+                "n_images": n_images,
+                "n_errors": self._n_errors.value,
+                "total_time": self._total_time.value,
+                "max_latency": self._max_time.value,
+            }
+        uptime = time.time() - self._start_time
+        d["uptime"] = uptime
+        d["mean_latency"] = d["total_time"] / n_requests if n_requests else 0.0
+        d["mean_time_per_image"] = d["total_time"] / n_images if n_images else 0.0
+        d["images_per_second"] = n_images / uptime if uptime > 0 else 0.0
+        return d
+
+
+def _work_for_response(filename, params):
+    """Process one image, returning the response dictionary and status."""
+    d = {"image": filename}
+    t0 = time.time()
+    try:
+        stats = work(filename, params)
+        d.update(stats)
+        status = 200
+    except Exception as e:
+        d["error"] = str(e)
+        status = 500
+    d["time_taken"] = time.time() - t0
+    return d, status
+
+
 class handler(server_base.BaseHTTPRequestHandler):
     def do_GET(self):
         """Respond to a GET request."""
@@ -271,6 +391,10 @@ def do_GET(self):
             stop = True
             return
 
+        if self.path == "/metrics":
+            self._send_json(200, self.server.metrics.as_dict())
+            return
+
         filename = self.path.split(";")[0]
         params = self.path.split(";")[1:]
 
@@ -278,16 +402,32 @@ def do_GET(self):
         if "%3A//" in filename:
             filename = urllib.parse.unquote(filename[1:])
 
-        d = {"image": filename}
+        d, response = _work_for_response(filename, params)
+        self.server.metrics.record(1, int(response != 200), d["time_taken"])
+        self._send_json(response, d)
 
+    def do_POST(self):
+        """Respond to a POST request, containing a batch of images."""
+        t0 = time.time()
         try:
-            stats = work(filename, params)
-            d.update(stats)
-            response = 200
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode())
+            filenames = request["filenames"]
+            params = request.get("params", [])
         except Exception as e:
-            d["error"] = str(e)
-            response = 500
+            self._send_json(400, {"error": "Invalid batch request: %s" % e})
+            return
 
+        results = []
+        n_errors = 0
+        for filename in filenames:
+            d, response = _work_for_response(filename, params)
+            results.append(d)
+            n_errors += int(response != 200)
+        self.server.metrics.record(len(filenames), n_errors, time.time() - t0)
+        self._send_json(200, results)
+
+    def _send_json(self, response, d):
         self.send_response(response)
         self.send_header("Content-type", "application/json")
         self.end_headers()
@@ -309,13 +449,25 @@ def serve(httpd):
   .type = int(value_min=1)
 port = 1701
   .type = int(value_min=1)
+request_queue_size = 128
+  .type = int(value_min=1)
+  .help = "The maximum number of connections waiting for a free worker before"
+          "further connections are refused."
 """
 )
 
 
-def main(nproc, port):
+def main(nproc, port, request_queue_size=128):
     server_class = server_base.HTTPServer
-    httpd = server_class(("", port), handler)
+    httpd = server_class(("", port), handler, bind_and_activate=False)
+    httpd.request_queue_size = request_queue_size
+    httpd.metrics = Metrics()
+    try:
+        httpd.server_bind()
+        httpd.server_activate()
+    except Exception:
+        httpd.server_close()
+        raise
     print(time.asctime(), "Serving %d processes on port %d" % (nproc, port))
 
     for j in range(nproc - 1):
@@ -343,7 +495,7 @@ def run(args=None):
         from libtbx.introspection import number_of_processors
 
         params.nproc = number_of_processors(return_value_if_unknown=-1)
-    main(params.nproc, params.port)
+    main(params.nproc, params.port, request_queue_size=params.request_queue_size)
 
 
 if __name__ == "__main__":
@@ -5,6 +5,7 @@
 import copy
 import itertools
 import math
+import multiprocessing
 from collections import OrderedDict
 
 import numpy as np
@@ -20,6 +21,7 @@
 from dials.algorithms.scaling.scaling_utilities import DialsMergingStatisticsError
 from dials.array_family import flex
 from dials.report.analysis import combined_table_to_batch_dependent_properties
+from dials.report.binning import histogram2d, unit_bin_sums
 from dials.report.plots import (
     AnomalousPlotter,
     IntensityStatisticsPlots,
@@ -78,6 +80,11 @@
     .type = ints(size=2)
   pixels_per_bin = 40
     .type = int(value_min=1)
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of processes to use to run the independent analyses"
+            "of the reflections in parallel"
+    .expert_level = 1
 
   centroid_diff_max = None
     .help = "Magnitude in pixels of shifts mapped to the extreme colours"
@@ -466,7 +473,7 @@ def __call__(self, rlist):
         if "intensity.sum.variance" in rlist:
             selection = rlist["intensity.sum.variance"] <= 0
             if selection.count(True) > 0:
-                rlist.del_selected(selection)
+                rlist = rlist.select(~selection)
                 print(
                     " Removing %d reflections with variance <= 0"
                     % selection.count(True)
@@ -510,21 +517,17 @@ def spot_count_per_image(self, rlist):
             ids = rlist["imageset_id"]
         else:
             ids = rlist["id"]
-        spot_count_per_image = []
-        indexed_per_image = []
-        for j in range(flex.max(ids) + 1):
-            spot_count_per_image.append([])
-            ids_sel = ids == j
-            zsel = z.select(ids_sel)
-            for i in range(max_z):
-                sel = (zsel >= i) & (zsel < (i + 1))
-                spot_count_per_image[j].append(sel.count(True))
-            if n_indexed > 0:
-                indexed_per_image.append([])
-                zsel = z.select(ids_sel & indexed_sel)
-                for i in range(max_z):
-                    sel = (zsel >= i) & (zsel < (i + 1))
-                    indexed_per_image[j].append(sel.count(True))
+        n_ids = flex.max(ids) + 1
+        spot_count_per_image, _ = unit_bin_sums(z, max_z, groups=ids, n_groups=n_ids)
+        spot_count_per_image = spot_count_per_image.tolist()
+        if n_indexed > 0:
+            indexed_per_image, _ = unit_bin_sums(
+                z.select(indexed_sel),
+                max_z,
+                groups=ids.select(indexed_sel),
+                n_groups=n_ids,
+            )
+            indexed_per_image = indexed_per_image.tolist()
 
         d = {
             "spot_count_per_image": {
@@ -572,13 +575,13 @@ def spot_count_per_image(self, rlist):
         if indexed_sel.count(True) > 0 and flex.max(rlist["id"]) > 0:
             # multiple lattices
             ids = rlist["id"]
-            indexed_per_lattice_per_image = []
-            for j in range(flex.max(ids) + 1):
-                indexed_per_lattice_per_image.append([])
-                zsel = z.select((ids == j) & indexed_sel)
-                for i in range(max_z):
-                    sel = (zsel >= i) & (zsel < (i + 1))
-                    indexed_per_lattice_per_image[j].append(sel.count(True))
+            indexed_per_lattice_per_image, _ = unit_bin_sums(
+                z.select(indexed_sel),
+                max_z,
+                groups=ids.select(indexed_sel),
+                n_groups=flex.max(ids) + 1,
+            )
+            indexed_per_lattice_per_image = indexed_per_lattice_per_image.tolist()
 
             d["indexed_per_lattice_per_image"] = {
                 "data": [],
@@ -613,7 +616,7 @@ def unindexed_count_xy(self, rlist):
         x = x.select(~indexed_sel).as_numpy_array()
         y = y.select(~indexed_sel).as_numpy_array()
 
-        H, xedges, yedges = np.histogram2d(x, y, bins=(self.nbinsx, self.nbinsy))
+        H, _, xedges, yedges = histogram2d(x, y, bins=(self.nbinsx, self.nbinsy))
 
         return {
             "n_unindexed_vs_xy": {
@@ -652,7 +655,7 @@ def indexed_count_xy(self, rlist):
         x = x.select(indexed_sel).as_numpy_array()
         y = y.select(indexed_sel).as_numpy_array()
 
-        H, xedges, yedges = np.histogram2d(x, y, bins=(self.nbinsx, self.nbinsy))
+        H, _, xedges, yedges = histogram2d(x, y, bins=(self.nbinsx, self.nbinsy))
 
         return {
             "n_indexed_vs_xy": {
@@ -709,14 +712,14 @@ def __call__(self, rlist):
         # Remove I_sigma <= 0
         selection = rlist["intensity.sum.variance"] <= 0
         if selection.count(True) > 0:
-            rlist.del_selected(selection)
+            rlist = rlist.select(~selection)
             print(" Removing %d reflections with variance <= 0" % selection.count(True))
 
         # Remove partial reflections as their observed centroids won't be accurate
         if "partiality" in rlist:
             selection = rlist["partiality"] < 0.99
             if selection.count(True) > 0 and selection.count(True) < selection.size():
-                rlist.del_selected(selection)
+                rlist = rlist.select(~selection)
                 print(" Removing %d partial reflections" % selection.count(True))
 
         # Select only integrated reflections
@@ -816,9 +819,9 @@ def centroid_diff_xy(self, rlist, threshold):
         xd = xd.as_numpy_array()
         yd = yd.as_numpy_array()
 
-        H, xedges, yedges = np.histogram2d(xc, yc, bins=(nbinsx, nbinsy))
-        H1, xedges, yedges = np.histogram2d(xc, yc, bins=(nbinsx, nbinsy), weights=xd)
-        H2, xedges, yedges = np.histogram2d(xc, yc, bins=(nbinsx, nbinsy), weights=yd)
+        H, (H1, H2), xedges, yedges = histogram2d(
+            xc, yc, bins=(nbinsx, nbinsy), weights=(xd, yd)
+        )
 
         nonzeros = np.nonzero(H)
         z1 = np.empty(H.shape)
@@ -895,7 +898,7 @@ def centroid_diff_z(self, rlist, threshold):
             # probably still images, no z residuals
             return {}
 
-        H, xedges, yedges = np.histogram2d(zc, zd, bins=(100, 100))
+        H, _, xedges, yedges = histogram2d(zc, zd, bins=(100, 100))
 
         return {
             "centroid_differences_z": {
@@ -942,29 +945,24 @@ def centroid_mean_diff_vs_phi(self, rlist, threshold):
             # probably still images, no z residuals
             return {}
 
-        mean_residuals_x = flex.double()
-        mean_residuals_y = flex.double()
-        mean_residuals_phi = flex.double()
-        rmsd_x = flex.double()
-        rmsd_y = flex.double()
-        rmsd_phi = flex.double()
         phi_obs_deg = RAD2DEG * zo
-        phi = []
-
-        for i_phi in range(
-            int(math.floor(flex.min(phi_obs_deg))),
-            int(math.ceil(flex.max(phi_obs_deg))),
-        ):
-            sel = (phi_obs_deg >= i_phi) & (phi_obs_deg < (i_phi + 1))
-            if sel.count(True) == 0:
-                continue
-            mean_residuals_x.append(flex.mean(dx.select(sel)))
-            mean_residuals_y.append(flex.mean(dy.select(sel)))
-            mean_residuals_phi.append(flex.mean(dphi.select(sel)))
-            rmsd_x.append(math.sqrt(flex.mean_sq(dx.select(sel))))
-            rmsd_y.append(math.sqrt(flex.mean_sq(dy.select(sel))))
-            rmsd_phi.append(math.sqrt(flex.mean_sq(dphi.select(sel))))
-            phi.append(i_phi)
+        phi_start = int(math.floor(flex.min(phi_obs_deg)))
+        n_phi = int(math.ceil(flex.max(phi_obs_deg))) - phi_start
+        counts, sums = unit_bin_sums(
+            phi_obs_deg,
+            n_phi,
+            start=phi_start,
+            weights=(dx, dy, dphi, dx * dx, dy * dy, dphi * dphi),
+        )
+        # Only report the one degree bins that contain reflections
+        sel = counts[0] > 0
+        counts = counts[0][sel]
+        sums = [s[0][sel] for s in sums]
+        phi = (np.arange(n_phi)[sel] + phi_start).tolist()
+        mean_residuals_x, mean_residuals_y, mean_residuals_phi = (
+            (s / counts).tolist() for s in sums[:3]
+        )
+        rmsd_x, rmsd_y, rmsd_phi = (np.sqrt(s / counts).tolist() for s in sums[3:])
 
         d = {
             "centroid_mean_differences_vs_phi": {
@@ -1062,12 +1060,12 @@ def centroid_xy_xz_zy_residuals(self, rlist, threshold):
 
         histx = flex.histogram(dx, n_slots=100)
         histy = flex.histogram(dy, n_slots=100)
-        Hxy, xedges, yedges = np.histogram2d(dx, dy, bins=(50, 50))
+        Hxy, _, xedges, yedges = histogram2d(dx, dy, bins=(50, 50))
 
         if not is_stills:
             histz = flex.histogram(dz, n_slots=100)
-            Hzy, zedges, yedges = np.histogram2d(dz, dy, bins=(50, 50))
-            Hxz, xedges, zedges = np.histogram2d(dx, dz, bins=(50, 50))
+            Hzy, _, zedges, yedges = histogram2d(dz, dy, bins=(50, 50))
+            Hxz, _, xedges, zedges = histogram2d(dx, dz, bins=(50, 50))
 
         density_hist_layout = {
             "showlegend": False,
@@ -1280,12 +1278,12 @@ def __call__(self, rlist):
 
         selection = rlist["intensity.sum.variance"] <= 0
         if selection.count(True) > 0:
-            rlist.del_selected(selection)
+            rlist = rlist.select(~selection)
             print(" Removing %d reflections with variance <= 0" % selection.count(True))
 
         selection = rlist["intensity.sum.value"] <= 0
         if selection.count(True) > 0:
-            rlist.del_selected(selection)
+            rlist = rlist.select(~selection)
             print(
                 " Removing %d reflections with intensity <= 0" % selection.count(True)
             )
@@ -1364,14 +1362,8 @@ def i_over_s_vs_xy(self, rlist, intensity_type):
         I_over_S = I / I_sig
         x, y, z = rlist["xyzcal.px"].parts()
 
-        H, xedges, yedges = np.histogram2d(
-            x.as_numpy_array(), y.as_numpy_array(), bins=(self.nbinsx, self.nbinsy)
-        )
-        H1, xedges, yedges = np.histogram2d(
-            x.as_numpy_array(),
-            y.as_numpy_array(),
-            bins=(self.nbinsx, self.nbinsy),
-            weights=flex.log10(I_over_S).as_numpy_array(),
+        H, (H1,), xedges, yedges = histogram2d(
+            x, y, bins=(self.nbinsx, self.nbinsy), weights=(flex.log10(I_over_S),)
         )
 
         nonzeros = np.nonzero(H)
@@ -1413,7 +1405,7 @@ def i_over_s_vs_z(self, rlist):
         I_over_S = I / I_sig
         x, y, z = rlist["xyzcal.px"].parts()
 
-        H, xedges, yedges = np.histogram2d(
+        H, _, xedges, yedges = histogram2d(
             z.as_numpy_array(), flex.log10(I_over_S).as_numpy_array(), bins=(100, 100)
         )
 
@@ -1490,8 +1482,9 @@ def qe_xy(self, rlist):
         yc = yc.as_numpy_array()
         qe = qe.as_numpy_array()
 
-        H, xedges, yedges = np.histogram2d(xc, yc, bins=(nbinsx, nbinsy))
-        H1, xedges, yedges = np.histogram2d(xc, yc, bins=(nbinsx, nbinsy), weights=qe)
+        H, (H1,), xedges, yedges = histogram2d(
+            xc, yc, bins=(nbinsx, nbinsy), weights=(qe,)
+        )
 
         nonzeros = np.nonzero(H)
         z1 = np.empty(H.shape)
@@ -1564,12 +1557,12 @@ def __call__(self, rlist, experiments):
 
         selection = rlist["intensity.sum.variance"] <= 0
         if selection.count(True) > 0:
-            rlist.del_selected(selection)
+            rlist = rlist.select(~selection)
             print(" Removing %d reflections with variance <= 0" % selection.count(True))
 
         selection = rlist["intensity.sum.value"] <= 0
         if selection.count(True) > 0:
-            rlist.del_selected(selection)
+            rlist = rlist.select(~selection)
             print(
                 " Removing %d reflections with intensity <= 0" % selection.count(True)
             )
@@ -1927,7 +1920,7 @@ def reference_xy(self, rlist):
         rlist = rlist.select(mask)
         x, y, z = rlist["xyzcal.px"].parts()
 
-        H, xedges, yedges = np.histogram2d(
+        H, _, xedges, yedges = histogram2d(
             x.as_numpy_array(), y.as_numpy_array(), bins=(self.nbinsx, self.nbinsy)
         )
 
@@ -2012,14 +2005,8 @@ def reflection_corr_vs_xy(self, rlist, filename):
         corr = rlist["profile.correlation"]
         x, y, z = rlist["xyzcal.px"].parts()
 
-        H, xedges, yedges = np.histogram2d(
-            x.as_numpy_array(), y.as_numpy_array(), bins=(self.nbinsx, self.nbinsy)
-        )
-        H1, xedges, yedges = np.histogram2d(
-            x.as_numpy_array(),
-            y.as_numpy_array(),
-            bins=(self.nbinsx, self.nbinsy),
-            weights=corr.as_numpy_array(),
+        H, (H1,), xedges, yedges = histogram2d(
+            x, y, bins=(self.nbinsx, self.nbinsy), weights=(corr,)
         )
 
         nonzeros = np.nonzero(H)
@@ -2062,7 +2049,7 @@ def reflection_corr_vs_z(self, rlist, filename):
         corr = rlist["profile.correlation"]
         x, y, z = rlist["xyzcal.px"].parts()
 
-        H, xedges, yedges = np.histogram2d(
+        H, _, xedges, yedges = histogram2d(
             z.as_numpy_array(), corr.as_numpy_array(), bins=(100, 100)
         )
 
@@ -2109,7 +2096,7 @@ def reflection_corr_vs_ios(self, rlist, filename):
         I_over_S = I_over_S.select(mask)
         corr = corr.select(mask)
 
-        H, xedges, yedges = np.histogram2d(
+        H, _, xedges, yedges = histogram2d(
             flex.log10(I_over_S).as_numpy_array(),
             corr.as_numpy_array(),
             bins=(100, 100),
@@ -2229,6 +2216,21 @@ def intensity_statistics(reflections, experiments):
     return resolution_plots, misc_plots, intensity_plots
 
 
+# The analysers and reflections shared by the analyses run in a worker process,
+# set by _init_analyser_worker
+_analyser_worker_data = None
+
+
+def _init_analyser_worker(analysers, reflections):
+    global _analyser_worker_data
+    _analyser_worker_data = (analysers, reflections)
+
+
+def _run_analyser(i):
+    analysers, reflections = _analyser_worker_data
+    return analysers[i](reflections)
+
+
 class Analyser(object):
     """Helper class to do all the analysis."""
 
@@ -2255,8 +2257,24 @@ def __call__(self, rlist=None, experiments=None):
         json_data = OrderedDict()
 
         if rlist is not None:
-            for analyse in self.analysers:
-                result = analyse(copy.deepcopy(rlist))
+            # The analysers select the reflections they need rather than modify
+            # the table, so they can share one copy of it, without the
+            # shoeboxes that none of them use
+            reflections = flex.reflection_table()
+            for key in rlist.keys():
+                if key != "shoebox":
+                    reflections[key] = rlist[key]
+            nproc = min(self.params.nproc, len(self.analysers))
+            if nproc > 1:
+                with multiprocessing.Pool(
+                    processes=nproc,
+                    initializer=_init_analyser_worker,
+                    initargs=(self.analysers, reflections),
+                ) as pool:
+                    results = pool.map(_run_analyser, range(len(self.analysers)), 1)
+            else:
+                results = [analyse(reflections) for analyse in self.analysers]
+            for result in results:
                 if result is not None:
                     json_data.update(result)
         else:
@@ -2527,6 +2545,7 @@ def __init__(self):
             read_experiments=True,
             check_format=False,
             epilog=help_message,
+            read_shoeboxes=False,
         )
         dials.util.log.print_banner()
 
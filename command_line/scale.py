@@ -204,14 +204,22 @@ def run(args: List[str] = None, phil: phil.scope = phil_scope) -> None:
     usage = """Usage: dials.scale integrated.refl integrated.expt
 [integrated.refl(2) integrated.expt(2) ....] [options]"""
 
-    parser = OptionParser(
-        usage=usage,
-        read_experiments=True,
-        read_reflections=True,
-        phil=phil,
-        check_format=False,
-        epilog=__doc__,
-    )
+    def option_parser(read_shoeboxes):
+        return OptionParser(
+            usage=usage,
+            read_experiments=True,
+            read_reflections=True,
+            phil=phil,
+            check_format=False,
+            epilog=__doc__,
+            read_shoeboxes=read_shoeboxes,
+        )
+
+    # The shoeboxes are only read if they are to be kept in the output
+    parser = option_parser(read_shoeboxes=False)
+    params, _ = parser.parse_args(args=args, show_diff_phil=False, quick_parse=True)
+    if not params.output.delete_integration_shoeboxes:
+        parser = option_parser(read_shoeboxes=True)
     params, options = parser.parse_args(args=args, show_diff_phil=False)
 
     if not params.input.experiments or not params.input.reflections:
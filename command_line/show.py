@@ -60,6 +60,10 @@
 max_reflections = None
   .type = int
   .help = "Limit the number of reflections in the output."
+show_shoeboxes = True
+  .type = bool
+  .help = "Whether to read and summarise the reflection shoeboxes. Large"
+          "reflection files are read more quickly without them."
 """,
     process_includes=True,
 )
@@ -193,16 +197,23 @@ def run(args=None):
 
     usage = "dials.show [options] models.expt | image_*.cbf"
 
-    parser = OptionParser(
-        usage=usage,
-        phil=phil_scope,
-        read_experiments=True,
-        read_experiments_from_images=True,
-        read_reflections=True,
-        check_format=False,
-        epilog=help_message,
-    )
+    def option_parser(read_shoeboxes):
+        return OptionParser(
+            usage=usage,
+            phil=phil_scope,
+            read_experiments=True,
+            read_experiments_from_images=True,
+            read_reflections=True,
+            check_format=False,
+            epilog=help_message,
+            read_shoeboxes=read_shoeboxes,
+        )
 
+    # Only read the shoeboxes if they are to be shown
+    parser = option_parser(read_shoeboxes=False)
+    params, _ = parser.parse_args(args=args, quick_parse=True)
+    if params.show_shoeboxes:
+        parser = option_parser(read_shoeboxes=True)
     params, options = parser.parse_args(args=args, show_diff_phil=True)
     reflections, experiments = reflections_and_experiments_from_files(
         params.input.reflections, params.input.experiments
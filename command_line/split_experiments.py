@@ -1,6 +1,8 @@
 from __future__ import absolute_import, division, print_function
 
 import functools
+import multiprocessing
+import time
 
 from dxtbx.model.experiment_list import ExperimentList
 from libtbx.phil import parse
@@ -26,6 +28,150 @@
 """
 
 
+def _remove_identifiers_and_partition(reflections):
+    """Remove the experiment identifiers map from the reflections and return it
+    as a dict, with the experiment partition of the reflections."""
+    identifiers = dict(reflections.experiment_identifiers())
+    for k in identifiers:
+        del reflections.experiment_identifiers()[k]
+    return identifiers, reflections.experiment_partition()
+
+
+# The experiments, reflections and output filename templates shared by the
+# processes writing one file per experiment, set by _init_experiment_writer
+_experiment_writer_data = None
+
+
+def _init_experiment_writer(
+    experiments, reflections, identifiers, partition, expt_template, refl_template
+):
+    global _experiment_writer_data
+    _experiment_writer_data = (
+        experiments,
+        reflections,
+        identifiers,
+        partition,
+        expt_template,
+        refl_template,
+    )
+
+
+def _write_experiment(i):
+    """Write experiment i, and its reflections, to their own files."""
+    (
+        experiments,
+        reflections,
+        identifiers,
+        partition,
+        expt_template,
+        refl_template,
+    ) = _experiment_writer_data
+    ExperimentList([experiments[i]]).as_json(expt_template(index=i))
+    if reflections is not None:
+        ref_sel = reflections.select(partition.indices(i))
+        ref_sel["id"] = flex.int(len(ref_sel), 0)
+        if i in identifiers:
+            ref_sel.experiment_identifiers()[0] = identifiers[i]
+        ref_sel.as_file(refl_template(index=i))
+    return i
+
+
+def write_experiments(
+    experiments, reflections, experiments_template, reflections_template, nproc=1
+):
+    """
+    Write each experiment, and its reflections, to its own files.
+
+    The reflections are partitioned by experiment once, and with nproc > 1 the
+    files are written by a pool of processes, each taking a chunk of
+    experiments at a time, so that only one experiment's reflections per
+    process are held in memory at once.
+
+    Args:
+        experiments: The experiments to split.
+        reflections: The reflections for all the experiments, or None.
+        experiments_template: A function of the index giving the filename of
+            the experiments file for each experiment.
+        reflections_template: As experiments_template for the reflections.
+        nproc: The number of processes to write the files.
+    """
+    if reflections is not None:
+        identifiers, partition = _remove_identifiers_and_partition(reflections)
+    else:
+        identifiers, partition = {}, None
+    initargs = (
+        experiments,
+        reflections,
+        identifiers,
+        partition,
+        experiments_template,
+        reflections_template,
+    )
+    n = len(experiments)
+    st = time.time()
+    pool = None
+    if nproc > 1 and n > 1:
+        pool = multiprocessing.Pool(
+            processes=min(nproc, n),
+            initializer=_init_experiment_writer,
+            initargs=initargs,
+        )
+        chunksize = max(1, min(100, n // (4 * nproc)))
+        results = pool.imap_unordered(_write_experiment, range(n), chunksize)
+    else:
+        _init_experiment_writer(*initargs)
+        results = (_write_experiment(i) for i in range(n))
+    try:
+        for n_done, i in enumerate(results, 1):
+            print("Saved experiment %d to %s" % (i, experiments_template(index=i)))
+            if reflections is not None:
+                print(
+                    "Saved reflections for experiment %d to %s"
+                    % (i, reflections_template(index=i))
+                )
+            if n_done % max(1, n // 10) == 0 or n_done == n:
+                elapsed = time.time() - st
+                print(
+                    "Written %d of %d experiments in %.1fs (%.1f experiments/s)"
+                    % (n_done, n, elapsed, n_done / elapsed if elapsed else 0)
+                )
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _init_experiment_writer(None, None, None, None, None, None)
+
+
+def reflections_by_experiment(reflections, experiments):
+    """
+    Split the reflections into a table for each experiment, in a single pass.
+
+    The experiment identifiers map is removed from the input reflections, so
+    that the per-experiment selections don't each copy the whole map.
+
+    Args:
+        reflections: The reflection table for all the experiments.
+        experiments: The experiments, in the order to split the reflections.
+
+    Yields:
+        A tuple (reflections, identifier) for each experiment. The reflections
+        have no experiment identifiers map, and identifier is None if the
+        input reflections had no identifiers.
+    """
+    identifiers, partition = _remove_identifiers_and_partition(reflections)
+    id_for_identifier = {v: k for k, v in identifiers.items()}
+    for i, experiment in enumerate(experiments):
+        if identifiers:
+            id_ = id_for_identifier.get(experiment.identifier)
+            if id_ is None:
+                raise Sorry(
+                    "Unable to find id matching experiment identifier in reflection table."
+                )
+        else:
+            id_ = i
+        yield reflections.select(partition.indices(id_)), identifiers.get(id_)
+
+
 class Script(object):
     def __init__(self):
         """Initialise the script."""
@@ -44,6 +190,10 @@ def __init__(self):
         .type = bool
         .help = "If True, group experiments by wavelength, from low to high"
                 "(using a relative tolerance of 1e-4 to match wavelengths)."
+      nproc = 1
+        .type = int(value_min=1)
+        .help = "The number of processes to use to write the output files"
+                "when writing one pair of files per experiment."
       output {
         experiments_prefix = split
           .type = str
@@ -200,6 +350,8 @@ def run(self, args=None):
                     for detector in experiments.detectors()
                 }
 
+            if reflections is not None:
+                split_reflections = reflections_by_experiment(reflections, experiments)
             for i, experiment in enumerate(experiments):
                 split_expt_id = experiments.detectors().index(experiment.detector)
                 experiment_filename = experiments_template(index=split_expt_id)
@@ -211,31 +363,11 @@ def run(self, args=None):
                         "Adding reflections for experiment %d to %s"
                         % (i, reflections_filename)
                     )
-                    if reflections.experiment_identifiers().keys():
-                        # first find which id value corresponds to experiment in question
-                        identifier = experiment.identifier
-                        id_ = None
-                        for k in reflections.experiment_identifiers().keys():
-                            if reflections.experiment_identifiers()[k] == identifier:
-                                id_ = k
-                                break
-                        if id_ is None:
-                            raise Sorry(
-                                "Unable to find id matching experiment identifier in reflection table."
-                            )
-                        ref_sel = reflections.select(reflections["id"] == id_)
-                        # now reset ids and reset/update identifiers map
-                        for k in ref_sel.experiment_identifiers().keys():
-                            del ref_sel.experiment_identifiers()[k]
-                        new_id = len(split_data[experiment.detector]["experiments"]) - 1
-                        ref_sel["id"] = flex.int(len(ref_sel), new_id)
+                    ref_sel, identifier = next(split_reflections)
+                    new_id = len(split_data[experiment.detector]["experiments"]) - 1
+                    ref_sel["id"] = flex.int(len(ref_sel), new_id)
+                    if identifier is not None:
                         ref_sel.experiment_identifiers()[new_id] = identifier
-                    else:
-                        ref_sel = reflections.select(reflections["id"] == i)
-                        ref_sel["id"] = flex.int(
-                            len(ref_sel),
-                            len(split_data[experiment.detector]["experiments"]) - 1,
-                        )
                     split_data[experiment.detector]["reflections"].extend(ref_sel)
 
             for i, detector in enumerate(experiments.detectors()):
@@ -270,31 +402,16 @@ def save_chunk(chunk_id, expts, refls):
                 chunk_refls = flex.reflection_table()
             else:
                 chunk_refls = None
+            if reflections:
+                split_reflections = reflections_by_experiment(reflections, experiments)
             for i, experiment in enumerate(experiments):
                 chunk_expts.append(experiment)
                 if reflections:
-                    if reflections.experiment_identifiers().keys():
-                        # first find which id value corresponds to experiment in question
-                        identifier = experiment.identifier
-                        id_ = None
-                        for k in reflections.experiment_identifiers().keys():
-                            if reflections.experiment_identifiers()[k] == identifier:
-                                id_ = k
-                                break
-                        if id_ is None:
-                            raise Sorry(
-                                "Unable to find id matching experiment identifier in reflection table."
-                            )
-                        ref_sel = reflections.select(reflections["id"] == id_)
-                        # now reset ids and reset/update identifiers map
-                        for k in ref_sel.experiment_identifiers().keys():
-                            del ref_sel.experiment_identifiers()[k]
-                        new_id = len(chunk_expts) - 1
-                        ref_sel["id"] = flex.int(len(ref_sel), new_id)
+                    ref_sel, identifier = next(split_reflections)
+                    new_id = len(chunk_expts) - 1
+                    ref_sel["id"] = flex.int(len(ref_sel), new_id)
+                    if identifier is not None:
                         ref_sel.experiment_identifiers()[new_id] = identifier
-                    else:
-                        ref_sel = reflections.select(reflections["id"] == i)
-                        ref_sel["id"] = flex.int(len(ref_sel), len(chunk_expts) - 1)
                     chunk_refls.extend(ref_sel)
                 if params.output.chunk_sizes:
                     chunk_limit = params.output.chunk_sizes[chunk_counter]
@@ -311,28 +428,13 @@ def save_chunk(chunk_id, expts, refls):
             if len(chunk_expts) > 0:
                 save_chunk(chunk_counter, chunk_expts, chunk_refls)
         else:
-            for i, experiment in enumerate(experiments):
-
-                experiment_filename = experiments_template(index=i)
-                print("Saving experiment %d to %s" % (i, experiment_filename))
-                ExperimentList([experiment]).as_json(experiment_filename)
-
-                if reflections is not None:
-                    reflections_filename = reflections_template(index=i)
-                    print(
-                        "Saving reflections for experiment %d to %s"
-                        % (i, reflections_filename)
-                    )
-                    ref_sel = reflections.select(reflections["id"] == i)
-                    if ref_sel.experiment_identifiers().keys():
-                        identifier = ref_sel.experiment_identifiers()[i]
-                        for k in ref_sel.experiment_identifiers().keys():
-                            del ref_sel.experiment_identifiers()[k]
-                        ref_sel["id"] = flex.int(ref_sel.size(), 0)
-                        ref_sel.experiment_identifiers()[0] = identifier
-                    else:
-                        ref_sel["id"] = flex.int(len(ref_sel), 0)
-                    ref_sel.as_file(reflections_filename)
+            write_experiments(
+                experiments,
+                reflections,
+                experiments_template,
+                reflections_template,
+                nproc=params.nproc,
+            )
 
         return
 
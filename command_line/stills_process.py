@@ -3,6 +3,7 @@
 import copy
 import glob
 import logging
+import multiprocessing
 import os
 import sys
 import tarfile
@@ -12,6 +13,7 @@
 import six
 import six.moves.cPickle as pickle
 from six import BytesIO
+from six.moves import queue
 
 from dxtbx.model.experiment_list import (
     Experiment,
@@ -23,6 +25,7 @@
 
 import dials.util
 from dials.array_family import flex
+from dials.array_family.columnar import ColumnarFileWriter
 from dials.util import log
 
 logger = logging.getLogger("dials.command_line.stills_process")
@@ -122,6 +125,22 @@
               concatenated list of all the successful events examined by that process. \
               If False, output a separate experiment/reflection file per image (generates a \
               lot of files).
+    composite_flush_interval = None
+      .type = int(value_min=1)
+      .help = If composite_output is True, write the composite output accumulated by each \
+              process to a new chunk of files on disk every this many images, rather than \
+              holding it all in memory until the end of processing. The chunks are \
+              concatenated into the composite files when processing finishes, and \
+              removed once the composite files are written. With mp.composite_stride, \
+              only the chunk filenames are sent between ranks.
+    composite_columnar = True
+      .type = bool
+      .help = If composite_flush_interval is set, write the composite reflections in \
+              the columnar format, one chunk at a time, so that the peak memory of the \
+              merge is that of the composite experiments plus the largest chunk of \
+              reflections. The columnar format is read by dials.array_family, but not \
+              by other msgpack readers. If False, the chunks are merged in memory \
+              and written in the usual format.
     logging_dir = None
       .type = str
       .help = Directory output log files will be placed
@@ -164,6 +183,11 @@
     nproc = 1
       .type = int(value_min=1)
       .help = "The number of processes to use."
+    batch_size = 1
+      .type = int(value_min=1)
+      .help = For multiprocessing, the number of images handed to a worker   \
+              process at a time. Images are handed out on demand, so that   \
+              slow images do not leave the other processes idle.
     composite_stride = None
       .type = int
       .help = For MPI, if using composite mode, specify how many ranks to    \
@@ -367,8 +391,6 @@ def load_reference_geometry(self):
 
     def run(self, args=None):
         """Execute the script."""
-        from libtbx import easy_mp
-
         try:
             from mpi4py import MPI
         except ImportError:
@@ -723,27 +745,30 @@ def process_this_event(nevent):
                     if processor:
                         processor.finalize()
         else:
-            from dxtbx.command_line.image_average import splitit
+            if process_fractions:
+                iterable = [
+                    item
+                    for item_num, item in enumerate(iterable)
+                    if process_this_event(item_num)
+                ]
 
             if params.mp.nproc == 1:
-                do_work(0, iterable)
+                processor = Processor(
+                    copy.deepcopy(params), composite_tag="%04d" % 0, rank=0
+                )
+                do_work(0, iterable, processor)
+                stage_timings = processor.stage_timings
             else:
-                result = list(
-                    easy_mp.multi_core_run(
-                        myfunction=do_work,
-                        argstuples=list(enumerate(splitit(iterable, params.mp.nproc))),
-                        nproc=params.mp.nproc,
-                    )
+                stage_timings, error_list = self.process_with_work_queue(
+                    do_work, iterable
                 )
-                error_list = [r[2] for r in result]
-                if error_list.count(None) != len(error_list):
+                if error_list:
                     print(
                         "Some processes failed excecution. Not all images may have processed. Error messages:"
                     )
                     for error in error_list:
-                        if error is None:
-                            continue
                         print(error)
+            log_stage_timings(stage_timings)
 
         # Total Time
         logger.info("")
@@ -757,11 +782,260 @@ def process_this_event(nevent):
                 )
             )
 
+    def process_with_work_queue(self, do_work, iterable):
+        """
+        Process the items with long-lived worker processes that take batches of
+        items from a shared queue as they become free, so that slow images do not
+        hold up the processing of the rest. Each worker has its own Processor,
+        which is finalized once the queue is exhausted.
+
+        The workers are forked, so that they inherit do_work and its data. Where
+        fork is not available (e.g. on Windows), the items are instead split
+        into one fixed chunk per process.
+
+        :param do_work: The function to process a list of items with a processor
+        :param iterable: The list of items
+        :returns: The per-image stage timings, and a list of error messages
+        """
+        nproc = self.params.mp.nproc
+        if "fork" not in multiprocessing.get_all_start_methods():
+            return self.process_in_chunks(do_work, iterable)
+
+        batch_size = self.params.mp.batch_size
+        context = multiprocessing.get_context("fork")
+        tasks = context.Queue()
+        results = context.Queue()
+        for start in range(0, len(iterable), batch_size):
+            tasks.put(iterable[start : start + batch_size])
+        for _ in range(nproc):
+            tasks.put(None)
+
+        processes = [
+            context.Process(
+                target=_work_queue_worker,
+                args=(do_work, self.params, i, tasks, results),
+            )
+            for i in range(nproc)
+        ]
+        for process in processes:
+            process.start()
+
+        stage_timings = []
+        error_list = []
+        finished = set()
+        while len(finished) < nproc:
+            try:
+                index, timings, error = results.get(timeout=1)
+            except queue.Empty:
+                # Check for workers that died without reporting back. A worker
+                # that exited cleanly has already put its final result, which
+                # is still to be read from the queue.
+                for index, process in enumerate(processes):
+                    if index not in finished and process.exitcode:
+                        finished.add(index)
+                        error_list.append(
+                            "Process %d exited with code %d" % (index, process.exitcode)
+                        )
+                continue
+            if timings is not None:
+                stage_timings.extend(timings)
+                continue
+            if index in finished:
+                continue
+            finished.add(index)
+            if error is not None:
+                error_list.append(error)
+        for process in processes:
+            process.join()
+        return stage_timings, error_list
+
+    def process_in_chunks(self, do_work, iterable):
+        """
+        Process the items split into one chunk per process.
+
+        :param do_work: The function to process a list of items
+        :param iterable: The list of items
+        :returns: The per-image stage timings, and a list of error messages
+        """
+        from dxtbx.command_line.image_average import splitit
+        from libtbx import easy_mp
+
+        nproc = self.params.mp.nproc
+        result = list(
+            easy_mp.multi_core_run(
+                myfunction=do_work,
+                argstuples=list(enumerate(splitit(iterable, nproc))),
+                nproc=nproc,
+            )
+        )
+        stage_timings = []
+        for _, processor, _ in result:
+            if processor is not None:
+                stage_timings.extend(processor.stage_timings)
+        error_list = [r[2] for r in result if r[2] is not None]
+        return stage_timings, error_list
+
+
+def _work_queue_worker(do_work, params, i, tasks, results):
+    """
+    Process batches of items from the tasks queue with a Processor, until a
+    None is received, then finalize the Processor. The stage timings for each
+    batch, and finally any error message, are put on the results queue.
+
+    :param do_work: The function to process a list of items with a processor
+    :param params: The processing parameters
+    :param i: The index of the worker
+    :param tasks: The queue of batches of items
+    :param results: The queue of (i, stage timings, error message) results
+    """
+    error = None
+    try:
+        processor = Processor(copy.deepcopy(params), composite_tag="%04d" % i, rank=i)
+        for batch in iter(tasks.get, None):
+            n = len(processor.stage_timings)
+            do_work(i, batch, processor, finalize=False)
+            results.put((i, processor.stage_timings[n:], None))
+        processor.finalize()
+    except Exception as e:
+        error = "Process %d: %s" % (i, e)
+    results.put((i, None, error))
+
+
+def log_stage_timings(stage_timings):
+    """
+    Log the time taken in each processing stage for each image, and a summary
+    of the time spent in each stage.
+
+    :param stage_timings: A list of (tag, {stage: time}) tuples
+    """
+    totals = OrderedDict()
+    for tag, timings in stage_timings:
+        if not timings:
+            continue
+        logger.info(
+            "Timing for %s: %s",
+            tag,
+            ", ".join("%s %.2fs" % (stage, t) for stage, t in timings.items()),
+        )
+        for stage, t in timings.items():
+            totals.setdefault(stage, []).append(t)
+    rows = [
+        (stage, len(t), "%.2f" % sum(t), "%.2f" % (sum(t) / len(t)), "%.2f" % max(t))
+        for stage, t in totals.items()
+    ]
+    if not rows:
+        return
+    logger.info(
+        "\nTime spent in each processing stage:\n%s",
+        dials.util.tabulate(
+            rows, headers=("Stage", "Images", "Total (s)", "Mean (s)", "Max (s)")
+        ),
+    )
+
+
+def offset_experiment_ids(reflections, n):
+    """
+    Offset the experiment ids of reflections, and the keys of their experiment
+    identifiers, by n
+    """
+    if "id" in reflections:
+        reflections["id"] += n
+    idents = reflections.experiment_identifiers()
+    keys = idents.keys()
+    values = idents.values()
+    for key in keys:
+        del idents[key]
+    for i, key in enumerate(keys):
+        idents[key + n] = values[i]
+
+
+def extend_with_bookkeeping(src_expts, src_refls, dest_expts, dest_refls):
+    """
+    Extend composite experiments and reflections, offsetting the experiment ids
+    of the source reflections past those already in the destination
+    """
+    offset_experiment_ids(src_refls, len(dest_refls.experiment_identifiers()))
+    dest_expts.extend(src_expts)
+    dest_refls.extend(src_refls)
+
+
+def chunk_filename(filename, n):
+    """The filename of chunk n of a composite output file"""
+    root, ext = os.path.splitext(filename)
+    return "%s.part%04d%s" % (root, n, ext)
+
+
+def merge_composite_chunks(
+    chunks, experiments_filename, reflections_filename, columnar=True
+):
+    """
+    Concatenate chunks of composite output into single experiment and reflection
+    files, and remove the chunks once the composite files have been written.
+
+    With columnar=True, the reflections are written one chunk at a time, in the
+    columnar format, so the peak memory is that of all the composite
+    experiments (which hold only the models) plus the reflections of the
+    largest chunk. Otherwise the reflections of all the chunks are held in
+    memory and written with reflection_table.as_file(). In either case, chunks
+    with different columns are merged as by reflection_table.extend().
+
+    :param chunks: A list of (experiments, reflections) chunk filenames, either
+                   of which may be None if that chunk has no data
+    :param experiments_filename: The output experiments filename
+    :param reflections_filename: The output reflections filename
+    :param columnar: Write the reflections in the columnar format
+    """
+    experiments = ExperimentList()
+    reflections = flex.reflection_table()
+    writer = None
+    n_identifiers = 0
+    try:
+        for expts_chunk, refls_chunk in chunks:
+            if expts_chunk is not None:
+                experiments.extend(
+                    ExperimentListFactory.from_json_file(
+                        expts_chunk, check_format=False
+                    )
+                )
+            if refls_chunk is None or not reflections_filename:
+                continue
+            chunk_refls = flex.reflection_table.from_file(refls_chunk)
+            offset_experiment_ids(chunk_refls, n_identifiers)
+            n_identifiers += len(chunk_refls.experiment_identifiers())
+            if not columnar:
+                reflections.extend(chunk_refls)
+                continue
+            if writer is None:
+                writer = ColumnarFileWriter(reflections_filename)
+            writer.write(chunk_refls)
+            del chunk_refls
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if len(experiments) > 0 and experiments_filename:
+        experiments.as_json(experiments_filename)
+    if writer is not None:
+        logger.info("Saved %d reflections to %s" % (writer.nrows, reflections_filename))
+    elif len(reflections) > 0:
+        logger.info(
+            "Saving %d reflections to %s" % (len(reflections), reflections_filename)
+        )
+        reflections.as_file(reflections_filename)
+
+    # Only remove the chunks once the composite files have been written
+    for chunk in chunks:
+        for filename in chunk:
+            if filename is not None:
+                os.remove(filename)
+
 
 class Processor(object):
     def __init__(self, params, composite_tag=None, rank=0):
         self.params = params
         self.composite_tag = composite_tag
+        # The time taken in each processing stage, for each image processed
+        self.stage_timings = []
 
         # The convention is to put %s in the phil parameter to add a tag to
         # each output datafile. Save the initial templates here.
@@ -808,6 +1082,12 @@ def __init__(self, params, composite_tag=None, rank=0):
             self.all_coset_experiments = ExperimentList()
             self.all_coset_reflections = flex.reflection_table()
 
+            # The chunks of composite output written to disk so far, and the
+            # number of images processed since the last chunk was written
+            self.composite_chunks = []
+            self.n_unflushed_images = 0
+            self.int_pickle_tar_mode = "w"
+
             self.setup_filenames(composite_tag)
 
     def setup_filenames(self, tag):
@@ -905,8 +1185,14 @@ def process_experiments(self, tag, experiments):
 
         if not self.params.output.composite_output:
             self.setup_filenames(tag)
+        elif self.params.output.composite_flush_interval is not None:
+            if self.n_unflushed_images >= self.params.output.composite_flush_interval:
+                self.flush_composite_output()
+            self.n_unflushed_images += 1
         self.tag = tag
         self.debug_start(tag)
+        timings = OrderedDict()
+        self.stage_timings.append((tag, timings))
 
         if self.params.output.experiments_filename:
             if self.params.output.composite_output:
@@ -926,7 +1212,9 @@ def process_experiments(self, tag, experiments):
         try:
             if self.params.dispatch.find_spots:
                 self.debug_write("spotfind_start")
+                st = time.time()
                 observed = self.find_spots(experiments)
+                timings["spotfinding"] = time.time() - st
             else:
                 print("Spot Finding turned off. Exiting")
                 self.debug_write("data_loaded", "done")
@@ -960,7 +1248,9 @@ def process_experiments(self, tag, experiments):
                         self.debug_write("too_many_spots_%d" % len(observed), "stop")
                         return
                 self.debug_write("index_start")
+                st = time.time()
                 experiments, indexed = self.index(experiments, observed)
+                timings["indexing"] = time.time() - st
             else:
                 print("Indexing turned off. Exiting")
                 self.debug_write("spotfinding_ok_%d" % len(observed), "done")
@@ -973,7 +1263,9 @@ def process_experiments(self, tag, experiments):
             return
         self.debug_write("refine_start")
         try:
+            st = time.time()
             experiments, indexed = self.refine(experiments, indexed)
+            timings["refinement"] = time.time() - st
         except Exception as e:
             print("Error refining", tag, str(e))
             self.debug_write("refine_failed_%d" % len(indexed), "fail")
@@ -983,7 +1275,9 @@ def process_experiments(self, tag, experiments):
         try:
             if self.params.dispatch.integrate:
                 self.debug_write("integrate_start")
+                st = time.time()
                 integrated = self.integrate(experiments, indexed)
+                timings["integration"] = time.time() - st
             else:
                 print("Integration turned off. Exiting")
                 self.debug_write("index_ok_%d" % len(indexed), "done")
@@ -1474,9 +1768,153 @@ def save_reflections(self, reflections, filename):
         reflections.as_file(filename)
         logger.info(" time taken: %g" % (time.time() - st))
 
+    def composite_outputs(self):
+        """
+        The composite outputs, as a list of tuples of the names of the attributes
+        accumulating the experiments and reflections, and their filenames
+        """
+        output = self.params.output
+        outputs = [
+            (
+                "all_imported_experiments",
+                "all_strong_reflections",
+                output.experiments_filename,
+                output.strong_filename,
+            ),
+            (
+                "all_indexed_experiments",
+                "all_indexed_reflections",
+                output.refined_experiments_filename,
+                output.indexed_filename,
+            ),
+            (
+                "all_integrated_experiments",
+                "all_integrated_reflections",
+                output.integrated_experiments_filename,
+                output.integrated_filename,
+            ),
+        ]
+        if self.params.dispatch.coset:
+            outputs.append(
+                (
+                    "all_coset_experiments",
+                    "all_coset_reflections",
+                    output.coset_experiments_filename,
+                    output.coset_filename,
+                )
+            )
+        return outputs
+
+    def flush_composite_output(self):
+        """
+        Write the composite output accumulated since the last flush to a new chunk
+        of files, and release it from memory
+        """
+        n_chunk = len(self.composite_chunks)
+        chunk = []
+        for (
+            expts_attr,
+            refls_attr,
+            expts_filename,
+            refls_filename,
+        ) in self.composite_outputs():
+            experiments = getattr(self, expts_attr)
+            reflections = getattr(self, refls_attr)
+            expts_chunk = refls_chunk = None
+            if len(experiments) > 0 and expts_filename:
+                expts_chunk = chunk_filename(expts_filename, n_chunk)
+                experiments.as_json(expts_chunk)
+            if len(reflections) > 0 and refls_filename:
+                refls_chunk = chunk_filename(refls_filename, n_chunk)
+                self.save_reflections(reflections, refls_chunk)
+            chunk.append((expts_chunk, refls_chunk))
+            setattr(self, expts_attr, ExperimentList())
+            setattr(self, refls_attr, flex.reflection_table())
+        self.composite_chunks.append(chunk)
+
+        if self.all_int_pickles and self.params.output.integration_pickle:
+            # Append the pickles to the archive after the first write
+            self.write_int_pickle_tar(mode=self.int_pickle_tar_mode)
+            self.int_pickle_tar_mode = "a"
+        self.all_int_pickles = []
+        self.all_int_pickle_filenames = []
+        self.n_unflushed_images = 0
+
+    def finalize_composite_chunks(self):
+        """
+        Write the remaining composite output, and concatenate the chunks of
+        composite output into the composite files
+        """
+        self.flush_composite_output()
+        chunks = self.composite_chunks
+        if self.params.mp.composite_stride is not None:
+            assert self.params.mp.method == "mpi"
+            stride = self.params.mp.composite_stride
+
+            from mpi4py import MPI
+
+            comm = MPI.COMM_WORLD
+            rank = comm.Get_rank()  # each process in MPI has a unique id, 0-indexed
+            size = comm.Get_size()  # size: number of processes running in this job
+            comm.barrier()
+
+            if rank % stride == 0:
+                subranks = [rank + i for i in range(1, stride) if rank + i < size]
+                for i in range(len(subranks)):
+                    logger.info("Rank %d waiting for sender" % rank)
+                    sender, sender_chunks = comm.recv(source=MPI.ANY_SOURCE)
+                    logger.info("Rank %d recieved data from rank %d" % (rank, sender))
+                    chunks.extend(sender_chunks)
+            else:
+                destrank = (rank // stride) * stride
+                logger.info("Rank %d sending results to rank %d" % (rank, destrank))
+                comm.send((rank, chunks), dest=destrank)
+                return
+
+        for i, (_, _, expts_filename, refls_filename) in enumerate(
+            self.composite_outputs()
+        ):
+            merge_composite_chunks(
+                [chunk[i] for chunk in chunks],
+                expts_filename,
+                refls_filename,
+                columnar=self.params.output.composite_columnar,
+            )
+
+    def write_int_pickle_tar(self, mode="w"):
+        """Write the integration pickles to a tar archive"""
+        tar_template_integration_pickle = self.params.output.integration_pickle.replace(
+            "%d", "%s"
+        )
+        outfile = (
+            os.path.join(
+                self.params.output.output_dir,
+                tar_template_integration_pickle % ("x", self.composite_tag),
+            )
+            + ".tar"
+        )
+        tar = tarfile.TarFile(outfile, mode)
+        for i, (fname, d) in enumerate(
+            zip(self.all_int_pickle_filenames, self.all_int_pickles)
+        ):
+            string = BytesIO(pickle.dumps(d, protocol=2))
+            info = tarfile.TarInfo(name=fname)
+            if six.PY3:
+                info.size = string.getbuffer().nbytes
+            else:
+                info.size = len(string.buf)
+            info.mtime = time.time()
+            tar.addfile(tarinfo=info, fileobj=string)
+        tar.close()
+
     def finalize(self):
         """Perform any final operations"""
-        if self.params.output.composite_output:
+        if (
+            self.params.output.composite_output
+            and self.params.output.composite_flush_interval is not None
+        ):
+            self.finalize_composite_chunks()
+        elif self.params.output.composite_output:
             if self.params.mp.composite_stride is not None:
                 assert self.params.mp.method == "mpi"
                 stride = self.params.mp.composite_stride
@@ -1509,21 +1947,6 @@ def finalize(self):
                             "Rank %d recieved data from rank %d" % (rank, sender)
                         )
 
-                        def extend_with_bookkeeping(
-                            src_expts, src_refls, dest_expts, dest_refls
-                        ):
-                            n = len(dest_refls.experiment_identifiers())
-                            src_refls["id"] += n
-                            idents = src_refls.experiment_identifiers()
-                            keys = idents.keys()
-                            values = idents.values()
-                            for key in keys:
-                                del idents[key]
-                            for i, key in enumerate(keys):
-                                idents[key + n] = values[i]
-                            dest_expts.extend(src_expts)
-                            dest_refls.extend(src_refls)
-
                         if len(imported_experiments) > 0:
                             extend_with_bookkeeping(
                                 imported_experiments,
@@ -1671,29 +2094,7 @@ def extend_with_bookkeeping(
 
             # Create a tar archive of the integration dictionary pickles
             if len(self.all_int_pickles) > 0 and self.params.output.integration_pickle:
-                tar_template_integration_pickle = (
-                    self.params.output.integration_pickle.replace("%d", "%s")
-                )
-                outfile = (
-                    os.path.join(
-                        self.params.output.output_dir,
-                        tar_template_integration_pickle % ("x", self.composite_tag),
-                    )
-                    + ".tar"
-                )
-                tar = tarfile.TarFile(outfile, "w")
-                for i, (fname, d) in enumerate(
-                    zip(self.all_int_pickle_filenames, self.all_int_pickles)
-                ):
-                    string = BytesIO(pickle.dumps(d, protocol=2))
-                    info = tarfile.TarInfo(name=fname)
-                    if six.PY3:
-                        info.size = string.getbuffer().nbytes
-                    else:
-                        info.size = len(string.buf)
-                    info.mtime = time.time()
-                    tar.addfile(tarinfo=info, fileobj=string)
-                tar.close()
+                self.write_int_pickle_tar()
 
 
 @dials.util.show_mail_handle_errors()
@@ -0,0 +1,111 @@
+"""Histogramming of reflection properties for the report analysers.
+
+Each function computes the bin index of every value once and then counts (or
+sums weights) with a single numpy.bincount pass, rather than building a
+selection over the whole array for every bin.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+def _as_numpy_array(values):
+    if hasattr(values, "as_numpy_array"):
+        return values.as_numpy_array()
+    return np.asarray(values)
+
+
+def uniform_bin_indices(values, n_bins):
+    """Assign values to n_bins equal width bins spanning their range.
+
+    The bins and edges are the same as those of numpy.histogram(values, n_bins),
+    so the largest value falls in the last bin.
+
+    Returns:
+        A tuple (indices, edges) of the bin index for each value and the
+        n_bins + 1 bin edges.
+    """
+    values = _as_numpy_array(values).astype(np.float64)
+    if values.size:
+        lower, upper = values.min(), values.max()
+    else:
+        lower, upper = 0.0, 1.0
+    if lower == upper:
+        lower -= 0.5
+        upper += 0.5
+    edges = np.linspace(lower, upper, n_bins + 1)
+    indices = ((values - lower) * (n_bins / (upper - lower))).astype(np.intp)
+    indices[indices == n_bins] = n_bins - 1
+    # Correct for rounding so that the indices agree with the edges
+    indices[values < edges[indices]] -= 1
+    indices[(values >= edges[indices + 1]) & (indices != n_bins - 1)] += 1
+    return indices, edges
+
+
+def histogram2d(x, y, bins, weights=()):
+    """Histogram points into a regular 2D grid, with optional weighted sums.
+
+    The counts and edges are the same as those of numpy.histogram2d(x, y, bins),
+    and each array of weights is summed over the same bins without recomputing
+    the bin of each point.
+
+    Args:
+        x: The x coordinates of the points.
+        y: The y coordinates of the points.
+        bins: A tuple (nbinsx, nbinsy) of the number of bins in each direction.
+        weights: A sequence of arrays of per-point weights to sum in each bin.
+
+    Returns:
+        A tuple (counts, sums, xedges, yedges), where counts and each entry of
+        the list sums are arrays of shape (nbinsx, nbinsy).
+    """
+    nbinsx, nbinsy = bins
+    ix, xedges = uniform_bin_indices(x, nbinsx)
+    iy, yedges = uniform_bin_indices(y, nbinsy)
+    flat = ix * nbinsy + iy
+    size = nbinsx * nbinsy
+    counts = np.bincount(flat, minlength=size).reshape(nbinsx, nbinsy)
+    sums = [
+        np.bincount(flat, weights=_as_numpy_array(w), minlength=size).reshape(
+            nbinsx, nbinsy
+        )
+        for w in weights
+    ]
+    return counts.astype(np.float64), sums, xedges, yedges
+
+
+def unit_bin_sums(values, n_bins, start=0, groups=None, n_groups=1, weights=()):
+    """Count values in the unit width bins [start + i, start + i + 1).
+
+    This is the binning used for counts per image (or per degree), for one
+    or more groups of values, e.g. per imageset or per lattice. Values outside
+    the n_bins bins, and values with a group outside [0, n_groups), are ignored.
+
+    Args:
+        values: The values to bin, e.g. the z centroids in images.
+        n_bins: The number of unit width bins.
+        start: The lower edge of the first bin.
+        groups: An optional array of the group of each value.
+        n_groups: The number of groups.
+        weights: A sequence of arrays of per-value weights to sum in each bin.
+
+    Returns:
+        A tuple (counts, sums) where counts and each entry of the list sums are
+        arrays of shape (n_groups, n_bins).
+    """
+    indices = np.floor(_as_numpy_array(values)).astype(np.int64) - int(start)
+    valid = (indices >= 0) & (indices < n_bins)
+    if groups is not None:
+        groups = _as_numpy_array(groups).astype(np.int64)
+        valid &= (groups >= 0) & (groups < n_groups)
+        indices = indices + groups * n_bins
+    flat = indices[valid]
+    size = n_groups * n_bins
+    counts = np.bincount(flat, minlength=size).reshape(n_groups, n_bins)
+    sums = [
+        np.bincount(flat, weights=_as_numpy_array(w)[valid], minlength=size).reshape(
+            n_groups, n_bins
+        )
+        for w in weights
+    ]
+    return counts, sums
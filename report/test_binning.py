@@ -0,0 +1,51 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+
+from dials.array_family import flex
+from dials.report.binning import histogram2d, uniform_bin_indices, unit_bin_sums
+
+
+def test_uniform_bin_indices():
+    values = np.array([0.0, 0.1, 0.5, 0.99, 1.0])
+    indices, edges = uniform_bin_indices(values, 10)
+    assert list(indices) == [0, 1, 5, 9, 9]
+    assert edges == pytest.approx(np.linspace(0, 1, 11))
+
+    # All values the same
+    indices, edges = uniform_bin_indices(np.full(3, 2.0), 2)
+    assert list(indices) == [1, 1, 1]
+    assert edges == pytest.approx([1.5, 2.0, 2.5])
+
+
+def test_histogram2d():
+    rs = np.random.RandomState(42)
+    x = rs.uniform(0, 100, size=1000)
+    y = rs.normal(50, 10, size=1000)
+    w = rs.uniform(size=1000)
+
+    H, (H1,), xedges, yedges = histogram2d(
+        flex.double(x), flex.double(y), bins=(7, 11), weights=(flex.double(w),)
+    )
+    H_np, xedges_np, yedges_np = np.histogram2d(x, y, bins=(7, 11))
+    H1_np, _, _ = np.histogram2d(x, y, bins=(7, 11), weights=w)
+    assert H.shape == (7, 11)
+    assert (H == H_np).all()
+    assert H1 == pytest.approx(H1_np)
+    assert xedges == pytest.approx(xedges_np)
+    assert yedges == pytest.approx(yedges_np)
+
+
+def test_unit_bin_sums():
+    z = flex.double([0.0, 0.5, 1.2, 2.9, 3.0, -0.5, 1.5, 2.5])
+    ids = flex.int([0, 0, 0, 0, 0, 0, 1, -1])
+    counts, (sums,) = unit_bin_sums(
+        z, 3, groups=ids, n_groups=2, weights=(flex.double(8, 1.5),)
+    )
+    # z = 3.0 and z = -0.5 fall outside the bins, and id = -1 is ignored
+    assert counts.tolist() == [[2, 1, 1], [0, 1, 0]]
+    assert sums.tolist() == [[3.0, 1.5, 1.5], [0.0, 1.5, 0.0]]
+
+    counts, _ = unit_bin_sums(flex.double([10.2, 10.7, 12.1]), 3, start=10)
+    assert counts.tolist() == [[2, 0, 1]]
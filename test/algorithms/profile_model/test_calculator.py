@@ -1,4 +1,11 @@
+import math
+import random
+
+import pytest
+
 from dials.algorithms.profile_model.gaussian_rs.calculator import (
+    _convolve,
+    _gaussian_kernel,
     _select_reflections_for_sigma_calc,
 )
 from dials.array_family import flex
@@ -38,3 +45,22 @@ def test_select_reflections_for_sigma_calc():
     )
     assert reflections.size() > 700
     assert reflections.size() < 1000
+
+
+@pytest.mark.parametrize("n", [10, 51, 200])
+def test_convolve_gaussian_kernel(n):
+    """Compare the smoothing of scan varying parameters with a direct sum."""
+    kernel = _gaussian_kernel(51)
+    assert kernel.sum() == pytest.approx(1)
+    assert kernel[25] == kernel.max()
+    assert math.exp(-4.5) == pytest.approx(kernel[0] / kernel[25])
+
+    data = [random.random() for i in range(n)]
+    expected = []
+    for i in range(n):
+        r = 0
+        for j, k in enumerate(kernel):
+            # The data are extended at each end with the first and last values
+            r += k * data[min(max(i - 25 + j, 0), n - 1)]
+        expected.append(r)
+    assert list(_convolve(data, kernel)) == pytest.approx(expected)
@@ -10,17 +10,18 @@
 
 
 @pytest.mark.parametrize(
-    "method,colnames,expected_nout",
+    "method,colnames,expected_nout,nproc",
     [
-        ("tukey", ("x_resid", "y_resid", "phi_resid"), 34),
-        pytest.param("mcd", ("x_resid", "y_resid", "phi_resid"), 35),
-        pytest.param("mcd", ("x_resid", "y_resid", "phi_resid"), 35),
+        ("tukey", ("x_resid", "y_resid", "phi_resid"), 34, 1),
+        ("tukey", ("x_resid", "y_resid", "phi_resid"), 34, 2),
+        pytest.param("mcd", ("x_resid", "y_resid", "phi_resid"), 35, 1),
+        pytest.param("mcd", ("x_resid", "y_resid", "phi_resid"), 35, 2),
         pytest.param(
-            "sauter_poon", ("miller_index", "xyzobs.px.value", "xyzcal.px"), 34
+            "sauter_poon", ("miller_index", "xyzobs.px.value", "xyzcal.px"), 34, 1
         ),
     ],
 )
-def test_centroid_outlier(dials_regression, method, colnames, expected_nout):
+def test_centroid_outlier(dials_regression, method, colnames, expected_nout, nproc):
 
     flex.set_random_seed(42)
     data_dir = os.path.join(
@@ -31,6 +32,7 @@ def test_centroid_outlier(dials_regression, method, colnames, expected_nout):
     )
     params = phil_scope.extract()
     params.outlier.algorithm = method
+    params.outlier.nproc = nproc
     params.outlier.sauter_poon.px_sz = (0.1, 0.1)  # must be set for SauterPoon
     outlier_detector = CentroidOutlierFactory.from_parameters_and_colnames(
         params, colnames
@@ -0,0 +1,68 @@
+from __future__ import absolute_import, division, print_function
+
+import random
+
+import pytest
+
+from scitbx import sparse
+from scitbx.array_family import flex
+from scitbx.linalg.svd import real as svd_real
+
+from dials.algorithms.refinement.engine import JacobianStatistics, Refinery
+
+
+def test_jacobian_statistics_match_full_jacobian():
+    random.seed(0)
+    nref, nparam, nresid = 40, 5, 3
+
+    # Random Jacobian with residuals of each type in a block of rows, and one
+    # column of zeros
+    jacobian = flex.double(flex.grid(nref * nresid, nparam), 0.0)
+    for i in range(nref * nresid):
+        for j in range(nparam - 1):
+            jacobian[i, j] = random.gauss(0, 1)
+
+    # Accumulate in chunks of reflections, as refinement does with blocks of
+    # matches, using a sparse Jacobian for one of the chunks
+    statistics = JacobianStatistics(nresid, nparam)
+    for start, end in [(0, 15), (15, nref)]:
+        rows = [r * nref + i for r in range(nresid) for i in range(start, end)]
+        chunk = flex.double(flex.grid(len(rows), nparam))
+        for k, row in enumerate(rows):
+            for j in range(nparam):
+                chunk[k, j] = jacobian[row, j]
+        if start == 0:
+            dense_chunk = chunk
+            chunk = sparse.matrix(len(rows), nparam)
+            chunk.assign_block(dense_chunk, 0, 0)
+        other = JacobianStatistics(nresid, nparam)
+        other.add(chunk)
+        statistics.merge(other)
+
+    for r, packed in enumerate(statistics.packed_correlation_matrices()):
+        block = jacobian.matrix_copy_block(r * nref, 0, nref, nparam)
+        expected = Refinery._packed_corr_mat(block)
+        assert list(packed) == pytest.approx(list(expected), abs=1e-10)
+
+    # The condition number is undefined for a Jacobian with a zero column
+    assert statistics.condition_number() == float("inf")
+
+    jacobian = jacobian.matrix_copy_block(0, 0, nref * nresid, nparam - 1)
+    statistics = JacobianStatistics(nresid, nparam - 1)
+    statistics.add(jacobian)
+    svd = svd_real(jacobian.deep_copy(), False, False)
+    expected = max(svd.sigma) / min(svd.sigma)
+    assert statistics.condition_number() == pytest.approx(expected)
+
+    # An ill-conditioned Jacobian, for which the smallest eigenvalue of the Gram
+    # matrix would be lost to rounding, accumulated in two chunks of rows
+    for j, scale in enumerate((1.0, 1e-5, 1e-10, 1.0)):
+        for i in range(nref * nresid):
+            jacobian[i, j] *= scale
+    statistics = JacobianStatistics(nresid, nparam - 1)
+    statistics.add(jacobian.matrix_copy_block(0, 0, nref, nparam - 1))
+    statistics.add(jacobian.matrix_copy_block(nref, 0, nref * (nresid - 1), nparam - 1))
+    svd = svd_real(jacobian.deep_copy(), False, False)
+    expected = max(svd.sigma) / min(svd.sigma)
+    assert expected > 1e9
+    assert statistics.condition_number() == pytest.approx(expected, rel=1e-4)
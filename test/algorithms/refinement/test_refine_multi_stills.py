@@ -3,6 +3,7 @@
 import os
 
 import procrunner
+import pytest
 
 from dxtbx.model.experiment_list import ExperimentListFactory
 from libtbx import phil
@@ -56,8 +57,9 @@ def test1(dials_regression, run_in_tmpdir):
         )
 
 
+@pytest.mark.parametrize("engine", ["LBFGScurvs", "GaussNewton", "LevMar"])
 def test_multi_process_refinement_gives_same_results_as_single_process_refinement(
-    dials_regression, run_in_tmpdir
+    dials_regression, run_in_tmpdir, engine
 ):
     data_dir = os.path.join(dials_regression, "refinement_test_data", "multi_stills")
     cmd = [
@@ -65,7 +67,7 @@ def test_multi_process_refinement_gives_same_results_as_single_process_refinemen
         os.path.join(data_dir, "combined_experiments.json"),
         os.path.join(data_dir, "combined_reflections.pickle"),
         "outlier.algorithm=null",
-        "engine=LBFGScurvs",
+        "engine=%s" % engine,
         "output.reflections=None",
     ]
     result = procrunner.run(cmd + ["output.experiments=refined_nproc4.expt", "nproc=4"])
@@ -1,10 +1,19 @@
 """Tests for ΔCC½ algorithms."""
 
+import random
 from unittest import mock
 
+import pytest
+
+from cctbx import sgtbx, uctbx
 from dxtbx.model import Crystal, Experiment, ExperimentList, Scan
 
 from dials.algorithms.statistics.cc_half_algorithm import CCHalfFromDials
+from dials.algorithms.statistics.delta_cchalf import (
+    PerGroupCChalfStatistics,
+    ReflectionSum,
+    compute_cchalf_from_reflection_sums,
+)
 from dials.array_family import flex
 from dials.command_line.compute_delta_cchalf import phil_scope
 
@@ -116,3 +125,43 @@ def mock_algorithm(*_):
         assert script.results_summary["dataset_removal"][
             "experiments_fully_removed"
         ] == ["0"]
+
+
+def test_per_group_cchalf_statistics():
+    """Compare the ΔCC½ with a direct calculation excluding each group."""
+    random.seed(0)
+    unit_cell = uctbx.unit_cell((10, 11, 12, 90, 90, 90))
+    space_group = sgtbx.space_group_info("P222").group()
+    indices = [(h, k, l) for h in range(1, 5) for k in range(4) for l in range(4)]
+    table = flex.reflection_table()
+    table["miller_index"] = flex.miller_index(
+        [random.choice(indices) for _ in range(1000)]
+    )
+    table["intensity"] = flex.double([random.gauss(100, 10) for _ in range(1000)])
+    table["variance"] = flex.double(1000, 1.0)
+    table["dataset"] = flex.int(1000, 0)
+    table["group"] = flex.int([random.randint(0, 9) for _ in range(1000)])
+
+    statistics = PerGroupCChalfStatistics(table, unit_cell, space_group, n_bins=3)
+    statistics.run()
+
+    def reflection_sums(table):
+        sums = {}
+        for h, i in zip(table["miller_index"], table["intensity"]):
+            s = sums.setdefault(h, ReflectionSum())
+            s.sum_x += i
+            s.sum_x2 += i ** 2
+            s.n += 1
+        return sums
+
+    table = statistics.reflection_table
+    assert statistics.mean_cchalf() == pytest.approx(
+        compute_cchalf_from_reflection_sums(reflection_sums(table), statistics.binner)
+    )
+    cchalf_i = statistics.cchalf_i()
+    assert sorted(cchalf_i) == list(range(10))
+    for group, cchalf in cchalf_i.items():
+        expected = compute_cchalf_from_reflection_sums(
+            reflection_sums(table.select(table["group"] != group)), statistics.binner
+        )
+        assert cchalf == pytest.approx(expected)
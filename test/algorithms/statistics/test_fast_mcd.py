@@ -64,6 +64,21 @@ def test_maha():
     assert approx_equal(list(maha), R_result)
 
 
+def test_cov():
+    from libtbx.test_utils import approx_equal
+    from scitbx.array_family import flex
+
+    from dials.algorithms.statistics.fast_mcd import cov, sample_covariance
+
+    flex.set_random_seed(42)
+    cols = [flex.random_double(50) for _ in range(4)]
+    covmat = cov(*cols)
+    assert covmat.all() == (4, 4)
+    for i in range(4):
+        for j in range(4):
+            assert approx_equal(covmat[i, j], sample_covariance(cols[i], cols[j]))
+
+
 def test_fast_mcd_small():
     # set random seeds to try to avoid assertion errors due to occasionally
     # finding less common solutions
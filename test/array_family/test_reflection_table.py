@@ -637,6 +637,35 @@ def test_sort():
         (2, 4, 2),
     ]
 
+    # Sort by several keys, including a single component of a vector column
+    table["d"] = flex.int([1, 0, 1, 0, 1, 0])
+    table.sort(["d", ("c", 2), "a"], reverse=[False, True, False])
+    assert list(table["d"]) == [0, 0, 0, 1, 1, 1]
+    assert list(table["c"]) == [
+        (2, 4, 2),
+        (1, 1, 2),
+        (2, 1, 1),
+        (3, 2, 1),
+        (3, 1, 1),
+        (1, 1, 1),
+    ]
+    assert list(table["a"]) == [3, 6, 1, 2, 4, 5]
+    perm = table.sort_permutation(["d", "c"])
+    assert list(perm) == [1, 2, 0, 5, 4, 3]
+
+    table["m"] = flex.mat3_double([(i % 2, 0, 0, 0, 0, 0, 0, 0, -i) for i in range(6)])
+    table.sort("m")
+    assert [m[0] for m in table["m"]] == [0, 0, 0, 1, 1, 1]
+    assert [m[8] for m in table["m"]] == [-4, -2, 0, -5, -3, -1]
+
+    # Subsort within the blocks of an already sorted column
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 0, 0, 1, 1])
+    table["panel"] = flex.size_t([2, 0, 1, 1, 0])
+    table.subsort("id", "panel")
+    assert list(table["id"]) == [0, 0, 0, 1, 1]
+    assert list(table["panel"]) == [0, 1, 2, 0, 1]
+
 
 def test_flags():
     # Create a table with flags all 0
@@ -848,6 +877,44 @@ def get_mask(self, index):
                         assert m1 == 0
 
 
+def test_match_with_reference():
+    predicted = flex.reflection_table()
+    predicted["miller_index"] = flex.miller_index(
+        [(1, 0, 0), (1, 0, 0), (2, 0, 0), (3, 0, 0), (2, 0, 0)]
+    )
+    predicted["entering"] = flex.bool([True, True, False, True, False])
+    predicted["id"] = flex.int(5, 0)
+    predicted["panel"] = flex.size_t([0, 0, 0, 0, 1])
+    predicted["xyzcal.px"] = flex.vec3_double(
+        [(10, 10, 1), (50, 50, 1), (20, 20, 2), (30, 30, 3), (20, 20, 2)]
+    )
+    predicted["flags"] = flex.size_t(5, 0)
+
+    observed = flex.reflection_table()
+    observed["miller_index"] = flex.miller_index(
+        [(1, 0, 0), (1, 0, 0), (2, 0, 0), (2, 0, 0), (5, 0, 0)]
+    )
+    observed["entering"] = flex.bool([True, True, False, False, True])
+    observed["id"] = flex.int(5, 0)
+    observed["panel"] = flex.size_t([0, 0, 0, 1, 0])
+    observed["xyzcal.px"] = flex.vec3_double(
+        [(50.5, 50, 1), (11, 10, 1), (21, 20, 2), (25, 20, 2), (0, 0, 0)]
+    )
+    observed["flags"] = flex.size_t(5, predicted.flags.strong)
+
+    # The first two predictions are matched to their nearest observations
+    sind, oind = predicted.match_with_reference_indices(observed)
+    assert list(sind) == [0, 1, 2, 4]
+    assert list(oind) == [1, 0, 2, 3]
+
+    mask, matched, unmatched = predicted.match_with_reference(observed)
+    assert list(mask) == [True, True, True, False, False]
+    assert list(matched["xyzcal.px"]) == [(10, 10, 1), (50, 50, 1), (20, 20, 2)]
+    assert list(unmatched["panel"]) == [1, 0]
+    assert list(predicted.get_flags(predicted.flags.reference_spot)) == list(mask)
+    assert predicted.get_flags(predicted.flags.strong).count(True) == 4
+
+
 def test_split_by_experiment_id():
     r = flex.reflection_table()
     r["id"] = flex.int()
@@ -897,6 +964,42 @@ def test_split_indices_by_experiment_id():
         assert r.select(index)["id"].count(exp) == num
 
 
+def test_experiment_partition():
+    r = flex.reflection_table()
+    r["id"] = flex.int([2, 0, -1, 2, 5, 0, 2])
+    r["x"] = flex.double(range(7))
+
+    partition = r.experiment_partition()
+    assert partition.ids == [-1, 0, 2, 5]
+    assert list(partition.indices(2)) == [0, 3, 6]
+    assert partition.count(0) == 2
+    assert partition.count(3) == 0
+    assert len(partition.indices(3)) == 0
+
+    # The partition is cached until the id column changes
+    assert r.experiment_partition() is partition
+    r["id"][1] = 5
+    partition = r.experiment_partition()
+    assert list(partition.indices(5)) == [1, 4]
+    r["id"] = flex.int(7, 1)
+    assert r.experiment_partition().ids == [1]
+
+    r["id"] = flex.int([2, 0, -1, 2, 5, 0, 2])
+    result = list(r.iter_experiments())
+    assert [i for i, _ in result] == [0, 2, 5]
+    assert [list(t["x"]) for _, t in result] == [[1, 5], [0, 3, 6], [4]]
+
+    selected = r.select_experiments([5, 0])
+    assert list(selected["x"]) == [1, 4, 5]
+    assert len(r.select_experiments([])) == 0
+
+    # Empty table
+    r = flex.reflection_table()
+    r["id"] = flex.int()
+    assert r.experiment_partition().ids == []
+    assert list(r.iter_experiments()) == []
+
+
 def test_split_partials():
     r = flex.reflection_table()
     r["value1"] = flex.double()
@@ -1179,6 +1282,167 @@ def compare(a, b):
     assert all(tuple(compare(a, b) for a, b in zip(new_table["col11"], c11)))
 
 
+def test_to_from_columnar_file(tmpdir, monkeypatch):
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 1] * 5)
+    table["miller_index"] = flex.miller_index([(i, i + 1, i + 2) for i in range(10)])
+    table["intensity.sum.value"] = flex.double(range(10))
+    table["flags"] = flex.size_t(range(10))
+    table.experiment_identifiers()[0] = "abcd"
+    table.experiment_identifiers()[1] = "efgh"
+
+    # Use a small row group size so that reads span several row groups
+    filename = tmpdir.join("reflections.refl").strpath
+    table.as_columnar_file(filename, row_group_size=3)
+
+    new_table = flex.reflection_table.from_columnar_file(filename)
+    assert new_table.is_consistent()
+    assert new_table.nrows() == 10
+    assert sorted(new_table.keys()) == sorted(table.keys())
+    assert list(new_table["miller_index"]) == list(table["miller_index"])
+    assert list(new_table["intensity.sum.value"]) == list(table["intensity.sum.value"])
+    assert dict(new_table.experiment_identifiers()) == {0: "abcd", 1: "efgh"}
+
+    new_table = flex.reflection_table.from_columnar_file(
+        filename, columns=["intensity.sum.value"], rows=(2, 8)
+    )
+    assert list(new_table.keys()) == ["intensity.sum.value"]
+    assert list(new_table["intensity.sum.value"]) == list(range(2, 8))
+
+    new_table = flex.reflection_table.from_columnar_file(filename, rows=(4, 4))
+    assert new_table.nrows() == 0
+    assert sorted(new_table.keys()) == sorted(table.keys())
+
+    with pytest.raises(KeyError):
+        flex.reflection_table.from_columnar_file(filename, columns=["missing"])
+
+    # An empty table keeps its columns
+    empty_filename = tmpdir.join("empty.refl").strpath
+    table[:0].as_columnar_file(empty_filename)
+    new_table = flex.reflection_table.from_columnar_file(empty_filename)
+    assert new_table.nrows() == 0
+    assert sorted(new_table.keys()) == sorted(table.keys())
+
+    # from_file detects the format, and as_file writes it on request
+    monkeypatch.setenv("DIALS_USE_COLUMNAR", "1")
+    table.as_file(filename)
+    new_table = flex.reflection_table.from_file(filename)
+    assert list(new_table["id"]) == list(table["id"])
+
+
+def test_columnar_file_writer(tmpdir):
+    from dials.array_family.columnar import ColumnarFileWriter
+
+    tables = []
+    for i, n in enumerate((4, 0, 3)):
+        table = flex.reflection_table()
+        table["id"] = flex.int(n, i)
+        table["intensity.sum.value"] = flex.double(range(n))
+        table.experiment_identifiers()[i] = "expt%d" % i
+        tables.append(table)
+
+    # The tables are appended one at a time
+    filename = tmpdir.join("reflections.refl").strpath
+    with ColumnarFileWriter(filename, row_group_size=3) as writer:
+        for table in tables:
+            writer.write(table)
+        assert writer.nrows == 7
+    new_table = flex.reflection_table.from_file(filename)
+    assert list(new_table["id"]) == [0, 0, 0, 0, 2, 2, 2]
+    assert list(new_table["intensity.sum.value"]) == [0, 1, 2, 3, 0, 1, 2]
+    assert dict(new_table.experiment_identifiers()) == {
+        0: "expt0",
+        1: "expt1",
+        2: "expt2",
+    }
+
+    # Tables with different columns are merged as by extend()
+    del tables[0]["intensity.sum.value"]
+    tables[2]["xyzobs.px.value"] = flex.vec3_double(3, (1, 2, 3))
+    with ColumnarFileWriter(filename, row_group_size=3) as writer:
+        for table in tables:
+            writer.write(table)
+    expected = flex.reflection_table()
+    for table in tables:
+        expected.extend(table)
+    new_table = flex.reflection_table.from_file(filename)
+    assert sorted(new_table.keys()) == sorted(expected.keys())
+    for key in expected.keys():
+        assert list(new_table[key]) == list(expected[key])
+    where = [flex.reflection_table_selector("intensity.sum.value", ">", 0.5)]
+    new_table = flex.reflection_table.from_file(filename, where=where)
+    assert list(new_table["id"]) == [2, 2]
+
+    # A file closed without writing any tables reads as an empty table
+    with ColumnarFileWriter(filename):
+        pass
+    new_table = flex.reflection_table.from_file(filename)
+    assert new_table.size() == 0
+    assert not new_table.keys()
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_from_file_columns_where(tmpdir, columnar):
+    table = flex.reflection_table()
+    table["id"] = flex.int([0, 1] * 5)
+    table["miller_index"] = flex.miller_index([(i, i + 1, i + 2) for i in range(10)])
+    table["intensity.sum.value"] = flex.double(range(10))
+    table["intensity.sum.variance"] = flex.double(10, 1)
+    table["flags"] = flex.size_t(10, 0)
+    table.set_flags(flex.bool([True, False] * 5), table.flags.integrated_sum)
+    table.experiment_identifiers()[0] = "abcd"
+    table.experiment_identifiers()[1] = "efgh"
+
+    filename = tmpdir.join("reflections.refl").strpath
+    if columnar:
+        table.as_columnar_file(filename, row_group_size=3)
+    else:
+        table.as_msgpack_file(filename)
+
+    new_table = flex.reflection_table.from_file(
+        filename, columns=["miller_index", "intensity.sum.value"]
+    )
+    assert sorted(new_table.keys()) == ["intensity.sum.value", "miller_index"]
+    assert new_table.nrows() == 10
+    assert list(new_table["miller_index"]) == list(table["miller_index"])
+
+    with pytest.raises(KeyError):
+        flex.reflection_table.from_file(filename, columns=["missing"])
+
+    # Select on id and flags, without keeping the selection columns
+    where = [
+        flex.reflection_table_selector("id", "==", 0),
+        flex.reflection_table_selector("flags", "==", table.flags.integrated_sum),
+        flex.reflection_table_selector("intensity.sum.i_over_sigma", ">", 3),
+    ]
+    new_table = flex.reflection_table.from_file(
+        filename, columns=["intensity.sum.value"], where=where
+    )
+    assert list(new_table.keys()) == ["intensity.sum.value"]
+    assert list(new_table["intensity.sum.value"]) == [4, 6, 8]
+    assert dict(new_table.experiment_identifiers()) == {0: "abcd", 1: "efgh"}
+
+    new_table = flex.reflection_table.from_file(filename, where=where[:1])
+    assert sorted(new_table.keys()) == sorted(table.keys())
+    assert list(new_table["intensity.sum.value"]) == [0, 2, 4, 6, 8]
+
+    # Read all but the excluded columns, which may be used in the selection
+    new_table = flex.reflection_table.from_file(
+        filename, where=where[:1], exclude_columns=["id", "shoebox"]
+    )
+    assert sorted(new_table.keys()) == sorted(k for k in table.keys() if k != "id")
+    assert list(new_table["intensity.sum.value"]) == [0, 2, 4, 6, 8]
+    new_table = flex.reflection_table.from_file(
+        filename, exclude_columns=["flags", "miller_index"]
+    )
+    assert sorted(new_table.keys()) == [
+        "id",
+        "intensity.sum.value",
+        "intensity.sum.variance",
+    ]
+    assert new_table.nrows() == 10
+
+
 def test_experiment_identifiers():
     from dxtbx.model import Experiment, ExperimentList
 
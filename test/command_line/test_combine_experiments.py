@@ -424,3 +424,27 @@ def test_failed_tolerance_error(dials_regression, monkeypatch):
         script.run_with_preparsed(params, options)
     assert "Beam" in str(exc.value)
     print("Got (expected) error message:", exc.value)
+
+
+def test_select_experiments_by_identifier():
+    from dxtbx.model import Experiment, ExperimentList
+
+    reflections = flex.reflection_table()
+    reflections["id"] = flex.int([2, 0, 3, 1, 2, 0, 3, 2])
+    reflections["intensity.sum.value"] = flex.double(range(8))
+    experiments = ExperimentList()
+    for i in range(4):
+        reflections.experiment_identifiers()[i] = "expt%d" % i
+        experiments.append(Experiment(identifier="expt%d" % i))
+
+    subset = ExperimentList([experiments[0], experiments[2], experiments[3]])
+    selected = combine_experiments.select_experiments_by_identifier(reflections, subset)
+    expected = reflections.select(subset)
+    expected.reset_ids()
+    assert list(selected["id"]) == list(expected["id"]) == [0, 0, 1, 1, 1, 2, 2]
+    assert list(selected["intensity.sum.value"]) == list(
+        expected["intensity.sum.value"]
+    )
+    assert dict(selected.experiment_identifiers()) == dict(
+        expected.experiment_identifiers()
+    )
@@ -1,6 +1,7 @@
 from __future__ import absolute_import, division, print_function
 
 import procrunner
+import six.moves.cPickle as pickle
 
 
 def test(dials_data, tmpdir):
@@ -35,3 +36,28 @@ def test(dials_data, tmpdir):
     assert (
         b"Found 8 hot pixels" in result.stdout or b"Found 9 hot pixels" in result.stdout
     )
+
+    # Merge with the mask from a previous run, with one more hot pixel
+    with tmpdir.join("hot_pixels.mask").open("rb") as f:
+        mask = pickle.load(f)
+    hot = set((~mask[0]).as_1d().iselection())
+    assert len(hot) in (8, 9)
+    mask[0][0] = False
+    with tmpdir.join("previous.mask").open("wb") as f:
+        pickle.dump(mask, f)
+    result = procrunner.run(
+        [
+            "dials.find_hot_pixels",
+            "input.experiments=spotfinder.expt",
+            "input.reflections=spotfinder.refl",
+            "input.mask=previous.mask",
+            "output.mask=merged.mask",
+        ],
+        working_directory=tmpdir,
+    )
+    assert not result.returncode and not result.stderr
+    with tmpdir.join("merged.mask").open("rb") as f:
+        merged = pickle.load(f)
+    assert len(merged) == 1
+    assert merged[0].all() == mask[0].all()
+    assert set((~merged[0]).as_1d().iselection()) == hot | {0}
@@ -46,6 +46,58 @@ def test_find_spots_from_images(dials_data, tmpdir):
     )
 
 
+def test_find_spots_from_images_with_prefetch(dials_data, tmpdir):
+    result = procrunner.run(
+        [
+            "dials.find_spots",
+            "nproc=2",
+            "mp.prefetch=3",
+            "output.reflections=spotfinder.refl",
+            "output.shoeboxes=True",
+            "algorithm=dispersion",
+        ]
+        + [
+            f.strpath for f in dials_data("centroid_test_data").listdir("centroid*.cbf")
+        ],
+        working_directory=tmpdir.strpath,
+    )
+    assert not result.returncode and not result.stderr
+    assert b"frames/s" in result.stdout
+
+    reflections = flex.reflection_table.from_file(tmpdir / "spotfinder.refl")
+    _check_expected_results(reflections)
+
+
+def test_find_spots_2d_no_shoeboxes_with_prefetch(dials_data, tmpdir):
+    tables = []
+    for prefetch in (0, 3):
+        result = procrunner.run(
+            [
+                "dials.find_spots",
+                "nproc=2",
+                "mp.prefetch=%d" % prefetch,
+                "force_2d=True",
+                "output.reflections=spotfinder_%d.refl" % prefetch,
+                "output.shoeboxes=False",
+                "algorithm=dispersion",
+            ]
+            + [
+                f.strpath
+                for f in dials_data("centroid_test_data").listdir("centroid*.cbf")
+            ],
+            working_directory=tmpdir.strpath,
+        )
+        assert not result.returncode and not result.stderr
+        tables.append(
+            flex.reflection_table.from_file(tmpdir / ("spotfinder_%d.refl" % prefetch))
+        )
+
+    assert tables[0].size() == tables[1].size()
+    assert list(tables[0]["xyzobs.px.value"].as_double()) == pytest.approx(
+        list(tables[1]["xyzobs.px.value"].as_double())
+    )
+
+
 def test_find_spots_from_images_override_maximum(dials_data, tmpdir):
     result = procrunner.run(
         [
@@ -256,6 +308,40 @@ def test_find_spots_with_hot_mask_with_prefix(dials_data, tmpdir):
     assert mask[0].count(False) == 12
 
 
+def test_find_spots_merge_hot_mask(dials_data, tmpdir):
+    images = [
+        f.strpath for f in dials_data("centroid_test_data").listdir("centroid*.cbf")
+    ]
+    args = [
+        "dials.find_spots",
+        "nproc=1",
+        "write_hot_mask=True",
+        "output.shoeboxes=False",
+        "algorithm=dispersion",
+    ]
+    result = procrunner.run(args + images, working_directory=tmpdir.strpath)
+    assert not result.returncode and not result.stderr
+    with tmpdir.join("hot_mask_0.pickle").open("rb") as f:
+        mask = pickle.load(f)
+    hot = set((~mask[0]).as_1d().iselection())
+    assert len(hot) == 12
+
+    # Merge with the mask from a previous run, with one more hot pixel
+    mask[0][0] = False
+    with tmpdir.join("previous.pickle").open("wb") as f:
+        pickle.dump(mask, f)
+    result = procrunner.run(
+        args + ["hot_mask_prefix=merged", "merge_hot_mask=previous.pickle"] + images,
+        working_directory=tmpdir.strpath,
+    )
+    assert not result.returncode and not result.stderr
+    with tmpdir.join("merged_0.pickle").open("rb") as f:
+        merged = pickle.load(f)
+    assert len(merged) == 1
+    assert merged[0].all() == mask[0].all()
+    assert set((~merged[0]).as_1d().iselection()) == hot | {0}
+
+
 def test_find_spots_with_generous_parameters(dials_data, tmpdir):
     # now with more generous parameters
     result = procrunner.run(
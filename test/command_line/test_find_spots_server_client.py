@@ -1,3 +1,4 @@
+import json
 import socket
 import subprocess
 import sys
@@ -37,6 +38,28 @@ def test_server_return_codes(dials_data, server):
         urllib.request.urlopen(f"http://127.0.0.1:{server}/some/junk/filename")
 
 
+def test_server_batch_and_metrics(dials_data, server):
+    filenames = [
+        f.strpath for f in dials_data("centroid_test_data").listdir("*.cbf", sort=True)
+    ][:3]
+    request = urllib.request.Request(
+        f"http://127.0.0.1:{server}/",
+        data=json.dumps({"filenames": filenames, "params": ["nproc=1"]}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    response = urllib.request.urlopen(request)
+    assert response.code == 200
+    results = json.loads(response.read())
+    assert [d["image"] for d in results] == filenames
+    assert all("n_spots_total" in d and "time_taken" in d for d in results)
+
+    response = urllib.request.urlopen(f"http://127.0.0.1:{server}/metrics")
+    metrics = json.loads(response.read())
+    assert metrics["n_images"] >= 3
+    assert metrics["n_requests"] >= 1
+    assert metrics["n_errors"] == 0
+
+
 def test_find_spots_server_client(dials_data, tmp_path, server):
     filenames = [
         f.strpath for f in dials_data("centroid_test_data").listdir("*.cbf", sort=True)
@@ -4,6 +4,8 @@
 import math
 import os
 import shutil
+import sys
+
 import pytest
 
 import procrunner
@@ -164,6 +166,76 @@ def test_basic_threaded_integrate(dials_data, tmp_path):
     assert table.select(table["id"] == 0).size() == 4204
 
 
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="Requires shared memory")
+def test_integrate_shared_image_cache(dials_data, tmp_path):
+    """Test that integration with the shared image cache gives the same result."""
+    expts = dials_data("centroid_test_data") / "indexed.expt"
+    refls = dials_data("centroid_test_data") / "indexed.refl"
+
+    tables = []
+    for shared_image_cache in (False, True):
+        working_directory = tmp_path / str(shared_image_cache)
+        working_directory.mkdir()
+        result = procrunner.run(
+            [
+                "dials.integrate",
+                "mp.nproc=2",
+                "mp.shared_image_cache=%s" % shared_image_cache,
+                "block.size=2",
+                "block.units=frames",
+                refls,
+                expts,
+            ],
+            working_directory=working_directory,
+        )
+        # Nothing, e.g. the resource tracker, should complain about the segments
+        assert not result.returncode and not result.stderr
+        tables.append(
+            flex.reflection_table.from_file(working_directory / "integrated.refl")
+        )
+
+    assert tables[0].size() == tables[1].size()
+    assert list(tables[0]["miller_index"]) == list(tables[1]["miller_index"])
+    assert list(tables[0]["intensity.sum.value"]) == pytest.approx(
+        list(tables[1]["intensity.sum.value"])
+    )
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="Requires shared memory")
+def test_integrate_shared_memory_transport(dials_data, tmp_path):
+    """Test that passing the reflections through shared memory gives the same result."""
+    expts = dials_data("centroid_test_data") / "indexed.expt"
+    refls = dials_data("centroid_test_data") / "indexed.refl"
+
+    tables = []
+    for transport in ("pickle", "shared_memory"):
+        working_directory = tmp_path / transport
+        working_directory.mkdir()
+        result = procrunner.run(
+            [
+                "dials.integrate",
+                "mp.nproc=2",
+                "mp.transport=%s" % transport,
+                "block.size=2",
+                "block.units=frames",
+                refls,
+                expts,
+            ],
+            working_directory=working_directory,
+        )
+        # Nothing, e.g. the resource tracker, should complain about the segments
+        assert not result.returncode and not result.stderr
+        tables.append(
+            flex.reflection_table.from_file(working_directory / "integrated.refl")
+        )
+
+    assert tables[0].size() == tables[1].size()
+    assert list(tables[0]["miller_index"]) == list(tables[1]["miller_index"])
+    assert list(tables[0]["intensity.sum.value"]) == pytest.approx(
+        list(tables[1]["intensity.sum.value"])
+    )
+
+
 def test_basic_integrate_output_integrated_only(dials_data, tmpdir):
 
     exp = load.experiment_list(
@@ -11,7 +11,8 @@
 from dials.command_line import refine_bravais_settings
 
 
-def test_refine_bravais_settings_i04_weak_data(dials_regression, tmpdir):
+@pytest.mark.parametrize("nproc", [1, 2])
+def test_refine_bravais_settings_i04_weak_data(dials_regression, tmpdir, nproc):
     data_dir = os.path.join(dials_regression, "indexing_test_data", "i04_weak_data")
     pickle_path = os.path.join(data_dir, "indexed.pickle")
     experiments_path = os.path.join(data_dir, "experiments.json")
@@ -25,6 +26,7 @@ def test_refine_bravais_settings_i04_weak_data(dials_regression, tmpdir):
                 "beam.fix=all",
                 "detector.fix=all",
                 "prefix=tst_",
+                "nproc=%i" % nproc,
             ]
         )
     for i in range(1, 10):
@@ -31,3 +31,19 @@ def test_report_scaled_data(dials_data, tmpdir):
     )
     assert not result.returncode and not result.stderr
     assert tmpdir.join("dials.report.html").check()
+
+
+def test_report_integrated_data_nproc(dials_data, tmpdir):
+    """Test that dials.report completes when running the analyses in parallel."""
+
+    result = procrunner.run(
+        [
+            "dials.report",
+            dials_data("l_cysteine_dials_output") / "20_integrated_experiments.json",
+            dials_data("l_cysteine_dials_output") / "20_integrated.pickle",
+            "nproc=2",
+        ],
+        working_directory=tmpdir,
+    )
+    assert not result.returncode and not result.stderr
+    assert tmpdir.join("dials.report.html").check()
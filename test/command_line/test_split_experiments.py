@@ -64,6 +64,48 @@ def test_split_chunk_sizes(tmpdir, option, with_identifiers):
         refls.assert_experiment_identifiers_are_consistent(expts)
 
 
+@pytest.mark.parametrize("nproc", [1, 3])
+def test_split_each_experiment(tmpdir, nproc):
+    """Test writing one pair of files per experiment, serially and in parallel"""
+    ids = [3, 0, 2, 1, 3, 0, 4]
+    experiments = ExperimentList()
+    reflections = flex.reflection_table()
+    reflections["id"] = flex.int(ids)
+    reflections["intensity"] = flex.double([(i + 1) * 100.0 for i in range(7)])
+    for i in range(5):
+        exp = generate_exp()
+        exp.identifier = str(i)
+        reflections.experiment_identifiers()[i] = str(i)
+        experiments.append(exp)
+
+    experiments.as_json(tmpdir.join("tmp.expt").strpath)
+    reflections.as_file(tmpdir.join("tmp.refl").strpath)
+
+    result = procrunner.run(
+        [
+            "dials.split_experiments",
+            tmpdir.join("tmp.expt").strpath,
+            tmpdir.join("tmp.refl").strpath,
+            "nproc=%i" % nproc,
+        ],
+        working_directory=tmpdir,
+    )
+    assert not result.returncode and not result.stderr
+
+    for j, intensities in enumerate(
+        [[200.0, 600.0], [400.0], [300.0], [100.0, 500.0], [700.0]]
+    ):
+        expts = load.experiment_list(
+            tmpdir.join("split_%s.expt" % j), check_format=False
+        )
+        assert len(expts) == 1
+        assert expts[0].identifier == str(j)
+        refls = flex.reflection_table.from_file(tmpdir.join("split_%s.refl" % j))
+        assert list(refls["id"]) == [0] * len(intensities)
+        assert list(refls["intensity"]) == intensities
+        refls.assert_experiment_identifiers_are_consistent(expts)
+
+
 def test_split_by_wavelength(tmpdir):
     """Test the split_by_wavelength option of dials.split_experiments"""
     experiments = ExperimentList()
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function
 
+import glob
 import os
 
 import pytest
@@ -12,7 +13,12 @@
 from libtbx.phil import parse
 
 from dials.array_family import flex
-from dials.command_line.stills_process import Processor, phil_scope
+from dials.command_line.stills_process import (
+    Processor,
+    chunk_filename,
+    merge_composite_chunks,
+    phil_scope,
+)
 
 cspad_cbf_in_memory_phil = """
 dispatch.squash_errors = False
@@ -160,3 +166,114 @@ def test_refl_table(result_filename, ranges):
             list(range(490, 515)),
         ],
     )
+
+
+@pytest.mark.parametrize("process_percent, expected_images", [(None, 4), (50, 2)])
+def test_sacla_h5_multiprocessing(
+    dials_regression, run_in_tmpdir, process_percent, expected_images
+):
+    sacla_path = os.path.join(dials_regression, "image_examples", "SACLA_MPCCD_Cheetah")
+    image_path = os.path.join(sacla_path, "run266702-0-subset.h5")
+    assert os.path.isfile(image_path)
+
+    geometry_path = os.path.join(sacla_path, "refined_experiments_level1.json")
+    assert os.path.isfile(geometry_path)
+
+    with open("process_sacla.phil", "w") as f:
+        f.write(sacla_phil % geometry_path)
+
+    command = [
+        "dials.stills_process",
+        "mp.nproc=2",
+        image_path,
+        "process_sacla.phil",
+    ]
+    if process_percent:
+        command.append("dispatch.process_percent=%d" % process_percent)
+    result = easy_run.fully_buffered(command).raise_if_errors()
+    result.show_stdout()
+    assert not any("Some processes failed" in line for line in result.stdout_lines)
+
+    # The images are shared between the composite output of the two workers
+    n_images = 0
+    for filename in glob.glob("idx-000?_integrated.refl"):
+        table = flex.reflection_table.from_file(filename)
+        n_images += len(set(table["id"]))
+    assert n_images == expected_images
+
+    with open("dials.process.log") as f:
+        assert "Time spent in each processing stage" in f.read()
+
+
+def test_sacla_h5_composite_flush_interval(dials_regression, run_in_tmpdir):
+    sacla_path = os.path.join(dials_regression, "image_examples", "SACLA_MPCCD_Cheetah")
+    image_path = os.path.join(sacla_path, "run266702-0-subset.h5")
+    assert os.path.isfile(image_path)
+
+    geometry_path = os.path.join(sacla_path, "refined_experiments_level1.json")
+    assert os.path.isfile(geometry_path)
+
+    with open("process_sacla.phil", "w") as f:
+        f.write(sacla_phil % geometry_path)
+
+    command = [
+        "dials.stills_process",
+        "output.composite_flush_interval=1",
+        image_path,
+        "process_sacla.phil",
+    ]
+    result = easy_run.fully_buffered(command).raise_if_errors()
+    result.show_stdout()
+
+    # The chunks written after each image are merged into the composite files
+    assert not glob.glob("idx-0000_*.part*")
+    table = flex.reflection_table.from_file("idx-0000_integrated.refl")
+    assert set(table["id"]) == {0, 1, 2, 3}
+    assert list(table.experiment_identifiers().keys()) == [0, 1, 2, 3]
+    experiments = ExperimentListFactory.from_json_file(
+        "idx-0000_integrated.expt", check_format=False
+    )
+    assert len(experiments) == 4
+    assert list(experiments.identifiers()) == list(
+        table.experiment_identifiers().values()
+    )
+
+
+@pytest.mark.parametrize("columnar", [True, False])
+def test_merge_composite_chunks(run_in_tmpdir, columnar):
+    # Chunks with different columns are merged as by extend()
+    tables = []
+    chunks = []
+    for i, n in enumerate((3, 2)):
+        table = flex.reflection_table()
+        table["id"] = flex.int(n, 0)
+        table["intensity.sum.value"] = flex.double(range(n))
+        table.experiment_identifiers()[0] = "expt%d" % i
+        tables.append(table)
+    tables[1]["xyzobs.px.value"] = flex.vec3_double(2, (1, 2, 3))
+    for i, table in enumerate(tables):
+        filename = chunk_filename("merged.refl", i)
+        table.as_file(filename)
+        chunks.append((None, filename))
+
+    merge_composite_chunks(chunks, None, "merged.refl", columnar=columnar)
+    assert not glob.glob("merged.part*")
+    table = flex.reflection_table.from_file("merged.refl")
+    assert list(table["id"]) == [0, 0, 0, 1, 1]
+    assert list(table["intensity.sum.value"]) == [0, 1, 2, 0, 1]
+    assert list(table["xyzobs.px.value"]) == [(0, 0, 0)] * 3 + [(1, 2, 3)] * 2
+    assert dict(table.experiment_identifiers()) == {0: "expt0", 1: "expt1"}
+
+
+def test_merge_composite_chunks_keeps_chunks_on_error(run_in_tmpdir):
+    # The chunks are only removed once the composite file has been written
+    table = flex.reflection_table()
+    table["id"] = flex.int(3, 0)
+    filename = chunk_filename("merged.refl", 0)
+    table.as_file(filename)
+    with open(chunk_filename("merged.refl", 1), "w") as f:
+        f.write("not a reflection file")
+    chunks = [(None, chunk_filename("merged.refl", i)) for i in range(2)]
+    with pytest.raises(Exception):
+        merge_composite_chunks(chunks, None, "merged.refl")
+    assert all(os.path.exists(f) for _, f in chunks)
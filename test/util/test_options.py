@@ -106,3 +106,22 @@ def mock_exp_obj(id_=0):
     assert expts[0].identifier == "0"
     assert expts[1].identifier == "1"
     assert expts[2].identifier == "2"
+
+
+def test_read_shoeboxes(tmp_path):
+    """Test that the shoeboxes are only read if requested."""
+    from dials.array_family import flex
+
+    table = flex.reflection_table()
+    table["id"] = flex.int(3, 0)
+    table["shoebox"] = flex.shoebox(3)
+    filename = str(tmp_path / "reflections.refl")
+    table.as_file(filename)
+
+    for read_shoeboxes in (True, False):
+        parser = OptionParser(read_reflections=True, read_shoeboxes=read_shoeboxes)
+        for args in ([filename], ["input.reflections=%s" % filename]):
+            params, _ = parser.parse_args(args)
+            reflections = flatten_reflections(params.input.reflections)
+            assert ("shoebox" in reflections[0]) == read_shoeboxes
+            assert list(reflections[0]["id"]) == [0, 0, 0]
@@ -171,6 +171,7 @@ def __init__(
         scan_tolerance=None,
         format_kwargs=None,
         load_models=True,
+        read_shoeboxes=True,
     ):
         """
         Parse the arguments. Populates its instance attributes in an intelligent way
@@ -191,6 +192,7 @@ def __init__(
         :param check_format: Check the format when reading images
         :param verbose: True/False print out some stuff
         :param load_models: Whether to load all models for ExperimentLists
+        :param read_shoeboxes: Whether to read the shoeboxes of the reflections
         """
 
         # Initialise output
@@ -221,7 +223,9 @@ def __init__(
 
         # Third try to read reflection files
         if read_reflections:
-            self.unhandled = self.try_read_reflections(self.unhandled, verbose)
+            self.unhandled = self.try_read_reflections(
+                self.unhandled, verbose, read_shoeboxes
+            )
 
     def _handle_converter_error(self, argument, exception, type, validation=False):
         "Record information about errors that occured processing an argument"
@@ -323,13 +327,16 @@ def try_read_experiments(self, args, check_format, verbose):
                 unhandled.append(argument)
         return unhandled
 
-    def try_read_reflections(self, args, verbose):
+    def try_read_reflections(self, args, verbose, read_shoeboxes=True):
         """Try to import reflections.
 
         :param args: The input arguments
         :param verbose: Print verbose output
+        :param read_shoeboxes: Whether to read the shoebox column. If False,
+                               its data is skipped without being decoded.
         :returns: Unhandled arguments
         """
+        exclude_columns = None if read_shoeboxes else ["shoebox"]
         unhandled = []
         for argument in args:
             try:
@@ -338,7 +345,9 @@ def try_read_reflections(self, args, verbose):
                 self.reflections.append(
                     FilenameDataWrapper(
                         filename=argument,
-                        data=flex.reflection_table.from_file(argument),
+                        data=flex.reflection_table.from_file(
+                            argument, exclude_columns=exclude_columns
+                        ),
                     )
                 )
             except pickle_errors:
@@ -365,6 +374,7 @@ def __init__(
         read_reflections=False,
         read_experiments_from_images=False,
         check_format=True,
+        read_shoeboxes=True,
     ):
         """
         Initialise the parser.
@@ -374,6 +384,7 @@ def __init__(
         :param read_reflections: Try to read the reflections
         :param read_experiments_from_images: Try to read the experiments from images
         :param check_format: Check the format when reading images
+        :param read_shoeboxes: Read the shoeboxes of the reflections
         """
         from dials.util.phil import parse
 
@@ -388,6 +399,7 @@ def __init__(
         self._read_reflections = read_reflections
         self._read_experiments_from_images = read_experiments_from_images
         self._check_format = check_format
+        self._read_shoeboxes = read_shoeboxes
 
         # Adopt the input scope
         input_phil_scope = self._generate_input_scope()
@@ -556,6 +568,7 @@ def _is_a_phil_file(filename):
             scan_tolerance=scan_tolerance,
             format_kwargs=format_kwargs,
             load_models=load_models,
+            read_shoeboxes=self._read_shoeboxes,
         )
 
         # Grab a copy of the errors that occured in case the caller wants them
@@ -615,10 +628,11 @@ def _generate_input_scope(self):
             phil_scope = parse(
                 """
         reflections = None
-          .type = reflection_table
+          .type = reflection_table(read_shoeboxes=%r)
           .multiple = True
           .help = "The reflection table file path"
       """
+                % self._read_shoeboxes
             )
             main_scope.adopt_scope(phil_scope)
 
@@ -757,6 +771,7 @@ def __init__(
         read_experiments_from_images=False,
         check_format=True,
         sort_options=False,
+        read_shoeboxes=True,
         **kwargs
     ):
         """
@@ -768,6 +783,9 @@ def __init__(
         :param read_experiments_from_images: Try to read the experiments from images
         :param check_format: Check the format when reading images
         :param sort_options: Show argument sorting options
+        :param read_shoeboxes: Read the shoeboxes of the reflections. Tools that
+                               never use them should set this to False, so that
+                               their data is skipped without being decoded.
         """
 
         # Create the phil parser
@@ -777,6 +795,7 @@ def __init__(
             read_reflections=read_reflections,
             read_experiments_from_images=read_experiments_from_images,
             check_format=check_format,
+            read_shoeboxes=read_shoeboxes,
         )
 
         # Initialise the option parser
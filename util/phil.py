@@ -52,6 +52,9 @@ class ReflectionTableConverters(object):
 
     phil_type = "reflection_table"
 
+    def __init__(self, read_shoeboxes=True):
+        self._read_shoeboxes = read_shoeboxes
+
     def __str__(self):
         return self.phil_type
 
@@ -61,7 +64,12 @@ def from_words(self, words, master):
             return None
         if not os.path.exists(s):
             raise Sorry("File %s does not exist" % s)
-        return FilenameDataWrapper(filename=s, data=flex.reflection_table.from_file(s))
+        return FilenameDataWrapper(
+            filename=s,
+            data=flex.reflection_table.from_file(
+                s, exclude_columns=None if self._read_shoeboxes else ["shoebox"]
+            ),
+        )
 
     def as_words(self, python_object, master):
         if python_object is None: